@@ -1,9 +1,38 @@
 """Initialize Flask app."""
+from importlib import import_module
+from os import getenv
+from threading import Thread
+
+from dotenv import load_dotenv
 from flask import Flask
 
 
+# modules the dashboard imports on first use, see prewarm
+LAZY_MODULES = ("app.scraper", "app.search_index", "app.dashapp.table", "app.dashapp.helpers",
+                "sklearn.feature_extraction.text")
+
+
+def prewarm():
+    """
+    Load what the first searches would otherwise load: the scraping engine, the storage backends
+    (pandas, pyarrow), the analytics stack, the NLTK stopword corpus and the skill dictionary.
+    """
+    try:
+        for name in LAZY_MODULES:
+            import_module(name)
+        from .dashapp.skills import get_automaton
+        from .dashapp.text import get_stop_words
+        get_automaton()
+        get_stop_words()
+    except Exception as err:
+        # whatever wasn't loaded is loaded on first use instead
+        print(f"Error prewarming: " + str(err))
+
+
 def init_app():
     """Construct core Flask application with embedded Dash app."""
+    # settings are read from .env when the app is built, not as a side effect of importing the scraper
+    load_dotenv()
     app = Flask(__name__, instance_relative_config=False)
 
     with app.app_context():
@@ -14,4 +43,9 @@ def init_app():
         from .dashapp.seeker import init_dashboard
         app = init_dashboard(app)
 
-        return app
+    # heavy modules load on first use; APP_PREWARM loads them in the background right away instead,
+    # so a freshly (re)started worker serves requests at once and is warm by the first search
+    if (getenv("APP_PREWARM") or "").lower() in ("1", "true", "yes"):
+        Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+    return app
@@ -0,0 +1,147 @@
+"""
+In-process cache for loaded runs and artifacts derived from them.
+
+Entries are bounded by total (estimated) size in bytes and by age, evicted least recently used
+first. Keys start with the normalized query key so every entry of a query can be dropped when
+a new run of it is saved.
+"""
+
+from collections import OrderedDict
+from os import getenv
+from threading import Lock
+from time import monotonic
+import sys
+
+import pandas as pd
+
+from app.metrics import REGISTRY
+
+
+def estimate_size(value) -> int:
+    """
+    Rough in-memory size of a cached value in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "indptr"):
+        # scipy sparse matrices
+        return int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes: int, ttl: float = None):
+        """
+        :param max_bytes: evict least recently used entries once their total size exceeds this
+        :param ttl: seconds an entry stays valid, None for no expiry
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key) -> None:
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def get(self, key, default=None):
+        """
+        Look up a key, refreshing its recency.
+        :return: cached value, or default on a miss or an expired entry
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and monotonic() - entry[1] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        """
+        Store a value, evicting older entries to stay within max_bytes. Values larger than
+        the whole cache are not stored.
+        """
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, monotonic(), size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() and caching its result on a miss.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, prefix) -> int:
+        """
+        Drop every entry whose (tuple) key starts with prefix.
+        :return: number of entries dropped
+        """
+        with self.lock:
+            stale = [key for key in self.entries if isinstance(key, tuple) and key[:1] == (prefix,)]
+            for key in stale:
+                self._drop(key)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache: hits, misses, hit ratio, evictions, entries and size in bytes.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+                evictions=self.evictions,
+                entries=len(self.entries),
+                size_bytes=self.size,
+                max_bytes=self.max_bytes,
+            )
+
+
+_run_cache = None
+_run_cache_lock = Lock()
+
+
+def get_run_cache() -> LRUCache:
+    """
+    Process-wide cache of loaded runs, bounded by RUN_CACHE_MAX_MB and RUN_CACHE_TTL (seconds).
+    """
+    global _run_cache
+    with _run_cache_lock:
+        if _run_cache is None:
+            ttl = getenv("RUN_CACHE_TTL")
+            _run_cache = LRUCache(max_bytes=int(float(getenv("RUN_CACHE_MAX_MB") or 256) * 1024 * 1024),
+                                  ttl=float(ttl) if ttl else 3600.0)
+            REGISTRY.add_collector("run_cache", _run_cache.stats, counters=("hits", "misses", "evictions"))
+        return _run_cache
@@ -0,0 +1,168 @@
+"""
+Embedded SQLite catalog of every saved run.
+
+Each run's query, pages wanted/got, max-scrape flag, row count, timestamps and file path are
+recorded when it is saved, so freshness and "best run" lookups are single indexed queries
+instead of a directory scan, and retention is applied in one pass.
+"""
+
+from contextlib import closing
+from datetime import datetime
+from os import getenv
+from pathlib import Path
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    query_key TEXT NOT NULL,
+    job TEXT NOT NULL,
+    location TEXT NOT NULL,
+    pages_wanted INTEGER NOT NULL,
+    pages_got INTEGER NOT NULL,
+    max_scrape INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    file_path TEXT NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS runs_by_query ON runs (query_key, finished_at DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def get_data_dir() -> Path:
+    """
+    Root folder runs are saved under, DATA_DIR in the env (defaults to "data").
+    """
+    return Path(getenv("DATA_DIR") or "data")
+
+
+def query_key(job: str, location: str) -> str:
+    """
+    Normalized identifier of a (job, location) query, also used as its folder name.
+    """
+    return f"{job.strip().lower()}-{location.strip().lower()}"
+
+
+def connect(db_path: Path = None) -> sqlite3.Connection:
+    """
+    Open the catalog, creating it (and indexing runs saved before it existed) on first use.
+    :param db_path: catalog file, defaults to <data dir>/catalog.sqlite3
+    :return: sqlite connection with Row factory
+    """
+    data_dir = get_data_dir()
+    db_path = Path(db_path or data_dir / "catalog.sqlite3")
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone() is None:
+        with conn:
+            backfill(conn, data_dir)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled', ?)",
+                         (datetime.now().isoformat(),))
+    return conn
+
+
+def record_run(job: str, location: str, pages_wanted: int, pages_got: int, row_count: int,
+               file_path: str, started_at: datetime = None, finished_at: datetime = None) -> int:
+    """
+    Add a saved run to the catalog.
+    :return: id of the catalog entry
+    """
+    finished_at = finished_at or datetime.now()
+    started_at = started_at or finished_at
+    with closing(connect()) as conn, conn:
+        cursor = conn.execute(
+            "INSERT OR REPLACE INTO runs (query_key, job, location, pages_wanted, pages_got, max_scrape, "
+            "row_count, started_at, finished_at, file_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (query_key(job, location), job.strip(), location.strip(), pages_wanted, pages_got,
+             int(pages_wanted > pages_got), row_count, started_at.timestamp(), finished_at.timestamp(),
+             str(file_path)))
+        return cursor.lastrowid
+
+
+def best_run(job: str, location: str, pages_wanted: int, fresh_after: datetime = None) -> sqlite3.Row:
+    """
+    Most complete fresh run that satisfies the request: either it got at least pages_wanted pages,
+    or it is a max-scrape (the query can't return more).
+    :param fresh_after: runs finished before this are considered stale, None accepts any age
+    :return: catalog row or None
+    """
+    with closing(connect()) as conn:
+        return conn.execute(
+            "SELECT * FROM runs WHERE query_key = ? AND finished_at >= ? AND (max_scrape = 1 OR pages_got >= ?) "
+            "ORDER BY pages_got DESC, finished_at DESC LIMIT 1",
+            (query_key(job, location), fresh_after.timestamp() if fresh_after else 0, pages_wanted)).fetchone()
+
+
+def latest_run(job: str, location: str) -> sqlite3.Row:
+    """
+    Most recently finished run of a query regardless of freshness.
+    :return: catalog row or None
+    """
+    with closing(connect()) as conn:
+        return conn.execute("SELECT * FROM runs WHERE query_key = ? ORDER BY finished_at DESC LIMIT 1",
+                            (query_key(job, location),)).fetchone()
+
+
+def apply_retention(job: str, location: str, keep: int = None) -> int:
+    """
+    Retention policy, applied in one pass: keep the newest `keep` runs of a query (RUNS_TO_KEEP in
+    the env, 5 by default) and delete the files (and artifacts cached next to them) and catalog rows
+    of all the older ones.
+    :return: number of runs removed
+    """
+    keep = keep if keep is not None else int(getenv("RUNS_TO_KEEP") or 5)
+    with closing(connect()) as conn, conn:
+        expired = conn.execute(
+            "SELECT id, file_path FROM runs WHERE query_key = ? ORDER BY finished_at DESC LIMIT -1 OFFSET ?",
+            (query_key(job, location), keep)).fetchall()
+        for run in expired:
+            run_path = Path(run["file_path"])
+            # artifacts cached next to a run are named <run file>.<artifact>
+            for sidecar in run_path.parent.glob(run_path.name + ".*"):
+                sidecar.unlink(missing_ok=True)
+            run_path.unlink(missing_ok=True)
+        conn.executemany("DELETE FROM runs WHERE id = ?", [(run["id"],) for run in expired])
+    return len(expired)
+
+
+def parse_run_name(file_name: str) -> tuple:
+    """
+    Recover (max_scrape, finished_at, pages_got) from a run file name such as
+    maxscrape_24-11-2020_15-37-16_2-pgs.parquet. Only the name is parsed, never the full path.
+    """
+    tag, date_part, time_part, pages_part = file_name.split('.')[0].split('_')[:4]
+    finished_at = datetime.strptime(f"{date_part}_{time_part}", "%d-%m-%Y_%H-%M-%S")
+    return tag == "maxscrape", finished_at, int(pages_part.split('-')[0])
+
+
+def backfill(conn: sqlite3.Connection, data_dir: Path) -> int:
+    """
+    Index runs that were saved before the catalog existed, from their folder and file names.
+    :return: number of runs indexed
+    """
+    import pyarrow.parquet as pq
+    indexed = 0
+    for file_path in Path(data_dir).glob("*/*.parquet"):
+        try:
+            max_scrape, finished_at, pages_got = parse_run_name(file_path.name)
+            row_count = pq.ParquetFile(file_path).metadata.num_rows
+        except Exception as err:
+            print(f"Skipping unrecognised run file {file_path}: " + str(err))
+            continue
+        # the original job/location casing is lost, the folder name is the normalized query key
+        folder = file_path.parent.name
+        job, _, location = folder.rpartition('-')
+        conn.execute(
+            "INSERT OR IGNORE INTO runs (query_key, job, location, pages_wanted, pages_got, max_scrape, "
+            "row_count, started_at, finished_at, file_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (folder, job, location, pages_got + int(max_scrape), pages_got, int(max_scrape), row_count,
+             finished_at.timestamp(), finished_at.timestamp(), str(file_path)))
+        indexed += 1
+    return indexed
@@ -1,72 +1,117 @@
-from nltk import ngrams
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.tokenize import RegexpTokenizer
-import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
+from pathlib import Path
+
+from app.cache import get_run_cache
+from .skills import LANGUAGE, TECH
+from .summary import build_summary, load_summary
+from .table import view_rows
+from .text import build_doc_term_matrix, load_doc_term_matrix
 
 
 def format_data(pd_df):
-    tokenizer = RegexpTokenizer(r'\w+')
-    stop_words = stopwords.words('english')
-    # clean description data
-    # step 1: lowercase
-    pd_df["lower_desc"] = pd_df.job_description.str.lower()
-    # step 2: remove \n
-    pd_df["repl_newline"] = pd_df.lower_desc.replace("\\n", "")
-    # step 3: remove punctuations and tokenize
-    pd_df["tokenize"] = pd_df.apply(lambda row: tokenizer.tokenize(row['repl_newline']), axis=1)
-    # step 4: remove stopwords
-    pd_df['stopwords_removed'] = pd_df['tokenize'].apply(lambda x: [item for item in x if item not in stop_words])
-    # step 5: merge tokens back into string text
-    pd_df['clean_data'] = [" ".join(txt) for txt in pd_df["stopwords_removed"].values]
-    # step 6: create bigrams
-    pd_df["bigrams"] = pd_df["stopwords_removed"].apply(lambda row: list(ngrams(row, 2)))
-
-    cv = CountVectorizer()
-    cv.fit_transform(pd_df["clean_data"])
-    print(len(cv.vocabulary_))
-
-
-def get_most_popular_tech(pd_df):
+    """
+    Clean job descriptions (lowercase, tokenize, drop stopwords) into a sparse unigram + bigram
+    document-term matrix. For a stored run the matrix is cached next to the run file and in-process.
+    :param pd_df: jobs data-frame, as returned by initialize
+    :return: text.DocTermMatrix
+    """
+    run_path = pd_df.attrs.get('run_path')
+    if run_path is None:
+        return build_doc_term_matrix(pd_df.job_description)
+    key = (Path(run_path).parent.name, 'dtm', run_path, Path(run_path).stat().st_mtime_ns)
+    return get_run_cache().get_or_load(key, lambda: load_doc_term_matrix(run_path, pd_df.get('job_description')))
+
+
+def get_table_view(pd_df, sort_by: list = None, filter_query: str = None):
+    """
+    Row positions of the jobs table's filtered and sorted view. For a stored run the view is cached
+    in-process, so paging through it only slices.
+    :param pd_df: jobs data-frame, as returned by initialize
+    :param sort_by: DataTable sort_by
+    :param filter_query: DataTable filter_query
+    :return: int array of row positions
+    """
+    run_path = pd_df.attrs.get('run_path')
+    if run_path is None:
+        return view_rows(pd_df, sort_by, filter_query)
+    sort_key = tuple((sort.get('column_id'), sort.get('direction')) for sort in sort_by or ())
+    key = (Path(run_path).parent.name, 'view', run_path, Path(run_path).stat().st_mtime_ns, sort_key,
+           filter_query or '')
+    return get_run_cache().get_or_load(key, lambda: view_rows(pd_df, sort_by, filter_query))
+
+
+def get_run_summary(pd_df):
+    """
+    Precomputed analytics of a run. For a stored run the summary saved next to it is read (or
+    built once if the run predates summaries) and cached in-process; an unsaved frame is summarized
+    from its descriptions.
+    :param pd_df: jobs data-frame, as returned by initialize; a stored run's description column
+                  isn't needed
+    :return: summary.RunSummary
+    """
+    run_path = pd_df.attrs.get('run_path')
+    if run_path is None:
+        return build_summary(pd_df)
+    key = (Path(run_path).parent.name, 'summary', run_path, Path(run_path).stat().st_mtime_ns)
+    return get_run_cache().get_or_load(key, lambda: load_summary(run_path))
+
+
+def get_most_popular_tech(pd_df, top: int = 20):
     """
     Helper to get a consensus of most popular technologies used
 
-    Needs access to job_description mostly
+    Read from the run's summary
     :param pd_df:
-    :return:
+    :param top: number of technologies returned
+    :return: series of postings mentioning each technology, most popular first
     """
-    print(pd_df['job_description'])
+    return get_run_summary(pd_df).popularity(TECH).head(top)
 
 
-def get_most_popular_language(pd_df):
+def get_most_popular_language(pd_df, top: int = 20):
     """
     Helper to get a consensus of most popular languages used
 
-    Needs access to job_description mostly
+    Read from the run's summary
     :param pd_df:
-    :return:
+    :param top: number of languages returned
+    :return: series of postings mentioning each language, most popular first
     """
-    print(pd_df['job_description'])
+    return get_run_summary(pd_df).popularity(LANGUAGE).head(top)
 
 
-def get_skill_to_pay_comparison(pd_df):
+def get_skill_to_pay_comparison(pd_df, min_postings: int = 3):
     """
     Helper to get a consensus of a skill to pay comparison
 
-    Needs access to job_description, salary_base
+    Read from the run's summary. A posting's pay is the midpoint of its yearly range, or its base
+    if no range is given.
     :param pd_df:
-    :return:
+    :param min_postings: skills with fewer postings stating a salary are left out
+    :return: data-frame indexed by skill with postings, median_salary and mean_salary, best paid first
     """
-    print(pd_df['job_description'])
+    return get_run_summary(pd_df).pay_by_skill(min_postings=min_postings)
 
 
-def get_role_spread(pd_df):
+def get_role_spread(pd_df, top: int = 20):
     """
     Helper to get a consensus of most popular roles posted
 
-    Needs access to title
+    Read from the run's summary
+    :param pd_df:
+    :param top: number of roles returned
+    :return: series of postings per role, most common first
+    """
+    return get_run_summary(pd_df).role_spread().head(top)
+
+
+def get_common_phrases(pd_df, top: int = 20):
+    """
+    Helper to get the phrases (bigrams) descriptions use most
+
+    Read from the run's document-term matrix, see format_data; built on first use, as the summary
+    doesn't keep it
     :param pd_df:
-    :return:
+    :param top: number of phrases returned
+    :return: series of mentions of each phrase, most frequent first
     """
-    print(pd_df['job_description'])
+    return format_data(pd_df).term_counts(ngram=2).head(top)
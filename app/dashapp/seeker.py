@@ -1,12 +1,16 @@
+from os import getenv
+
 import dash
 import dash_table
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.exceptions import PreventUpdate
-from app.scraper import initialize
-from .helpers import get_most_popular_tech, format_data
+from app.tasks import get_runner
 from dash.dependencies import Input, Output, State
 
+# the scraping engine, storage (pandas, pyarrow) and analytics stacks are imported by the callbacks
+# that need them, so a worker starts with just Flask and Dash loaded; see app.prewarm
+
 
 def serve_layout():
     return html.Div(id='main', children=[
@@ -24,22 +28,61 @@ def serve_layout():
             html.Br(), html.Br(),
             html.Button("Submit", id="submit-search", n_clicks=0),
             html.Br(), html.Br(),
-            html.Div(id='res-container')
+            html.Div(id='res-container'),
+            dcc.Store(id='search-task'),
+            dcc.Interval(id='task-poll', interval=1000, disabled=True)
         ], style={'padding-top': '20px'}),
         html.Div(id='data-table-container', children=[
-            dash_table.DataTable(id='jobs-table')
+            # rows are paged, sorted and filtered server side, the browser only ever holds one page;
+            # columns and page size come with the first run shown, so the layout needs no storage imports
+            dcc.Store(id='table-run'),
+            dash_table.DataTable(id='jobs-table', columns=[], data=[],
+                                 page_action='custom', page_current=0, page_count=1,
+                                 sort_action='custom', sort_mode='multi', sort_by=[],
+                                 filter_action='custom', filter_query='')
         ]),
+        html.Div(id='posting-search-container', children=[
+            html.Label('Search Postings'),
+            dcc.Input(id='posting-search', type='text', debounce=True,
+                      placeholder='python -java "machine learning" title:senior'),
+            html.Div(id='posting-results')
+        ], style={'padding-top': '20px'}),
         dcc.Tabs(id='graph-tabs', children=[
             # Prevalent Tech
             dcc.Tab(label='Most Popular Tech', value='tech'),
             dcc.Tab(label='Most Popular Languages', value='lang'),
             dcc.Tab(label='Compensation to Skill', value='skill'),
             dcc.Tab(label='Role Spread', value='role'),
+            dcc.Tab(label='Common Phrases', value='phrases'),
         ]),
         html.Div(id='tabs-content')
     ])
 
 
+def describe_progress(task) -> str:
+    """
+    Human readable progress of a running search task.
+    """
+    progress = task.progress.as_dict()
+    text = f"Scraping page {progress['pages_done'] + 1} of {progress['pages_total']}, " \
+           f"{progress['postings_parsed']} postings parsed"
+    if progress['eta_seconds'] is not None:
+        text += f", about {int(progress['eta_seconds'] // 60)} min left"
+    return text + "..."
+
+
+def bar_chart(series, y_title: str, empty_text: str = "No known skills found in these postings."):
+    """
+    Bar chart of a skill (or role) series, one bar per skill.
+    """
+    if series.empty:
+        return html.P(empty_text)
+    return dcc.Graph(figure={
+        'data': [{'type': 'bar', 'x': list(series.index), 'y': [float(value) for value in series.values]}],
+        'layout': {'yaxis': {'title': y_title}, 'margin': {'t': 20}}
+    })
+
+
 def init_dashboard(server):
     external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
     dash_app = dash.Dash(
@@ -49,55 +92,165 @@ def init_dashboard(server):
     )
     dash_app.layout = serve_layout
 
+    # launch the webdriver pool up front so the first cache miss doesn't pay browser startup
+    if (getenv("DRIVER_POOL_PREWARM") or "").lower() in ("1", "true", "yes"):
+        from app.scraper import get_driver_pool
+        get_driver_pool().prewarm()
+
     @dash_app.callback(
-        [Output('jobs-table', 'columns'),
-         Output('jobs-table', 'data')],
+        Output('search-task', 'data'),
         [Input('submit-search', 'n_clicks')],
         [State('job-query', 'value'),
          State('job-loc-query', 'value'),
          State('pages-query', 'value')]
     )
     def search(n_clicks: int, job_value: str, loc_value: str, pages: int):
-        if n_clicks is not None:
-            if job_value is not None and loc_value is not None and pages is not None:
-                jobs_df = initialize(job_value, loc_value, pages)
-                columns = [{'name': i, "id": i} for i in
-                           jobs_df[jobs_df.columns[~jobs_df.columns.isin(['job_description'])]]]
-                data = jobs_df.to_dict('records')
-                return columns, data
-        else:
+        if n_clicks and job_value is not None and loc_value is not None and pages is not None:
+            from app.storage import TABLE_COLUMNS
+            # returns right away, a scrape already running for the same query is joined instead of repeated;
+            # the table and tabs never need descriptions, so the run cache keeps the run without them
+            task = get_runner().submit(job_value, loc_value, pages, columns=TABLE_COLUMNS)
+            return task.id
+        raise PreventUpdate
+
+    @dash_app.callback(
+        [Output('table-run', 'data'),
+         Output('res-container', 'children'),
+         Output('task-poll', 'disabled'),
+         Output('jobs-table', 'columns'),
+         Output('jobs-table', 'page_size')],
+        [Input('search-task', 'data'),
+         Input('task-poll', 'n_intervals')]
+    )
+    def poll_search(task_id: str, n_intervals: int):
+        task = get_runner().get(task_id) if task_id else None
+        if task is None:
+            raise PreventUpdate
+        if not task.done():
+            return dash.no_update, describe_progress(task), False, dash.no_update, dash.no_update
+        if task.status == "failed":
+            return dash.no_update, f"Search failed: {task.error}", True, dash.no_update, dash.no_update
+        from .table import get_page_size, table_columns
+        # the run the task settled on, the table loads it (without descriptions) through the run cache
+        table_run = dict(job=task.job, location=task.location, pages=task.pages, run_path=task.run_path)
+        return table_run, f"{task.rows} postings", True, table_columns(), get_page_size()
+
+    @dash_app.callback(
+        [Output('jobs-table', 'data'),
+         Output('jobs-table', 'page_count')],
+        [Input('table-run', 'data'),
+         Input('jobs-table', 'page_current'),
+         Input('jobs-table', 'page_size'),
+         Input('jobs-table', 'sort_by'),
+         Input('jobs-table', 'filter_query')]
+    )
+    def update_table(table_run: dict, page_current: int, page_size: int, sort_by: list, filter_query: str):
+        if not table_run:
             raise PreventUpdate
+        from app.scraper import load_cached_run
+        from app.storage import TABLE_COLUMNS
+        from .helpers import get_table_view
+        from .table import get_page_size, page_records
+        # the run the search settled on, served from the run cache rather than looked up (or scraped) again
+        try:
+            jobs_df = load_cached_run(table_run['job'], table_run['location'], table_run['pages'],
+                                      table_run['run_path'], TABLE_COLUMNS)
+        except FileNotFoundError as err:
+            # the run was pruned since the search, searching again picks up the newer one
+            print(err)
+            raise PreventUpdate
+        rows = get_table_view(jobs_df, sort_by, filter_query)
+        return page_records(jobs_df, rows, page_current, page_size or get_page_size())
+
+    @dash_app.callback(Output('posting-results', 'children'),
+                       Input('posting-search', 'value'))
+    def search_index(query: str):
+        if not query:
+            raise PreventUpdate
+        from app.search_index import search as search_postings
+        try:
+            results = search_postings(query, limit=20)
+        except ValueError as err:
+            return html.P(str(err))
+        if not results:
+            return html.P("No postings match.")
+        return html.Ul([
+            html.Li([html.B(result['title']), f" - {result['company']}, {result['location']}", html.Br(),
+                     html.Small(result['snippet'])])
+            for result in results
+        ])
 
     @dash_app.callback(Output('tabs-content', 'children'),
-                       Input('graph-tabs', 'value'),
-                       [State('job-query', 'value'),
-                        State('job-loc-query', 'value'),
-                        State('pages-query', 'value')]
+                       [Input('graph-tabs', 'value'),
+                        Input('table-run', 'data')],
+                       [State('search-task', 'data')]
                        )
-    def render_content(tab, job_value: str, loc_value: str, pages: int):
+    def render_content(tab, table_run: dict, task_id: str):
+        from app.scraper import load_cached_run
+        from app.storage import TABLE_COLUMNS
+        from .helpers import get_most_popular_tech, get_most_popular_language, get_skill_to_pay_comparison, \
+            get_role_spread, get_common_phrases
         jobs_df = None
-        if job_value is not None and loc_value is not None and pages is not None:
-            jobs_df = initialize(job_value, loc_value, pages)
+        if table_run:
+            # the tabs render from the precomputed summary of the run the search task settled on,
+            # descriptions aren't needed; never search again here, that could scrape on the request thread
+            try:
+                jobs_df = load_cached_run(table_run['job'], table_run['location'], table_run['pages'],
+                                          table_run['run_path'], TABLE_COLUMNS)
+            except FileNotFoundError as err:
+                # the run was pruned since, searching again picks up the newer one
+                print(err)
+                raise PreventUpdate
+        else:
+            # the search's first run isn't in yet, the tabs render once poll_search hands it over
+            task = get_runner().get(task_id) if task_id else None
+            if task is not None and not task.done():
+                return html.Div([describe_progress(task)])
+            if task is not None and task.status == "failed":
+                return html.Div([f"Search failed: {task.error}"])
 
+        if jobs_df is None:
+            return html.Div([html.P("Search for a job to see its analytics.")])
         if tab == 'tech':
             try:
-                format_data(jobs_df)
                 return html.Div([
-                    html.H5('Most Popular Tech')
+                    html.H5('Most Popular Tech'),
+                    bar_chart(get_most_popular_tech(jobs_df), 'Postings')
                 ])
             except Exception as err:
                 print(err)
         elif tab == 'lang':
-            return html.Div([
-                html.H5('Most Popular Languages')
-            ])
+            try:
+                return html.Div([
+                    html.H5('Most Popular Languages'),
+                    bar_chart(get_most_popular_language(jobs_df), 'Postings')
+                ])
+            except Exception as err:
+                print(err)
         elif tab == 'skill':
-            return html.Div([
-                html.H5('Compensation to Skill')
-            ])
+            try:
+                pay = get_skill_to_pay_comparison(jobs_df)
+                return html.Div([
+                    html.H5('Compensation to Skill'),
+                    bar_chart(pay.median_salary, 'Median yearly salary')
+                ])
+            except Exception as err:
+                print(err)
         elif tab == 'role':
-            return html.Div([
-                html.H5('Role Spread')
-            ])
+            try:
+                return html.Div([
+                    html.H5('Role Spread'),
+                    bar_chart(get_role_spread(jobs_df), 'Postings', "No titles found in these postings.")
+                ])
+            except Exception as err:
+                print(err)
+        elif tab == 'phrases':
+            try:
+                return html.Div([
+                    html.H5('Common Phrases'),
+                    bar_chart(get_common_phrases(jobs_df), 'Mentions', "No phrases found in these postings.")
+                ])
+            except Exception as err:
+                print(err)
 
     return dash_app.server
@@ -0,0 +1,303 @@
+"""
+Multi-pattern skill extractor for job descriptions.
+
+A curated dictionary of languages and technologies, aliases included, is compiled once into an
+Aho-Corasick automaton over word tokens. Each description is tokenized with a single regex and
+run through the automaton in one linear pass, so the cost doesn't grow with the number of
+skills. The result is a sparse postings x skills matrix that feeds the analytics tabs and is
+cached next to the stored run like the document-term matrix.
+"""
+
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from re import compile as re_compile
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from app.storage import read_run
+
+SKILLS_SUFFIX = ".skills.npz"
+LANGUAGE = "language"
+TECH = "tech"
+
+# canonical name: (category, aliases matched besides the lowercased name itself). Names that are
+# also everyday words ("go", "rest", "excel") are spelled so only the technical sense matches
+SKILLS = {
+    # languages
+    "Python": (LANGUAGE, ["python3"]),
+    "Java": (LANGUAGE, []),
+    "JavaScript": (LANGUAGE, ["js", "ecmascript", "es6"]),
+    "TypeScript": (LANGUAGE, []),
+    "C": (LANGUAGE, []),
+    "C++": (LANGUAGE, ["cpp", "c plus plus"]),
+    "C#": (LANGUAGE, ["c sharp", "csharp"]),
+    "Golang": (LANGUAGE, ["go lang"]),
+    "Rust": (LANGUAGE, []),
+    "Ruby": (LANGUAGE, []),
+    "PHP": (LANGUAGE, []),
+    "Kotlin": (LANGUAGE, []),
+    "Swift": (LANGUAGE, []),
+    "Objective-C": (LANGUAGE, ["objective c", "objc"]),
+    "Scala": (LANGUAGE, []),
+    "RStudio": (LANGUAGE, ["r studio", "r programming"]),
+    "MATLAB": (LANGUAGE, []),
+    "Perl": (LANGUAGE, []),
+    "Bash": (LANGUAGE, ["shell scripting", "shell script", "shell scripts"]),
+    "PowerShell": (LANGUAGE, []),
+    "SQL": (LANGUAGE, ["t-sql", "tsql", "pl/sql", "plsql"]),
+    "HTML": (LANGUAGE, ["html5"]),
+    "CSS": (LANGUAGE, ["css3", "scss", "sass"]),
+    "Dart": (LANGUAGE, []),
+    "Elixir": (LANGUAGE, []),
+    "Haskell": (LANGUAGE, []),
+    "Clojure": (LANGUAGE, []),
+    "Lua": (LANGUAGE, []),
+    "Groovy": (LANGUAGE, []),
+    "VBA": (LANGUAGE, ["visual basic"]),
+    "COBOL": (LANGUAGE, []),
+    "Solidity": (LANGUAGE, []),
+    # frameworks and libraries
+    "React": (TECH, ["react.js", "reactjs", "react native"]),
+    "Angular": (TECH, ["angularjs", "angular.js"]),
+    "Vue.js": (TECH, ["vue", "vuejs"]),
+    "Node.js": (TECH, ["node", "nodejs"]),
+    "Express.js": (TECH, ["expressjs"]),
+    "Next.js": (TECH, ["nextjs"]),
+    "jQuery": (TECH, []),
+    "Redux": (TECH, []),
+    "GraphQL": (TECH, []),
+    "Django": (TECH, []),
+    "Flask": (TECH, []),
+    "FastAPI": (TECH, []),
+    "Spring Boot": (TECH, ["springboot", "spring framework", "spring mvc"]),
+    "Hibernate": (TECH, []),
+    ".NET": (TECH, ["dotnet", "asp.net", ".net core"]),
+    "Ruby on Rails": (TECH, ["rails", "ror"]),
+    "Laravel": (TECH, []),
+    "Pandas": (TECH, []),
+    "NumPy": (TECH, []),
+    "scikit-learn": (TECH, ["sklearn", "scikit learn"]),
+    "TensorFlow": (TECH, []),
+    "PyTorch": (TECH, []),
+    "Keras": (TECH, []),
+    "Spark": (TECH, ["apache spark", "pyspark"]),
+    "Hadoop": (TECH, []),
+    "Kafka": (TECH, ["apache kafka"]),
+    "Airflow": (TECH, ["apache airflow"]),
+    "Selenium": (TECH, []),
+    "Flutter": (TECH, []),
+    # databases
+    "PostgreSQL": (TECH, ["postgres", "postgresql", "psql"]),
+    "MySQL": (TECH, []),
+    "SQL Server": (TECH, ["mssql", "ms sql", "microsoft sql server"]),
+    "Oracle": (TECH, []),
+    "MongoDB": (TECH, ["mongo"]),
+    "Redis": (TECH, []),
+    "Elasticsearch": (TECH, ["elastic search", "elk"]),
+    "Cassandra": (TECH, []),
+    "DynamoDB": (TECH, []),
+    "Snowflake": (TECH, []),
+    "SQLite": (TECH, []),
+    # cloud, infrastructure and tooling
+    "AWS": (TECH, ["amazon web services", "ec2", "s3", "lambda"]),
+    "Azure": (TECH, ["microsoft azure"]),
+    "GCP": (TECH, ["google cloud", "google cloud platform"]),
+    "Docker": (TECH, []),
+    "Kubernetes": (TECH, ["k8s", "kube", "eks", "aks", "gke"]),
+    "Terraform": (TECH, []),
+    "Ansible": (TECH, []),
+    "Jenkins": (TECH, []),
+    "CI/CD": (TECH, ["ci cd", "continuous integration", "continuous delivery", "continuous deployment"]),
+    "Git": (TECH, ["github", "gitlab", "bitbucket"]),
+    "Linux": (TECH, ["unix", "ubuntu", "red hat", "rhel"]),
+    "REST API": (TECH, ["restful", "rest apis", "rest services"]),
+    "Microservices": (TECH, ["microservice", "micro services"]),
+    "Jira": (TECH, []),
+    "Tableau": (TECH, []),
+    "Power BI": (TECH, ["powerbi"]),
+    "Microsoft Excel": (TECH, ["ms excel", "advanced excel", "excel spreadsheets"]),
+    "Salesforce": (TECH, []),
+    "SAP": (TECH, []),
+    "Figma": (TECH, []),
+    "Machine Learning": (TECH, ["ml", "deep learning"]),
+}
+
+# word tokens; "c++", "c#", ".net" and "k8s" stay whole, "node.js" becomes "node" ".js"
+token_pattern = re_compile(r"\.?[a-z0-9]+[+#]*")
+
+
+def tokenize(text: str) -> list:
+    return token_pattern.findall(text.lower())
+
+
+class SkillAutomaton:
+
+    def __init__(self, skills: dict):
+        """
+        Aho-Corasick automaton over word tokens. States are trie nodes, a token without a goto
+        edge follows failure links, so every description is scanned once whatever the number
+        of patterns, and patterns only ever match whole tokens.
+        :param skills: canonical name: (category, aliases) dictionary like SKILLS
+        """
+        self.names = np.array(list(skills), dtype=str)
+        self.categories = np.array([category for category, _ in skills.values()], dtype=str)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for index, (name, (_, aliases)) in enumerate(skills.items()):
+            for pattern in {name.lower(), *aliases}:
+                self._add(tokenize(pattern), index)
+        self._link()
+
+    def _add(self, tokens: list, index: int) -> None:
+        state = 0
+        for token in tokens:
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        self.output[state] += (index,)
+
+    def _link(self) -> None:
+        # breadth first, so a state's failure target is always finished before the state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.output[child] += self.output[self.fail[child]]
+
+    def find(self, text: str) -> set:
+        """
+        Indices of every skill mentioned in text.
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for token in tokenize(text):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+@lru_cache(maxsize=1)
+def get_automaton() -> SkillAutomaton:
+    """
+    Automaton of the SKILLS dictionary, compiled once per process.
+    """
+    return SkillAutomaton(SKILLS)
+
+
+class SkillMatrix:
+
+    def __init__(self, matrix: sparse.csr_matrix, skills: np.ndarray, categories: np.ndarray):
+        """
+        Which skills every posting mentions.
+        :param matrix: postings x skills csr matrix, 1 where the posting mentions the skill
+        :param skills: canonical name of every column
+        :param categories: category of every column (language or tech)
+        """
+        self.matrix = matrix
+        self.skills = skills
+        self.categories = categories
+
+    @property
+    def nbytes(self) -> int:
+        return (self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+                + self.skills.nbytes + self.categories.nbytes)
+
+    def popularity(self, category: str = None) -> pd.Series:
+        """
+        Number of postings mentioning each skill, most popular first, skills never seen left out.
+        :param category: only LANGUAGE or TECH skills, all if None
+        """
+        counts = pd.Series(np.asarray(self.matrix.sum(axis=0)).ravel(), index=self.skills)
+        if category is not None:
+            counts = counts[self.categories == category]
+        return counts[counts > 0].sort_values(ascending=False)
+
+    def pay_by_skill(self, salaries: pd.Series, min_postings: int = 1) -> pd.DataFrame:
+        """
+        Join the matrix with a salary column of the same postings.
+        :param salaries: one (annual) salary per posting in matrix row order, NaN where unknown
+        :param min_postings: leave out skills with fewer postings stating a salary
+        :return: data-frame indexed by skill with postings, median_salary and mean_salary, best paid first
+        """
+        values = np.asarray(salaries, dtype=np.float64)
+        by_skill = self.matrix.tocsc()
+        rows = []
+        for column, skill in enumerate(self.skills):
+            paid = values[by_skill.indices[by_skill.indptr[column]:by_skill.indptr[column + 1]]]
+            paid = paid[~np.isnan(paid)]
+            if len(paid) >= max(min_postings, 1):
+                rows.append((skill, len(paid), float(np.median(paid)), float(paid.mean())))
+        return (pd.DataFrame(rows, columns=["skill", "postings", "median_salary", "mean_salary"])
+                .set_index("skill").sort_values("median_salary", ascending=False))
+
+    def save(self, file_path: Path) -> None:
+        np.savez_compressed(file_path, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                            shape=np.array(self.matrix.shape), skills=self.skills, categories=self.categories)
+
+    @classmethod
+    def load(cls, file_path: Path) -> "SkillMatrix":
+        with np.load(file_path, allow_pickle=False) as arrays:
+            data = np.ones(len(arrays["indices"]), dtype=np.int8)
+            matrix = sparse.csr_matrix((data, arrays["indices"], arrays["indptr"]), shape=tuple(arrays["shape"]))
+            return cls(matrix, arrays["skills"], arrays["categories"])
+
+
+def extract_skills(descriptions: pd.Series) -> SkillMatrix:
+    """
+    Match every description against the skill dictionary in one pass.
+    :param descriptions: job descriptions, missing values count as empty
+    :return: SkillMatrix with a row per description
+    """
+    automaton = get_automaton()
+    indptr = [0]
+    indices = []
+    for description in descriptions.fillna("").astype(str):
+        indices.extend(sorted(automaton.find(description)))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int8), np.array(indices, dtype=np.int32),
+                                np.array(indptr, dtype=np.int32)), shape=(len(descriptions), len(automaton.names)))
+    return SkillMatrix(matrix, automaton.names, automaton.categories)
+
+
+def skills_path(run_path: str) -> Path:
+    """
+    Where the skill matrix of a stored run is cached.
+    """
+    run_path = Path(run_path)
+    return run_path.with_name(run_path.name + SKILLS_SUFFIX)
+
+
+def load_skill_matrix(run_path: str, descriptions: pd.Series = None) -> SkillMatrix:
+    """
+    Skill matrix of a stored run, built and saved next to the run on first use. A cached matrix
+    built from a different skill dictionary is rebuilt.
+    :param run_path: path of the stored run
+    :param descriptions: the run's descriptions if already loaded, read from the run otherwise
+    :return: SkillMatrix
+    """
+    cache_path = skills_path(run_path)
+    if cache_path.is_file() and cache_path.stat().st_mtime_ns >= Path(run_path).stat().st_mtime_ns:
+        cached = SkillMatrix.load(cache_path)
+        if np.array_equal(cached.skills, get_automaton().names):
+            return cached
+    if descriptions is None:
+        descriptions = read_run(run_path, ["job_description"]).job_description
+    skill_matrix = extract_skills(descriptions)
+    skill_matrix.save(cache_path)
+    return skill_matrix
@@ -0,0 +1,262 @@
+"""
+Precomputed analytics of a stored run.
+
+When a run is saved its skill counts, role (title) counts, job type counts and salary
+distributions, overall and per skill, are computed once and written next to it as a small JSON
+summary. The analytics tabs render from the summary without touching descriptions. Summaries
+are additive: an incremental refresh adds the new postings' summary to the previous run's
+instead of re-reading every description. Postings marked as near-duplicates (see app.dedup) are
+only counted as duplicates, the analytics count each role once.
+"""
+
+from pathlib import Path
+import json
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from app.storage import read_run
+from .skills import SKILLS, extract_skills, load_skill_matrix
+
+SUMMARY_SUFFIX = ".summary.json"
+SUMMARY_COLUMNS = ["job_id", "title", "job_type", "salary_annual_base", "salary_annual_upper", "duplicate_of"]
+
+role_suffix = re.compile(r"\s*(?:\(.*|\s[-|–]\s.*|,.*)$")
+
+
+def skills_version() -> int:
+    """
+    Checksum of the skill dictionary, a summary built from another dictionary is rebuilt.
+    """
+    return zlib.crc32("\n".join(SKILLS).encode("utf-8"))
+
+
+def role_of(title: str) -> str:
+    """
+    Role a posting's title stands for: lowercased, without the parenthesised or dash/comma
+    separated details that follow it, e.g. "Senior Developer (Remote) - Team X" -> "senior developer".
+    """
+    return " ".join(role_suffix.sub("", title or "").lower().split())
+
+
+class Pay:
+
+    def __init__(self, values: dict = None):
+        """
+        Mergeable distribution of yearly salaries. Stated salaries are round figures, so counting
+        each distinct value keeps this small while medians stay exact.
+        :param values: salary -> number of postings paying it
+        """
+        self.values = values or {}
+
+    @property
+    def count(self) -> int:
+        return sum(self.values.values())
+
+    def add(self, other: "Pay") -> "Pay":
+        return Pay(_add_counts(self.values, other.values))
+
+    def median(self) -> float:
+        count = self.count
+        if not count:
+            return float("nan")
+        # 0-based positions of the middle value(s)
+        low, high, seen, middle = (count - 1) // 2, count // 2, 0, []
+        for value in sorted(self.values):
+            seen += self.values[value]
+            while len(middle) < 2 and seen > (low, high)[len(middle)]:
+                middle.append(value)
+            if len(middle) == 2:
+                break
+        return (middle[0] + middle[1]) / 2
+
+    def mean(self) -> float:
+        count = self.count
+        return sum(value * times for value, times in self.values.items()) / count if count else float("nan")
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "Pay":
+        distinct, counts = np.unique(values[~np.isnan(values)], return_counts=True)
+        return cls(dict(zip(distinct.tolist(), counts.tolist())))
+
+    def as_dict(self) -> dict:
+        # JSON object keys are strings, repr keeps floats exact
+        return {repr(value): count for value, count in self.values.items()}
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "Pay":
+        return cls({float(value): count for value, count in values.items()})
+
+
+def _add_counts(first: dict, second: dict) -> dict:
+    counts = dict(first)
+    for key, count in second.items():
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+class RunSummary:
+
+    def __init__(self, postings: int = 0, skills: dict = None, roles: dict = None, job_types: dict = None,
+                 pay: Pay = None, skill_pay: dict = None, version: int = None, duplicates: int = 0):
+        """
+        Aggregates of a run's postings, near-duplicates left out.
+        :param skills: skill -> postings mentioning it
+        :param roles: role_of(title) -> postings
+        :param job_types: job type -> postings
+        :param pay: yearly salaries of the postings stating one
+        :param skill_pay: skill -> Pay of the postings mentioning it
+        :param version: skills_version() the summary was built with
+        :param duplicates: postings left out as near-duplicates of another
+        """
+        self.postings = postings
+        self.skills = skills or {}
+        self.roles = roles or {}
+        self.job_types = job_types or {}
+        self.pay = pay or Pay()
+        self.skill_pay = skill_pay or {}
+        self.version = version if version is not None else skills_version()
+        self.duplicates = duplicates
+
+    def add(self, other: "RunSummary") -> "RunSummary":
+        """
+        Summary of the postings of both summaries.
+        """
+        skill_pay = dict(self.skill_pay)
+        for skill, pay in other.skill_pay.items():
+            skill_pay[skill] = skill_pay[skill].add(pay) if skill in skill_pay else pay
+        return RunSummary(self.postings + other.postings, _add_counts(self.skills, other.skills),
+                          _add_counts(self.roles, other.roles), _add_counts(self.job_types, other.job_types),
+                          self.pay.add(other.pay), skill_pay, self.version, self.duplicates + other.duplicates)
+
+    def popularity(self, category: str = None) -> pd.Series:
+        """
+        Number of postings mentioning each skill, most popular first, like SkillMatrix.popularity.
+        :param category: only LANGUAGE or TECH skills, all if None
+        """
+        counts = pd.Series({skill: count for skill, count in self.skills.items()
+                            if category is None or SKILLS.get(skill, (None,))[0] == category}, dtype=np.int64)
+        return counts[counts > 0].sort_values(ascending=False)
+
+    def pay_by_skill(self, min_postings: int = 1) -> pd.DataFrame:
+        """
+        Salaries by skill, like SkillMatrix.pay_by_skill.
+        :param min_postings: leave out skills with fewer postings stating a salary
+        :return: data-frame indexed by skill with postings, median_salary and mean_salary, best paid first
+        """
+        rows = [(skill, pay.count, pay.median(), pay.mean()) for skill, pay in self.skill_pay.items()
+                if pay.count >= max(min_postings, 1)]
+        return (pd.DataFrame(rows, columns=["skill", "postings", "median_salary", "mean_salary"])
+                .set_index("skill").sort_values("median_salary", ascending=False))
+
+    def role_spread(self) -> pd.Series:
+        """
+        Number of postings per role, most common first.
+        """
+        return pd.Series(self.roles, dtype=np.int64).sort_values(ascending=False)
+
+    def save(self, file_path: Path) -> None:
+        document = dict(version=self.version, postings=self.postings, skills=self.skills, roles=self.roles,
+                        job_types=self.job_types, pay=self.pay.as_dict(), duplicates=self.duplicates,
+                        skill_pay={skill: pay.as_dict() for skill, pay in self.skill_pay.items()})
+        Path(file_path).write_text(json.dumps(document), encoding="utf-8")
+
+    @classmethod
+    def load(cls, file_path: Path) -> "RunSummary":
+        document = json.loads(Path(file_path).read_text(encoding="utf-8"))
+        return cls(document["postings"], document["skills"], document["roles"], document["job_types"],
+                   Pay.from_dict(document["pay"]),
+                   {skill: Pay.from_dict(pay) for skill, pay in document["skill_pay"].items()}, document["version"],
+                   document.get("duplicates", 0))
+
+
+def yearly_pay(pd_df: pd.DataFrame) -> np.ndarray:
+    """
+    A posting's yearly pay: the midpoint of its range, or its base if no range is given.
+    :return: float array, NaN where no salary is stated
+    """
+    base = pd_df['salary_annual_base'] if 'salary_annual_base' in pd_df else pd.Series(np.nan, index=pd_df.index)
+    upper = pd_df['salary_annual_upper'] if 'salary_annual_upper' in pd_df else base
+    base = base.astype(float)
+    return ((base + upper.astype(float).fillna(base)) / 2).to_numpy()
+
+
+def build_summary(pd_df: pd.DataFrame, skill_matrix=None) -> RunSummary:
+    """
+    Summarize postings.
+    :param pd_df: jobs data-frame with title, job_type and the annual salary columns, and
+                  job_description unless skill_matrix is given
+    :param skill_matrix: skills.SkillMatrix of the same postings, extracted if None
+    :return: RunSummary
+    """
+    if skill_matrix is None:
+        skill_matrix = extract_skills(pd_df['job_description'])
+    matrix, duplicates = skill_matrix.matrix, 0
+    if 'duplicate_of' in pd_df:
+        originals = pd_df['duplicate_of'].isna().to_numpy()
+        duplicates = int((~originals).sum())
+        if duplicates:
+            pd_df, matrix = pd_df[originals].reset_index(drop=True), matrix[originals]
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    pay = yearly_pay(pd_df)
+    by_skill = matrix.tocsc()
+    skill_pay = {}
+    for column, skill in enumerate(skill_matrix.skills):
+        skill_values = pay[by_skill.indices[by_skill.indptr[column]:by_skill.indptr[column + 1]]]
+        if not np.isnan(skill_values).all():
+            skill_pay[str(skill)] = Pay.of(skill_values)
+    titles = pd_df['title'] if 'title' in pd_df else pd.Series("", index=pd_df.index)
+    job_types = pd_df['job_type'] if 'job_type' in pd_df else pd.Series(None, index=pd_df.index)
+    return RunSummary(
+        postings=len(pd_df),
+        skills={str(skill): int(count) for skill, count in zip(skill_matrix.skills, counts) if count},
+        roles={role: int(count) for role, count in titles.astype(object).fillna("").map(role_of).value_counts().items()
+               if role},
+        job_types={str(job_type): int(count)
+                   for job_type, count in job_types.dropna().astype(str).value_counts().items()},
+        pay=Pay.of(pay),
+        skill_pay=skill_pay,
+        duplicates=duplicates,
+    )
+
+
+def summary_path(run_path: str) -> Path:
+    """
+    Where the summary of a stored run is saved.
+    """
+    run_path = Path(run_path)
+    return run_path.with_name(run_path.name + SUMMARY_SUFFIX)
+
+
+def load_summary(run_path: str) -> RunSummary:
+    """
+    Summary of a stored run, built and saved next to the run if missing or outdated.
+    :param run_path: path of the stored run
+    :return: RunSummary
+    """
+    cache_path = summary_path(run_path)
+    if cache_path.is_file() and cache_path.stat().st_mtime_ns >= Path(run_path).stat().st_mtime_ns:
+        cached = RunSummary.load(cache_path)
+        if cached.version == skills_version():
+            return cached
+    jobs_df = read_run(run_path, SUMMARY_COLUMNS + ["job_description"])
+    summary = build_summary(jobs_df, load_skill_matrix(run_path, jobs_df.get('job_description')))
+    summary.save(cache_path)
+    return summary
+
+
+def extend_summary(base_path: str, new_jobs: list, base_df: pd.DataFrame) -> RunSummary:
+    """
+    Summary of an incremental refresh, by delta: the base run's summary plus the new postings'.
+    New postings already in the base run (same job_id) are counted once, as the base run's.
+    :param base_path: path of the run that was refreshed
+    :param new_jobs: list of job dicts scraped incrementally
+    :param base_df: the base run's jobs, for their job ids
+    :return: RunSummary of the merged run
+    """
+    new_df = pd.DataFrame.from_records(new_jobs, columns=SUMMARY_COLUMNS + ["job_description"])
+    if "job_id" in base_df:
+        new_df = new_df[new_df.job_id.isna() | ~new_df.job_id.isin(base_df.job_id.dropna())]
+    return load_summary(base_path).add(build_summary(new_df.reset_index(drop=True)))
@@ -0,0 +1,163 @@
+"""
+Server-side paging, sorting and filtering for the jobs DataTable.
+
+The table runs with custom page/sort/filter actions: the browser only sends its current page,
+sort_by and filter_query, and only the rows of the visible page, restricted to the shown
+columns, are sent back. Filter queries use the DataTable's own syntax, e.g.
+`{company} contains acme && {salary_annual_base} >= 80000`.
+"""
+
+from os import getenv
+import math
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from app.storage import JOB_SCHEMA, TABLE_COLUMNS
+
+# columns shown in the table, job keys are only used to de-duplicate postings
+VISIBLE_COLUMNS = [name for name in TABLE_COLUMNS if name not in ("job_id", "duplicate_of")]
+NUMERIC_COLUMNS = frozenset(field.name for field in JOB_SCHEMA
+                            if pa.types.is_decimal(field.type) or pa.types.is_floating(field.type))
+
+filter_part = re.compile(r"^\s*\{(?P<column>[^}]+)\}\s*(?P<operator>\S+)\s*(?P<value>.*?)\s*$")
+# symbols and names the DataTable writes, with their (s)ensitive and (i)nsensitive variants
+operators = {
+    "=": "eq", "eq": "eq", "!=": "ne", "ne": "ne", "<": "lt", "lt": "lt", "<=": "le", "le": "le",
+    ">": "gt", "gt": "gt", ">=": "ge", "ge": "ge", "contains": "contains", "datestartswith": "datestartswith",
+}
+
+
+def get_page_size() -> int:
+    """
+    Rows per table page (TABLE_PAGE_SIZE, default 25).
+    """
+    return int(getenv("TABLE_PAGE_SIZE") or 25)
+
+
+def table_columns() -> list:
+    """
+    DataTable column definitions of the visible columns.
+    """
+    return [{'name': name, 'id': name, 'type': 'numeric' if name in NUMERIC_COLUMNS else 'text'}
+            for name in VISIBLE_COLUMNS]
+
+
+def parse_filter(filter_query: str) -> list:
+    """
+    Split a DataTable filter query into its conditions. Parts that can't be parsed are dropped.
+    :param filter_query: e.g. '{title} contains "data" && {salary_annual_base} > 50000'
+    :return: list of (column, operator, value) with operator one of eq, ne, lt, le, gt, ge,
+             contains, datestartswith
+    """
+    conditions = []
+    for part in (filter_query or "").split(" && "):
+        match = filter_part.match(part)
+        if match is None:
+            continue
+        name = match.group("operator")
+        operator = operators.get(name)
+        if operator is None and name[:1] in "si":
+            operator = operators.get(name[1:])
+        if operator is None:
+            continue
+        value = match.group("value")
+        if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"`":
+            value = value[1:-1].replace("\\" + value[0], value[0])
+        conditions.append((match.group("column"), operator, value))
+    return conditions
+
+
+def condition_mask(column: pd.Series, operator: str, value: str) -> np.ndarray:
+    """
+    Rows of a column matching one filter condition. Numeric columns compare as numbers, text
+    columns as case-insensitive strings.
+    :return: boolean array
+    """
+    if column.name in NUMERIC_COLUMNS and operator not in ("contains", "datestartswith"):
+        numbers = pd.to_numeric(column, errors="coerce").to_numpy(dtype=float)
+        try:
+            target = float(value)
+        except ValueError:
+            return np.zeros(len(column), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            return {"eq": numbers == target, "ne": numbers != target, "lt": numbers < target,
+                    "le": numbers <= target, "gt": numbers > target, "ge": numbers >= target}[operator]
+
+    present = column.notna().to_numpy()
+    text = column.astype(object).where(column.notna(), "").astype(str).str.lower()
+    value = value.lower()
+    if operator == "contains":
+        matched = text.str.contains(value, regex=False)
+    elif operator == "datestartswith":
+        matched = text.str.startswith(value)
+    elif operator == "eq":
+        matched = text == value
+    elif operator == "ne":
+        return (text != value).to_numpy() | ~present
+    else:
+        matched = {"lt": text < value, "le": text <= value, "gt": text > value, "ge": text >= value}[operator]
+    return matched.to_numpy() & present
+
+
+def filter_rows(pd_df: pd.DataFrame, filter_query: str) -> np.ndarray:
+    """
+    Positions of the rows matching every condition of a filter query.
+    :return: sorted int array of row positions
+    """
+    mask = np.ones(len(pd_df), dtype=bool)
+    for column, operator, value in parse_filter(filter_query):
+        if column in pd_df:
+            mask &= condition_mask(pd_df[column], operator, value)
+    return np.flatnonzero(mask)
+
+
+def sort_rows(pd_df: pd.DataFrame, rows: np.ndarray, sort_by: list) -> np.ndarray:
+    """
+    Order row positions by the table's sort_by, missing values last.
+    :param rows: row positions to order
+    :param sort_by: list of {'column_id': ..., 'direction': 'asc' | 'desc'}
+    :return: reordered row positions
+    """
+    sort_by = [sort for sort in sort_by or () if sort.get('column_id') in pd_df]
+    if not sort_by or not len(rows):
+        return rows
+    keys = {}
+    for sort in sort_by:
+        column = pd_df[sort['column_id']].iloc[rows]
+        if column.name in NUMERIC_COLUMNS:
+            keys[column.name] = pd.to_numeric(column, errors="coerce").astype(float).to_numpy()
+        else:
+            keys[column.name] = column.astype(object).where(column.notna(), None).map(
+                lambda text: text.lower() if isinstance(text, str) else text).to_numpy()
+    frame = pd.DataFrame(keys)
+    frame["_row"] = rows
+    frame = frame.sort_values([sort['column_id'] for sort in sort_by],
+                              ascending=[sort.get('direction') != 'desc' for sort in sort_by],
+                              na_position="last", kind="mergesort")
+    return frame["_row"].to_numpy()
+
+
+def view_rows(pd_df: pd.DataFrame, sort_by: list = None, filter_query: str = None) -> np.ndarray:
+    """
+    Row positions of the filtered and sorted view of a run.
+    """
+    return sort_rows(pd_df, filter_rows(pd_df, filter_query), sort_by)
+
+
+def page_records(pd_df: pd.DataFrame, rows: np.ndarray, page_current: int, page_size: int) -> tuple:
+    """
+    Records of one page of a view, restricted to the visible columns.
+    :param rows: row positions of the view, see view_rows
+    :param page_current: zero based page number
+    :return: tuple of list of record dicts and the view's number of pages
+    """
+    page_count = max(1, math.ceil(len(rows) / page_size))
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    page_rows = rows[page_current * page_size:(page_current + 1) * page_size]
+    columns = [name for name in VISIBLE_COLUMNS if name in pd_df]
+    page = pd_df[columns].iloc[page_rows]
+    # NaN and pd.NA aren't valid JSON, blank cells are sent as null
+    return page.astype(object).where(page.notna(), None).to_dict('records'), page_count
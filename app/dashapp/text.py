@@ -0,0 +1,111 @@
+"""
+Batched text-cleaning engine for job descriptions.
+
+Whole description columns are lowercased, tokenized, stripped of stopwords (hashed set lookups)
+and counted into a sparse unigram + bigram document-term matrix in a single vectorizer pass.
+The matrix is cached next to the stored run so it is built once per run, not per tab render.
+NLTK and scikit-learn are only imported once a matrix is first built.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from app.storage import read_run
+
+DTM_SUFFIX = ".dtm.npz"
+
+
+@lru_cache(maxsize=1)
+def get_stop_words() -> frozenset:
+    """
+    English stopwords as a hashed set, loaded from the NLTK corpus once per process.
+    """
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+class DocTermMatrix:
+
+    def __init__(self, matrix: sparse.csr_matrix, terms: np.ndarray):
+        """
+        Sparse counts of every unigram and bigram per posting.
+        :param matrix: postings x terms csr matrix of counts
+        :param terms: term of every column, bigrams are space separated
+        """
+        self.matrix = matrix
+        self.terms = terms
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes + self.terms.nbytes
+
+    def term_counts(self, ngram: int = None) -> pd.Series:
+        """
+        Total count of every term across postings, most frequent first.
+        :param ngram: only unigrams (1) or bigrams (2), all if None
+        """
+        counts = pd.Series(np.asarray(self.matrix.sum(axis=0)).ravel(), index=self.terms)
+        if ngram is not None:
+            counts = counts[counts.index.str.count(' ') == ngram - 1]
+        return counts.sort_values(ascending=False)
+
+    def save(self, file_path: Path) -> None:
+        np.savez_compressed(file_path, data=self.matrix.data, indices=self.matrix.indices,
+                            indptr=self.matrix.indptr, shape=np.array(self.matrix.shape), terms=self.terms)
+
+    @classmethod
+    def load(cls, file_path: Path) -> "DocTermMatrix":
+        with np.load(file_path, allow_pickle=False) as arrays:
+            matrix = sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                       shape=tuple(arrays["shape"]))
+            return cls(matrix, arrays["terms"])
+
+
+def build_doc_term_matrix(descriptions: pd.Series) -> DocTermMatrix:
+    """
+    Tokenize a whole column of descriptions in one pass. Stopwords are dropped before bigrams are
+    formed, so bigrams join the neighbouring words that remain, as the row-by-row version did.
+    :param descriptions: job descriptions, missing values count as empty
+    :return: unigram + bigram document-term matrix
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    vectorizer = CountVectorizer(lowercase=True, token_pattern=r"\w+", stop_words=list(get_stop_words()),
+                                 ngram_range=(1, 2), dtype=np.int32)
+    try:
+        matrix = vectorizer.fit_transform(descriptions.fillna("").astype(str))
+    except ValueError:
+        # every description empty or made only of stopwords
+        return DocTermMatrix(sparse.csr_matrix((len(descriptions), 0), dtype=np.int32), np.array([], dtype=str))
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    return DocTermMatrix(matrix.tocsr(), terms.astype(str))
+
+
+def dtm_path(run_path: str) -> Path:
+    """
+    Where the document-term matrix of a stored run is cached.
+    """
+    run_path = Path(run_path)
+    return run_path.with_name(run_path.name + DTM_SUFFIX)
+
+
+def load_doc_term_matrix(run_path: str, descriptions: pd.Series = None) -> DocTermMatrix:
+    """
+    Document-term matrix of a stored run, built and saved next to the run on first use.
+    :param run_path: path of the stored run
+    :param descriptions: the run's descriptions if already loaded, read from the run otherwise
+    :return: DocTermMatrix
+    """
+    cache_path = dtm_path(run_path)
+    if cache_path.is_file() and cache_path.stat().st_mtime_ns >= Path(run_path).stat().st_mtime_ns:
+        return DocTermMatrix.load(cache_path)
+    if descriptions is None:
+        descriptions = read_run(run_path, ["job_description"]).job_description
+    dtm = build_doc_term_matrix(descriptions)
+    dtm.save(cache_path)
+    return dtm
@@ -0,0 +1,157 @@
+"""
+Near-duplicate detection for postings as they are scraped.
+
+Reposted and syndicated copies of a role differ in title or location but share (almost) all of
+their description. Every description is reduced to a MinHash signature over its word shingles
+and looked up in an LSH index (signature bands hashed into buckets), so a posting is only
+compared with the few earlier postings sharing a band with it rather than with all of them.
+A posting whose estimated Jaccard similarity with an earlier one reaches the threshold joins
+that posting's cluster: it is kept, marked duplicate_of the cluster's first posting, but its
+description isn't stored a second time.
+"""
+
+from functools import lru_cache
+from os import getenv
+import re
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_WORDS = 5
+MERSENNE = (1 << 31) - 1
+word_pattern = re.compile(r"[a-z0-9]+")
+
+
+@lru_cache(maxsize=1)
+def permutations() -> tuple:
+    """
+    Coefficients of the NUM_PERM hash functions (a * x + b) mod MERSENNE, fixed so signatures
+    are comparable across processes.
+    """
+    rng = np.random.default_rng(20201124)
+    return (rng.integers(1, MERSENNE, NUM_PERM, dtype=np.uint64),
+            rng.integers(0, MERSENNE, NUM_PERM, dtype=np.uint64))
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """
+    Hashes of the distinct runs of `size` consecutive words of a text, lowercased.
+    :return: uint64 array of values below MERSENNE
+    """
+    words = word_pattern.findall((text or "").lower())
+    grams = {" ".join(words[start:start + size]) for start in range(max(len(words) - size + 1, 1))} \
+        if words else set()
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64,
+                       count=len(grams)) % MERSENNE
+
+
+def minhash(text: str) -> np.ndarray:
+    """
+    MinHash signature of a text: the fraction of equal positions in two signatures estimates the
+    Jaccard similarity of their shingle sets.
+    :return: uint32 array of NUM_PERM values, None for a text without words
+    """
+    hashed = shingles(text)
+    if not len(hashed):
+        return None
+    a, b = permutations()
+    return ((np.outer(hashed, a) + b) % MERSENNE).min(axis=0).astype(np.uint32)
+
+
+def use_dedup() -> bool:
+    """
+    Whether scrapes mark near-duplicate postings (SCRAPER_DEDUP, default on).
+    """
+    return (getenv("SCRAPER_DEDUP") or "true").lower() in ("1", "true", "yes")
+
+
+class DedupIndex:
+
+    def __init__(self, threshold: float = None, bands: int = BANDS):
+        """
+        LSH index of the postings of one scrape.
+        :param threshold: estimated Jaccard similarity from which postings are near-duplicates,
+                          DEDUP_THRESHOLD in the env (0.8 by default)
+        :param bands: signature bands, more bands find less similar candidates
+        """
+        self.threshold = threshold if threshold is not None else float(getenv("DEDUP_THRESHOLD") or 0.8)
+        self.rows = NUM_PERM // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+        self.clusters = []
+        self.sizes = {}
+
+    def _band_keys(self, signature: np.ndarray) -> list:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(len(self.buckets))]
+
+    def find(self, signature: np.ndarray) -> int:
+        """
+        Most similar indexed posting at or above the threshold.
+        :return: its position in the index, None if there is none
+        """
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, key: str, text: str) -> tuple:
+        """
+        Index a posting.
+        :param key: the posting's job_id, or any key unique within the scrape
+        :param text: its description
+        :return: tuple of the key of its cluster's first posting and whether it is a copy of it
+        """
+        signature = minhash(text)
+        if signature is None:
+            return key, False
+        match = self.find(signature)
+        cluster = self.clusters[match] if match is not None else key
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        self.clusters.append(cluster)
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(position)
+        self.sizes[cluster] = self.sizes.get(cluster, 0) + 1
+        return cluster, match is not None
+
+    def mark(self, a_job) -> bool:
+        """
+        Dedup stage for a freshly built Job: a near-duplicate is marked duplicate_of its cluster's
+        first posting and its description dropped.
+        :return: whether the job is a copy
+        """
+        cluster, copy = self.add(a_job.job_id or f"#{len(self.signatures)}", a_job.job_description)
+        if copy:
+            a_job.duplicate_of = cluster
+            a_job.job_description = None
+        return copy
+
+    def mark_record(self, record: dict, renamed: dict) -> None:
+        """
+        Dedup stage over job dicts that may already carry marks from another index, e.g. shards
+        scraped by separate processes being merged.
+        :param renamed: previous cluster key -> cluster key in this index, updated as clusters join
+        """
+        if record.get("duplicate_of") is not None:
+            record["duplicate_of"] = renamed.get(record["duplicate_of"], record["duplicate_of"])
+            return
+        key = record.get("job_id") or f"#{len(self.signatures)}"
+        cluster, copy = self.add(key, record.get("job_description"))
+        if copy:
+            renamed[key] = cluster
+            record["duplicate_of"] = cluster
+            record["job_description"] = None
+
+
+def get_dedup_index() -> DedupIndex:
+    """
+    Fresh index for a scrape, None if deduplication is off.
+    """
+    return DedupIndex() if use_dedup() else None
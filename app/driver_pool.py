@@ -0,0 +1,255 @@
+"""
+Bounded pool of warm Chrome webdrivers shared by scrapes and Dash callbacks.
+
+Drivers are launched once and handed out with checkout/checkin. A driver is health-checked
+before it is reused, its session is reset between queries and it is recycled after serving
+a configurable number of pages or as soon as it stops responding.
+"""
+
+from contextlib import contextmanager
+from os import getenv
+from queue import Empty, LifoQueue
+from threading import Lock
+from time import monotonic
+import atexit
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from app.metrics import REGISTRY
+
+
+class PoolExhausted(Exception):
+    """Raised when no driver could be checked out within the timeout."""
+
+
+class DriverPool:
+
+    def __init__(self, factory, size: int = 2, max_pages: int = 50, timeout: float = None):
+        """
+        :param factory: zero argument callable launching a new webdriver
+        :param size: max number of drivers alive at once
+        :param max_pages: pages a driver may serve before it is replaced
+        :param timeout: seconds a checkout waits for a driver unless it says otherwise, None waits forever
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.idle = LifoQueue()
+        self.lock = Lock()
+        self.alive = 0
+        self.in_use = 0
+        self.pages_served = {}
+        # metrics
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.launches = 0
+        self.restarts = 0
+        self.busy_time = 0.0
+        self.checked_out_at = {}
+        self.created_at = monotonic()
+
+    def _launch(self) -> WebDriver:
+        driver = self.factory()
+        with self.lock:
+            self.launches += 1
+            self.pages_served[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver: WebDriver) -> None:
+        with self.lock:
+            self.alive -= 1
+            self.pages_served.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as err:
+            print(f"Error closing webdriver: {err}")
+
+    @staticmethod
+    def is_healthy(driver: WebDriver) -> bool:
+        """
+        Cheap liveness probe: a crashed browser or dead chromedriver raises on any command.
+        """
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset_session(driver: WebDriver) -> None:
+        """
+        Drop cookies, storage and the current page so queries don't leak state into each other.
+        """
+        driver.execute_script("try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}")
+        driver.delete_all_cookies()
+        driver.get("about:blank")
+
+    def prewarm(self) -> None:
+        """
+        Launch drivers up to the pool size so the first searches don't pay browser startup.
+        """
+        while True:
+            with self.lock:
+                if self.alive >= self.size:
+                    return
+                self.alive += 1
+            try:
+                self.idle.put(self._launch())
+            except Exception:
+                with self.lock:
+                    self.alive -= 1
+                raise
+
+    def checkout(self, timeout: float = None) -> WebDriver:
+        """
+        Borrow a healthy driver, launching one if the pool isn't full yet.
+        :param timeout: seconds to wait for a driver to be checked in, the pool's timeout if None
+        :return: webdriver that must be given back with checkin
+        :raises PoolExhausted: if every driver stayed checked out for the whole timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = monotonic()
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except Empty:
+                driver = None
+                with self.lock:
+                    can_launch = self.alive < self.size
+                    if can_launch:
+                        self.alive += 1
+                if can_launch:
+                    try:
+                        driver = self._launch()
+                    except Exception:
+                        with self.lock:
+                            self.alive -= 1
+                        raise
+                else:
+                    remaining = None if timeout is None else timeout - (monotonic() - start)
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhausted(f"No webdriver available after {timeout}s")
+                    try:
+                        driver = self.idle.get(timeout=remaining)
+                    except Empty:
+                        raise PoolExhausted(f"No webdriver available after {timeout}s")
+
+            if not self.is_healthy(driver):
+                self._discard(driver)
+                with self.lock:
+                    self.restarts += 1
+                continue
+
+            waited = monotonic() - start
+            with self.lock:
+                self.in_use += 1
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                self.checked_out_at[id(driver)] = monotonic()
+            return driver
+
+    def checkin(self, driver: WebDriver, pages: int = 0) -> None:
+        """
+        Give a driver back. It is reset and kept warm, or replaced if it crashed or is worn out.
+        :param driver: driver obtained from checkout
+        :param pages: number of result pages it served during this checkout
+        """
+        if driver is None:
+            return
+        with self.lock:
+            self.in_use -= 1
+            self.busy_time += monotonic() - self.checked_out_at.pop(id(driver), monotonic())
+            served = self.pages_served.get(id(driver), 0) + (pages or 0)
+            self.pages_served[id(driver)] = served
+
+        if served >= self.max_pages or not self.is_healthy(driver):
+            self._discard(driver)
+            with self.lock:
+                self.restarts += 1
+            return
+        try:
+            self.reset_session(driver)
+        except Exception:
+            self._discard(driver)
+            with self.lock:
+                self.restarts += 1
+            return
+        self.idle.put(driver)
+
+    @contextmanager
+    def driver(self, timeout: float = None):
+        """
+        Context manager around checkout/checkin. The yielded lease's `pages` attribute is the
+        page count reported at checkin.
+        """
+        lease = DriverLease(self.checkout(timeout))
+        try:
+            yield lease
+        finally:
+            self.checkin(lease.driver, lease.pages)
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of the pool's counters.
+        :return: dict of pool size, usage, wait times and restarts
+        """
+        with self.lock:
+            uptime = monotonic() - self.created_at
+            return dict(
+                size=self.size,
+                alive=self.alive,
+                in_use=self.in_use,
+                idle=self.idle.qsize(),
+                checkouts=self.checkouts,
+                wait_seconds_total=self.total_wait,
+                wait_seconds_avg=self.total_wait / self.checkouts if self.checkouts else 0.0,
+                wait_seconds_max=self.max_wait,
+                utilization=self.busy_time / (uptime * self.size) if uptime else 0.0,
+                launches=self.launches,
+                restarts=self.restarts,
+            )
+
+    def close(self) -> None:
+        """
+        Quit every idle driver. Drivers still checked out are quit when they are checked in.
+        """
+        self.max_pages = 0
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except Empty:
+                return
+
+
+class DriverLease:
+
+    def __init__(self, driver: WebDriver):
+        self.driver = driver
+        self.pages = 0
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool(factory) -> DriverPool:
+    """
+    Process-wide pool sized by DRIVER_POOL_SIZE, recycling drivers after DRIVER_MAX_PAGES pages.
+    Checkouts give up after DRIVER_POOL_TIMEOUT seconds (300 by default, 0 or less waits forever).
+    :param factory: callable launching a webdriver, used when the pool is first created
+    :return: shared DriverPool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            timeout = float(getenv("DRIVER_POOL_TIMEOUT") or 300)
+            _pool = DriverPool(factory,
+                               size=int(getenv("DRIVER_POOL_SIZE") or 2),
+                               max_pages=int(getenv("DRIVER_MAX_PAGES") or 50),
+                               timeout=timeout if timeout > 0 else None)
+            atexit.register(_pool.close)
+            REGISTRY.add_collector("driver_pool", _pool.metrics,
+                                   counters=("checkouts", "wait_seconds_total", "launches", "restarts"))
+        return _pool
@@ -0,0 +1,274 @@
+"""
+Browserless backend for the Indeed scraper.
+
+Builds the advanced-search URL directly, pulls result and viewjob pages over a pooled
+HTTP session and parses them with lxml into the same Job objects the Selenium flow produces.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime
+from os import getenv
+from time import monotonic
+from urllib.parse import urlencode, urljoin
+import logging
+
+import requests
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from app import metrics, posting_store
+from app.dedup import DedupIndex, get_dedup_index
+from app.job import Job
+from app.pipeline import PageDone
+from app.throttle import BlockedError, HostRateLimiter, get_limiter, get_workers, looks_blocked
+
+default_base_url = "https://ca.indeed.com"
+# results per search page, as selected in the advanced search form
+RESULTS_PER_PAGE = 50
+request_headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/86.0.4240.111 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-CA,en;q=0.9",
+}
+
+
+def get_base_url() -> str:
+    """
+    Base URL all requests are made against. Overridable with INDEED_BASE_URL so the backend
+    can be pointed at the local fixture server.
+    :return: base URL without a trailing slash
+    """
+    return (getenv("INDEED_BASE_URL") or default_base_url).rstrip('/')
+
+
+def build_search_url(what: str, where: str, start: int = 0, base_url: str = None) -> str:
+    """
+    Build the URL the advanced search form submits to, with the same filters search_job selects.
+    :param what: The job user queries for
+    :param where: The location user queries for
+    :param start: result offset of the page to fetch
+    :param base_url: override for get_base_url()
+    :return: absolute search URL
+    """
+    params = {
+        "as_and": what,
+        "l": where,
+        "fromage": 1,
+        "radius": 100,
+        "limit": RESULTS_PER_PAGE,
+        "sort": "date",
+        "psf": "advsrch",
+    }
+    if start:
+        params["start"] = start
+    return f"{base_url or get_base_url()}/jobs?{urlencode(params)}"
+
+
+def build_viewjob_url(job_key: str, base_url: str = None) -> str:
+    """
+    Build the URL of the standalone page of a single posting.
+    :param job_key: Indeed job key (data-jk)
+    :param base_url: override for get_base_url()
+    :return: absolute viewjob URL
+    """
+    return f"{base_url or get_base_url()}/viewjob?{urlencode({'jk': job_key})}"
+
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    """
+    Create a requests session with a pooled, retrying adapter so connections are kept alive
+    across result and viewjob pages.
+    :param pool_size: max connections kept per host
+    :return: configured session
+    """
+    session = requests.Session()
+    session.headers.update(request_headers)
+    # 403/429 are left to the rate limiter, retrying them here would bypass its backoff
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch(session: requests.Session, url: str, limiter: HostRateLimiter = None) -> str:
+    """
+    GET a page once the host's rate limiter allows it and report the outcome back to it.
+    :param session: pooled session from new_session
+    :param url: absolute URL
+    :param limiter: rate limiter to go through, defaults to the shared one
+    :return: decoded response body
+    """
+    limiter = limiter or get_limiter()
+    with metrics.stage("throttle"):
+        limiter.acquire(url)
+    start = monotonic()
+    try:
+        with metrics.stage("fetch"):
+            response = session.get(url, timeout=20)
+    except requests.RequestException:
+        limiter.record(url, monotonic() - start, ok=False)
+        raise
+    blocked = looks_blocked(response.status_code, response.text)
+    limiter.record(url, monotonic() - start, ok=response.ok, blocked=blocked)
+    if blocked:
+        metrics.count("blocked")
+        raise BlockedError(f"Blocked by {url} (HTTP {response.status_code})")
+    response.raise_for_status()
+    return response.text
+
+
+def _text(tree, xpath: str) -> str:
+    """
+    Stripped text content of the first node matching xpath, or an empty string.
+    """
+    nodes = tree.xpath(xpath)
+    return nodes[0].text_content().strip() if nodes else ""
+
+
+def parse_search_page(page: str, page_url: str) -> tuple:
+    """
+    Parse a search results page.
+    :param page: html of the results page
+    :param page_url: URL the page was fetched from, used to resolve the next link
+    :return: tuple of list of job keys on the page and absolute URL of the next page (None if last)
+    """
+    tree = lxml_html.fromstring(page)
+    job_keys = []
+    for card in tree.xpath("//*[@data-jk]"):
+        job_key = card.get("data-jk")
+        if job_key and job_key not in job_keys:
+            job_keys.append(job_key)
+    next_links = tree.xpath("//a[@aria-label='Next']/@href")
+    next_url = urljoin(page_url, next_links[0]) if next_links else None
+    return job_keys, next_url
+
+
+def parse_viewjob_page(page: str) -> Job:
+    """
+    Parse the standalone page of a posting into a Job. The info chunk is rebuilt line by line
+    the same way vjs-jobinfo renders it so Job parses salary/type/responsiveness identically.
+    :param page: html of the viewjob page
+    :return: Job object
+    """
+    tree = lxml_html.fromstring(page)
+    job_title = _text(tree, "//*[contains(@class, 'jobsearch-JobInfoHeader-title')]")
+    company_info = tree.xpath("//*[contains(@class, 'jobsearch-InlineCompanyRating')]/div")
+    job_cp = company_info[0].text_content().strip() if company_info else ""
+    job_loc = company_info[-1].text_content().strip() if len(company_info) > 1 else ""
+    job_desc = _text(tree, "//*[@id='jobDescriptionText']")
+
+    # salary and job type render as one "-" separated line in vjs-jobinfo
+    metadata = [node.text_content().strip()
+                for node in tree.xpath("//*[contains(@class, 'jobsearch-JobMetadataHeader-item')]")]
+    chunk_lines = [job_title, job_cp, job_loc, " - ".join(metadata)]
+    chunk_lines.extend(node.text_content().strip()
+                       for node in tree.xpath("//*[contains(@class, 'jobsearch-ResponsiveEmployer')]"))
+    full_chunk = "\n".join(line for line in chunk_lines if line)
+
+    return Job(job_title, job_cp, job_loc, job_desc, full_chunk)
+
+
+def fetch_search_page(session: requests.Session, url: str) -> tuple:
+    """
+    Fetch and parse a results page.
+    :return: see parse_search_page
+    """
+    page = fetch(session, url)
+    with metrics.stage("parse_search"):
+        return parse_search_page(page, url)
+
+
+def fetch_job(session: requests.Session, job_key: str) -> Job:
+    """
+    Fetch and parse the viewjob page of a posting.
+    :return: Job object
+    """
+    page = fetch(session, build_viewjob_url(job_key))
+    with metrics.stage("parse"):
+        a_job = parse_viewjob_page(page)
+    a_job.job_id = job_key
+    return a_job
+
+
+def get_per_page_info(session: requests.Session, job_keys: list, pool: ThreadPoolExecutor,
+                      dedup: DedupIndex = None, stored: dict = None):
+    """
+    HTTP counterpart of scraper.get_per_page_info: fetch every posting's viewjob page, keeping
+    as many in flight as the pool has workers. Pacing is left to the shared rate limiter.
+    :param session: pooled session from new_session
+    :param job_keys: job keys found on a result page
+    :param pool: executor the fetches are submitted to
+    :param dedup: index of the scrape's postings so far, near-duplicates get marked, see app.dedup
+    :param stored: job key -> job dict of postings taken from the posting store instead of fetched
+    :return: generator of Job objects in result page order
+    """
+    stored = stored or {}
+    # fetches run in the calling context so they count towards the run profile being collected
+    futures = [(job_key, None if job_key in stored else pool.submit(copy_context().run, fetch_job, session, job_key))
+               for job_key in job_keys]
+    for job_key, future in tqdm(futures):
+        try:
+            if future is None:
+                # scraped recently by another query, no need to fetch it
+                a_job = Job.from_record(stored[job_key])
+                metrics.count("posting_reused")
+            else:
+                a_job = future.result()
+        except BlockedError:
+            # every later fetch would be blocked too, stop so the page is redone on resume
+            raise
+        except Exception as err:
+            print(f"Error retrieving job {job_key}: " + str(err))
+            continue
+        if dedup is not None:
+            with metrics.stage("dedup"):
+                if dedup.mark(a_job):
+                    metrics.count("duplicate")
+        yield a_job
+
+
+def iter_jobs(job: str, location: str, total_pages: int, known_ids: set = None, start_page: int = 1,
+              start_url: str = None, skip_ids: set = None):
+    """
+    Scrape a query without a browser. Mirrors scraper.iter_selenium_jobs' arguments and output.
+
+    The next results page is requested as soon as the current one is parsed, so it downloads
+    while the current page's postings are still being fetched.
+    :return: generator of Job objects, with a PageDone marker after every finished page
+    """
+    seen_ids = set(known_ids or ()) | set(skip_ids or ())
+    dedup = get_dedup_index()
+    workers = get_workers()
+    next_url = start_url or build_search_url(job, location)
+
+    with new_session(pool_size=max(10, workers)) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        next_page = pool.submit(copy_context().run, fetch_search_page, session, next_url)
+        for curr_page in range(start_page - 1, total_pages):
+            start_time = datetime.now()
+            print(f"\nGathering data from page {curr_page + 1} of {total_pages}...\n")
+            try:
+                job_keys, following_url = next_page.result()
+            except Exception as err:
+                print(f"Error fetching results page {next_url}: " + str(err))
+                # not the end of the results: raise so the scrape is recorded as interrupted, not as max-scrape
+                raise
+            new_keys = [job_key for job_key in job_keys if job_key not in seen_ids]
+            seen_ids.update(job_keys)
+            if known_ids is not None and job_keys and not new_keys:
+                print("\nCaught up with previously scraped postings.")
+                break
+            if following_url is not None and curr_page + 1 < total_pages:
+                next_url = following_url
+                next_page = pool.submit(copy_context().run, fetch_search_page, session, next_url)
+            yield from get_per_page_info(session, new_keys, pool, dedup, posting_store.reusable(new_keys))
+            elapsed_time = datetime.now() - start_time
+            logging.info(f"Page {curr_page + 1} done in {elapsed_time.total_seconds()}s")
+            yield PageDone(curr_page + 1, following_url)
+            if following_url is None:
+                print("\nReached end of pagination.")
+                break
@@ -1,27 +1,106 @@
-from re import sub
+from re import compile as re_compile
 from decimal import Decimal
 
+import numpy as np
+
+JOB_TYPES = frozenset(["Full-time", "Freelance", "Apprenticeship", "Volunteer", "Casual", "Commission",
+                       "Fly-In/Fly-Out", "Contract", "Part-time", "Permanent", "Internship", "Temporary",
+                       "Temporarily remote", "Remote"])
+# multipliers turning a salary quoted per period into a yearly one (40h weeks, 52 weeks)
+ANNUAL_FACTORS = {"hour": 2080.0, "day": 260.0, "week": 52.0, "month": 12.0, "year": 1.0}
+
+non_numeric = re_compile(r'[^\d.]')
+info_separator = re_compile(r'\s+-\s+|,\s+')
+salary_period = re_compile(r'\b(?:an?|per)\s+(hour|day|week|month|year)\b')
+
+
+def parse_info_line(line: str) -> tuple:
+    """
+    Parse salary and job type out of a line of a Job info chunk such as
+    "$40 - $55 an hour - Contract".
+    :param line: single line from job info chunk
+    :return: tuple of (salary_base, salary_upper, salary_period, job_type), None where absent
+    """
+    parts = info_separator.split(line.strip())
+    currency = [part for part in parts if "$" in part]
+    salary_base = salary_upper = period = None
+    if currency:
+        salary_base = Decimal(non_numeric.sub('', currency[0]) or 0)
+        if len(currency) > 1:
+            salary_upper = Decimal(non_numeric.sub('', currency[1]) or 0)
+        match = salary_period.search(line)
+        if match is not None:
+            period = match.group(1)
+        else:
+            # no period given: amounts this small can only be hourly
+            period = "hour" if salary_base < 200 else "year"
+    job_types = [part for part in parts if "$" not in part and part in JOB_TYPES]
+    return salary_base, salary_upper, period, "-".join(job_types) or None
+
+
+def parse_info_chunk(extra_info: str) -> tuple:
+    """
+    Parse the full info chunk of a posting.
+    :param extra_info: text of the job info container, one field per line
+    :return: tuple of (responsive, salary_base, salary_upper, salary_period, job_type)
+    """
+    info_by_line = extra_info.strip().split("\n")
+    last_line = info_by_line[-1]
+    if last_line.startswith("Responded"):
+        if len(info_by_line) > 1 and info_by_line[-2].startswith("$"):
+            return (True,) + parse_info_line(info_by_line[-2])
+        return True, None, None, None, None
+    return (False,) + parse_info_line(last_line)
+
+
+def annualize(amount, period: str) -> float:
+    """
+    Yearly equivalent of a salary amount quoted per period.
+    :return: float amount, NaN if there is no amount
+    """
+    if amount is None or period is None:
+        return np.nan
+    return float(amount) * ANNUAL_FACTORS[period]
+
+
+def parse_jobs(records) -> dict:
+    """
+    Batch counterpart of Job: parse many raw postings straight into typed columns without creating
+    a Job object or dict per posting.
+    :param records: iterable of (title, company, location, job_description, extra_info[, job_id]) tuples
+    :return: dict of column name to list/array, ready for pd.DataFrame or storage.to_table
+    """
+    columns = {name: [] for name in ("job_id", "title", "company", "location", "job_description",
+                                     "salary_base", "salary_upper", "salary_period", "job_type")}
+    responsive, annual_base, annual_upper = [], [], []
+    for record in records:
+        title, company, location, job_description, extra_info = record[:5]
+        is_responsive, salary_base, salary_upper, period, job_type = parse_info_chunk(extra_info)
+        columns["job_id"].append(record[5] if len(record) > 5 else None)
+        columns["title"].append(title)
+        columns["company"].append(company)
+        columns["location"].append(location.lstrip('-'))
+        columns["job_description"].append(job_description)
+        columns["salary_base"].append(salary_base)
+        columns["salary_upper"].append(salary_upper)
+        columns["salary_period"].append(period)
+        columns["job_type"].append(job_type)
+        responsive.append(is_responsive)
+        annual_base.append(annualize(salary_base, period))
+        annual_upper.append(annualize(salary_upper, period))
+    columns["is_responsive"] = np.array(responsive, dtype=bool)
+    columns["salary_annual_base"] = np.array(annual_base, dtype=np.float64)
+    columns["salary_annual_upper"] = np.array(annual_upper, dtype=np.float64)
+    return columns
+
 
 class Job:
 
-    def __parse_extras(self, line: str) -> None:
-        """
-        Parse extra fields from a full Job info
-        :param line: single line from job info chunk
-        :return:
-        """
-        job_types = ["Full-time", "Freelance", "Apprenticeship", "Volunteer", "Casual", "Commission", "Fly-In/Fly-Out",
-                     "Contract", "Part-time", "Permanent", "Internship", "Temporary", "Temporarily remote", "Remote"]
-        salary_info = line.split('-')
-        currency = [s for s in salary_info if "$" in s]
-        if currency:
-            self.salary_base = Decimal(sub(r'[^\d.]', '', currency[0]))
-            if len(currency) > 1:
-                self.salary_upper = Decimal(sub(r'[^\d.]', '', currency[1]))
-        job_types = [s for s in salary_info if "$" not in s and s in job_types]
-        self.job_type = None if "-".join(job_types) == '' else "-".join(job_types)
-
-    def __init__(self, title: str, company: str, location: str, job_description: str, extra_info: str):
+    __slots__ = ("job_id", "title", "company", "location", "job_description", "responsive",
+                 "salary_base", "salary_upper", "salary_period", "job_type", "duplicate_of")
+
+    def __init__(self, title: str, company: str, location: str, job_description: str, extra_info: str,
+                 job_id: str = None):
         """
         Initialization of Job objects
         :param title:
@@ -29,25 +108,40 @@ class Job:
         :param location:
         :param job_description:
         :param extra_info:
+        :param job_id: stable Indeed job key (data-jk) of the posting
         """
         # initialization handles sanitization of data
+        self.job_id = job_id
+        # set by the dedup stage when the posting is a near-duplicate of an earlier one
+        self.duplicate_of = None
         self.title = title
         self.company = company
         self.location = location.lstrip('-')
         self.job_description = job_description
-        self.responsive = False
-        self.salary_upper = None
-        self.salary_base = None
-        self.job_type = None
-        info_by_line = extra_info.strip().split("\n")
-        last_line = info_by_line[-1]
-        if last_line.startswith("Responded"):
-            self.responsive = True
-            prev_line = info_by_line[-2]
-            if prev_line.startswith("$"):
-                self.__parse_extras(prev_line)
-        else:
-            self.__parse_extras(last_line)
+        (self.responsive, self.salary_base, self.salary_upper,
+         self.salary_period, self.job_type) = parse_info_chunk(extra_info)
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        """
+        Rebuild a Job from a job dict such as as_dict() returns, without parsing an info chunk,
+        e.g. a posting taken from the posting store.
+        :param record: job dict
+        :return: Job object
+        """
+        a_job = cls.__new__(cls)
+        a_job.job_id = record.get("job_id")
+        a_job.duplicate_of = record.get("duplicate_of")
+        a_job.title = record.get("title")
+        a_job.company = record.get("company")
+        a_job.location = record.get("location")
+        a_job.job_description = record.get("job_description")
+        a_job.responsive = record.get("is_responsive")
+        a_job.salary_base = record.get("salary_base")
+        a_job.salary_upper = record.get("salary_upper")
+        a_job.salary_period = record.get("salary_period")
+        a_job.job_type = record.get("job_type")
+        return a_job
 
     def get_description(self) -> str:
         """
@@ -66,6 +160,8 @@ class Job:
             overview += f"Salary base: {self.salary_base}\n"
         if self.salary_upper is not None:
             overview += f"Salary upper: {self.salary_upper}\n"
+        if self.salary_period is not None:
+            overview += f"Salary period: {self.salary_period}\n"
         if self.job_type is not None:
             overview += f"Job-Type: {self.job_type}"
         if self.responsive:
@@ -78,6 +174,7 @@ class Job:
         :return:
         """
         return dict(
+            job_id=self.job_id,
             title=self.title,
             company=self.company,
             location=self.location,
@@ -85,5 +182,9 @@ class Job:
             is_responsive=self.responsive,
             salary_base=self.salary_base,
             salary_upper=self.salary_upper,
-            job_type=self.job_type
+            salary_period=self.salary_period,
+            salary_annual_base=annualize(self.salary_base, self.salary_period),
+            salary_annual_upper=annualize(self.salary_upper, self.salary_period),
+            job_type=self.job_type,
+            duplicate_of=self.duplicate_of
         )
@@ -0,0 +1,235 @@
+"""
+Per-stage scrape instrumentation.
+
+Every stage of a scrape (search navigation, popup handling, detail clicks and waits, parsing,
+throttling, pagination, storage) is timed into a histogram labelled by stage, and failures and
+notable events (pages, postings, popups closed) are counted. The registry renders in the
+Prometheus text format for the /metrics route. While a run is being profiled the same
+observations are summed into its RunProfile, which can be saved as JSON next to the run's file.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+import json
+
+PREFIX = "jobseekr"
+PROFILE_SUFFIX = ".profile.json"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        """
+        Monotonic count, one series per combination of label values.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self) -> list:
+        with self.lock:
+            lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+            lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Distribution of observed values (seconds), one series per combination of label values.
+        :param buckets: upper bounds of the cumulative buckets, +Inf is implied
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def collect(self) -> list:
+        with self.lock:
+            lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, snapshot, counters: tuple = ()) -> None:
+        """
+        Export a component's own stats dict at scrape time, e.g. the run cache's or the driver pool's.
+        :param name: component name, series are named <PREFIX>_<name>_<key>
+        :param snapshot: callable returning a dict of numeric stats
+        :param counters: keys that only ever grow, typed as counters rather than gauges
+        """
+        with self.lock:
+            self.collectors.append((name, snapshot, counters))
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics, collectors = list(self.metrics), list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines += metric.collect()
+        for name, snapshot, counters in collectors:
+            try:
+                stats = snapshot()
+            except Exception as err:
+                print(f"Error collecting {name} metrics: " + str(err))
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                series = f"{PREFIX}_{name}_{key}"
+                lines += [f"# TYPE {series} {'counter' if key in counters else 'gauge'}", f"{series} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(f"{PREFIX}_stage_seconds", "Time spent in each scrape stage.",
+                                            ("stage",)))
+STAGE_ERRORS = REGISTRY.register(Counter(f"{PREFIX}_stage_errors_total", "Scrape stages that raised.", ("stage",)))
+EVENTS = REGISTRY.register(Counter(f"{PREFIX}_events_total",
+                                   "Scrape events such as pages, postings and popups closed.", ("event",)))
+
+
+class RunProfile:
+
+    def __init__(self):
+        """
+        Per-stage totals of a single run.
+        """
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.events = {}
+        self.lock = Lock()
+
+    def add_stage(self, name: str, seconds: float, failed: bool = False) -> None:
+        with self.lock:
+            stage = self.stages.setdefault(name, dict(count=0, seconds=0.0, max_seconds=0.0, errors=0))
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+            stage["errors"] += int(failed)
+
+    def add_event(self, name: str, amount: float = 1) -> None:
+        with self.lock:
+            self.events[name] = self.events.get(name, 0) + amount
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return dict(started_at=self.started_at.isoformat(), finished_at=datetime.now().isoformat(),
+                        stages={name: dict(stage) for name, stage in self.stages.items()}, events=dict(self.events))
+
+    def save(self, run_path: str) -> Path:
+        """
+        Write the profile next to a stored run as <run file>.profile.json.
+        :return: path written
+        """
+        run_path = Path(run_path)
+        profile_path = run_path.with_name(run_path.name + PROFILE_SUFFIX)
+        profile_path.write_text(json.dumps(self.as_dict(), indent=2), encoding="utf-8")
+        return profile_path
+
+
+_current_profile = ContextVar("run_profile", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time the enclosed block as a scrape stage. An exception raised in the block counts as an
+    error of the stage and is re-raised.
+    """
+    start = perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if failed:
+            STAGE_ERRORS.inc(stage=name)
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add_stage(name, elapsed, failed)
+
+
+def count(event: str, amount: float = 1) -> None:
+    """
+    Count a scrape event (page_done, posting_parsed, popup_closed...).
+    """
+    EVENTS.inc(amount, event=event)
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_event(event, amount)
+
+
+@contextmanager
+def profile_run():
+    """
+    Collect the stages and events of the enclosed block, on this thread and in work submitted
+    through contextvars.copy_context(), into a fresh RunProfile.
+    :return: context manager yielding the RunProfile
+    """
+    profile = RunProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def render() -> str:
+    return REGISTRY.render()
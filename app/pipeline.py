@@ -0,0 +1,236 @@
+"""
+Streaming scrape pipeline and its crash-safe on-disk segment.
+
+Backends yield Job objects as they are parsed and a PageDone marker after every results page.
+The consumer appends them in batches to an append-only JSON lines segment that is flushed and
+fsynced per batch, so memory stays flat however many pages are scraped and a crash loses at
+most one batch. Once the scrape ends the segment is compacted into a regular stored run.
+
+The page markers double as checkpoints: a segment whose scrape was interrupted (or whose
+process died) knows the pages done, the next results page URL and the postings collected,
+so a later scrape of the same query can append to it and carry on from there.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+import json
+import os
+
+SEGMENT_SUFFIX = ".jsonl"
+SALARY_FIELDS = ("salary_base", "salary_upper")
+
+
+class PageDone:
+
+    def __init__(self, page: int, next_url: str = None):
+        """
+        Marker yielded by a backend once every posting of a results page has been yielded.
+        :param page: 1-based number of the page just finished
+        :param next_url: URL of the following results page, None if it was the last one
+        """
+        self.page = page
+        self.next_url = next_url
+
+
+def new_segment_path(query_dir: Path) -> Path:
+    """
+    Fresh segment file for a scrape of the query stored under query_dir.
+    """
+    query_dir = Path(query_dir)
+    query_dir.mkdir(parents=True, exist_ok=True)
+    return query_dir / f"inprogress{datetime.now().strftime('_%d-%m-%Y_%H-%M-%S-%f')}{SEGMENT_SUFFIX}"
+
+
+class SegmentWriter:
+
+    def __init__(self, file_path: Path, meta: dict, batch_size: int = 25):
+        """
+        Append-only writer. The first line holds the run's metadata, then one line per job and
+        one marker line per finished page.
+        :param file_path: segment file, created if missing and appended to otherwise
+        :param meta: description of the scrape (job, location, pages wanted, ...)
+        :param batch_size: jobs buffered in memory before they are flushed to disk
+        """
+        self.path = Path(file_path)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        is_new = not self.path.exists()
+        self.file = open(self.path, "a", encoding="utf-8")
+        if is_new:
+            self.buffer.append({"_meta": dict(meta, started_at=datetime.now().isoformat())})
+            self.flush()
+
+    def write_job(self, record: dict) -> None:
+        """
+        Queue a job dict, flushing once a full batch is buffered.
+        """
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def page_done(self, page: int, next_url: str = None) -> None:
+        """
+        Record that a page is complete. Always flushes so the page's jobs are on disk with it.
+        """
+        self.buffer.append({"_page": page, "next_url": next_url})
+        self.flush()
+
+    def interrupted(self, reason: str) -> None:
+        """
+        Record that the scrape stopped before it was done, e.g. blocked or crashed.
+        """
+        self.buffer.append({"_interrupted": reason})
+        self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        self.file.write("".join(json.dumps(line, default=str) + "\n" for line in self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class Segment:
+
+    def __init__(self, file_path: Path):
+        """
+        Reader over a segment written by SegmentWriter. A line cut short by a crash is ignored.
+        :param file_path: segment file
+        """
+        self.path = Path(file_path)
+        self.meta = {}
+        self.pages_done = 0
+        self.next_url = None
+        self.count = 0
+        self.interrupted = None
+        self.saved_as = None
+        for line in self._lines():
+            if "_meta" in line:
+                self.meta = line["_meta"]
+            elif "_page" in line:
+                self.pages_done = line["_page"]
+                self.next_url = line.get("next_url")
+                # pages done after an interruption mean the scrape was resumed
+                self.interrupted = None
+            elif "_interrupted" in line:
+                self.interrupted = line["_interrupted"]
+            elif "_saved" in line:
+                self.saved_as = line["_saved"]
+            else:
+                self.count += 1
+                # postings collected after a save (a resume) aren't in the saved run
+                self.saved_as = None
+
+    def _lines(self):
+        with open(self.path, encoding="utf-8") as segment_file:
+            for raw in segment_file:
+                try:
+                    yield json.loads(raw)
+                except ValueError:
+                    # torn write at the end of a crashed segment
+                    continue
+
+    def iter_batches(self, batch_size: int = 1000):
+        """
+        Stream the segment's jobs back.
+        :return: generator of lists of job dicts, salaries as Decimal
+        """
+        batch = []
+        for line in self._lines():
+            if not is_job_line(line):
+                continue
+            for field in SALARY_FIELDS:
+                if line.get(field) is not None:
+                    line[field] = Decimal(line[field])
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def read_records(self) -> list:
+        """
+        All jobs of the segment at once, for small (incremental) scrapes.
+        """
+        return [record for batch in self.iter_batches() for record in batch]
+
+    def job_ids(self) -> set:
+        return {line.get("job_id") for line in self._lines() if is_job_line(line) and line.get("job_id")}
+
+    @property
+    def resumable(self) -> bool:
+        """
+        Whether a scrape can pick up where this one stopped: a full (not incremental or sharded)
+        scrape with at least one page done, more pages wanted and a next page to go to.
+        """
+        return (not self.meta.get("incremental") and "shard" not in self.meta and self.pages_done > 0
+                and self.next_url is not None and self.pages_done < self.meta.get("pages_wanted", 0))
+
+    def age(self) -> timedelta:
+        """
+        Time since the segment was last written to.
+        """
+        return datetime.now() - datetime.fromtimestamp(self.path.stat().st_mtime)
+
+    def mark_saved(self, run_path: str) -> None:
+        """
+        Record that the postings so far were saved as a run, so they aren't recovered again while
+        the segment is kept as a checkpoint.
+        """
+        with open(self.path, "a", encoding="utf-8") as segment_file:
+            segment_file.write(json.dumps({"_saved": str(run_path)}) + "\n")
+        self.saved_as = str(run_path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def is_job_line(line: dict) -> bool:
+    return not any(key in line for key in ("_meta", "_page", "_interrupted", "_saved"))
+
+
+def find_checkpoint(query_dir: Path, pages_wanted: int, max_age: timedelta,
+                    idle: timedelta = timedelta(minutes=15)) -> Segment:
+    """
+    Most recent segment a scrape of pages_wanted pages can resume from. Segments of a scrape
+    that was interrupted qualify right away, others once they've been idle for `idle`.
+    :param query_dir: folder of the query
+    :param max_age: ignore checkpoints older than this, results pages will have moved on
+    :return: Segment, None if there is nothing to resume
+    """
+    candidates = []
+    for file_path in Path(query_dir).glob(f"inprogress_*{SEGMENT_SUFFIX}"):
+        segment = Segment(file_path)
+        if (segment.resumable and segment.meta.get("pages_wanted") == pages_wanted and segment.age() <= max_age
+                and (segment.interrupted is not None or segment.age() >= idle)):
+            candidates.append(segment)
+    return max(candidates, key=lambda segment: segment.path.stat().st_mtime, default=None)
+
+
+def find_abandoned_segments(query_dir: Path, idle: timedelta = timedelta(minutes=15)) -> list:
+    """
+    Segments left behind by a scrape that crashed or was killed. A segment still being written
+    is flushed at least once per page, so one untouched for `idle` is considered abandoned.
+    :param query_dir: folder of the query
+    :return: list of segment paths
+    """
+    cutoff = (datetime.now() - idle).timestamp()
+    return sorted(file_path for file_path in Path(query_dir).glob(f"inprogress_*{SEGMENT_SUFFIX}")
+                  if file_path.stat().st_mtime < cutoff)
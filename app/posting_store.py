@@ -0,0 +1,255 @@
+"""
+Store of every scraped posting, shared by all queries.
+
+Overlapping queries ("Software Engineer" and "Software Developer" in Toronto) match many of
+the same postings. Each posting is kept once, keyed by its job key, and a membership table
+records which queries matched it and when they first and last did. A scrape of any query takes
+postings another query scraped recently from the store instead of opening them again, and a
+query's view (every posting it matched) is read from the store without a copy per query.
+
+Descriptions, by far the largest field, aren't copied into the store: a posting keeps the path
+of the newest run holding its description and the description is read from that run when needed.
+"""
+
+from contextlib import closing
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import islice
+from os import getenv
+from pathlib import Path
+import sqlite3
+
+import pandas as pd
+
+from app import catalog, storage
+from app.cache import get_run_cache
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stored_postings (
+    job_id TEXT PRIMARY KEY,
+    title TEXT,
+    company TEXT,
+    location TEXT,
+    is_responsive INTEGER,
+    salary_base TEXT,
+    salary_upper TEXT,
+    salary_period TEXT,
+    salary_annual_base REAL,
+    salary_annual_upper REAL,
+    job_type TEXT,
+    duplicate_of TEXT,
+    run_path TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS query_postings (
+    query_key TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (query_key, job_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS query_postings_by_job ON query_postings (job_id);
+"""
+# posting fields kept in the store, in stored_postings column order; run_path is the run holding the description
+FIELDS = ("job_id", "title", "company", "location", "is_responsive", "salary_base", "salary_upper", "salary_period",
+          "salary_annual_base", "salary_annual_upper", "job_type", "duplicate_of", "run_path")
+SALARY_FIELDS = ("salary_base", "salary_upper")
+
+UPSERT_POSTING = f"""
+INSERT INTO stored_postings ({", ".join(FIELDS)}, first_seen, last_seen)
+VALUES ({", ".join("?" * len(FIELDS))}, ?, ?)
+ON CONFLICT (job_id) DO UPDATE SET
+    {", ".join(f"{name} = excluded.{name}" for name in FIELDS if name not in ("job_id", "run_path"))},
+    run_path = coalesce(excluded.run_path, stored_postings.run_path),
+    last_seen = max(stored_postings.last_seen, excluded.last_seen)
+"""
+UPSERT_MEMBER = """
+INSERT INTO query_postings (query_key, job_id, first_seen, last_seen) VALUES (?, ?, ?, ?)
+ON CONFLICT (query_key, job_id) DO UPDATE SET last_seen = max(query_postings.last_seen, excluded.last_seen)
+"""
+
+
+def use_posting_store() -> bool:
+    """
+    Whether scraped postings are kept in the shared store and reused across queries (POSTING_STORE, default on).
+    """
+    return (getenv("POSTING_STORE") or "true").lower() in ("1", "true", "yes")
+
+
+def get_reuse_max_age() -> timedelta:
+    """
+    How recently a posting must have been scraped to be taken from the store instead of opened
+    again (POSTING_STORE_MAX_HOURS, default 20).
+    """
+    return timedelta(hours=float(getenv("POSTING_STORE_MAX_HOURS") or 20))
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Open the run catalog with the store tables created.
+    """
+    conn = catalog.connect()
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(stored_postings)")]
+    if "job_description" in columns:
+        # stores written by older versions copied every description, they are rebuilt by later scrapes
+        conn.executescript("DROP TABLE stored_postings; DROP TABLE IF EXISTS query_postings;")
+    conn.executescript(STORE_SCHEMA)
+    return conn
+
+
+def _row(record: dict, run_path: str) -> tuple:
+    values = []
+    for name in FIELDS:
+        value = record.get(name)
+        if name == "run_path":
+            # a near-duplicate's description was dropped from the run, its original's run is kept
+            value = str(run_path) if run_path is not None and record.get("job_description") is not None else None
+        elif name in SALARY_FIELDS and value is not None:
+            value = str(value)
+        elif name == "is_responsive" and value is not None:
+            value = int(value)
+        elif isinstance(value, float) and value != value:
+            # NaN salaries are stored as NULL
+            value = None
+        values.append(value)
+    return tuple(values)
+
+
+def add_postings(job: str, location: str, records, seen_at: datetime = None, run_path: str = None) -> int:
+    """
+    Store the postings a scrape of a query matched and record them as the query's members.
+    Postings without a job key can't be matched across queries and are left out.
+    :param records: iterable of job dicts, e.g. Job.as_dict() or segment records
+    :param seen_at: when the postings were scraped, now if None
+    :param run_path: saved run holding the postings' descriptions, they can't be reused without one
+    :return: number of postings stored
+    """
+    seen_at = (seen_at or datetime.now()).timestamp()
+    key = catalog.query_key(job, location)
+    records = (record for record in records if record.get("job_id"))
+    stored = 0
+    with closing(connect()) as conn, conn:
+        while True:
+            batch = [_row(record, run_path) for record in islice(records, 1000)]
+            if not batch:
+                break
+            conn.executemany(UPSERT_POSTING, [row + (seen_at, seen_at) for row in batch])
+            conn.executemany(UPSERT_MEMBER, [(key, row[0], seen_at, seen_at) for row in batch])
+            stored += len(batch)
+    return stored
+
+
+def _run_descriptions(run_path: str) -> pd.DataFrame:
+    descriptions = storage.read_run(run_path, ["job_id", "job_description"]).dropna(subset=["job_id"])
+    return descriptions.drop_duplicates("job_id").set_index("job_id")
+
+
+def get_descriptions(job_ids: pd.Series, run_paths: pd.Series) -> pd.Series:
+    """
+    Read postings' descriptions from the runs holding them. Each run is read once and its
+    descriptions are kept in the run cache.
+    :param job_ids: job keys of the postings
+    :param run_paths: run holding each posting's description, aligned with job_ids
+    :return: series of descriptions aligned with job_ids, None where the run is gone (e.g. pruned)
+    """
+    references = pd.DataFrame({"job_id": job_ids, "run_path": run_paths})
+    descriptions = pd.Series([None] * len(references), index=references.index, dtype=object)
+    for run_path, group in references.dropna(subset=["run_path"]).groupby("run_path"):
+        try:
+            version = Path(run_path).stat().st_mtime_ns
+            run_descriptions = get_run_cache().get_or_load(
+                (Path(run_path).parent.name, "descriptions", run_path, version), lambda: _run_descriptions(run_path))
+        except (OSError, ValueError) as err:
+            print(f"Error reading descriptions from {run_path}: " + str(err))
+            continue
+        descriptions[group.index] = run_descriptions.job_description.reindex(group.job_id).values
+    return descriptions.where(descriptions.notna(), None)
+
+
+def _read_frame(conn: sqlite3.Connection, sql: str, params) -> pd.DataFrame:
+    frame = pd.read_sql_query(sql, conn, params=params)
+    frame = frame.astype(object).where(frame.notna(), None)
+    for name in SALARY_FIELDS:
+        frame[name] = [None if value is None else Decimal(value) for value in frame[name]]
+    frame["is_responsive"] = [None if value is None else bool(value) for value in frame["is_responsive"]]
+    return frame
+
+
+def reusable(job_ids: list) -> dict:
+    """
+    Postings among job_ids that were scraped recently enough to reuse, see get_reuse_max_age.
+    A near-duplicate comes with its original's description and unmarked, so the scrape reusing it
+    checks it against its own postings.
+    :return: dict of job key to job dict, empty if the store is off
+    """
+    job_ids = [job_id for job_id in job_ids if job_id]
+    if not job_ids or not use_posting_store():
+        return {}
+    fresh_after = (datetime.now() - get_reuse_max_age()).timestamp()
+    columns = ", ".join(f"posting.{name}" for name in FIELDS if name not in ("duplicate_of", "run_path"))
+    try:
+        with closing(connect()) as conn:
+            frame = _read_frame(
+                conn, f"SELECT {columns}, NULL AS duplicate_of, "
+                "coalesce(posting.run_path, original.run_path) AS description_run, "
+                "CASE WHEN posting.run_path IS NULL THEN posting.duplicate_of ELSE posting.job_id END "
+                "AS description_id "
+                "FROM stored_postings AS posting "
+                "LEFT JOIN stored_postings AS original ON original.job_id = posting.duplicate_of "
+                f"WHERE posting.job_id IN ({', '.join('?' * len(job_ids))}) AND posting.last_seen >= ?",
+                job_ids + [fresh_after])
+    except sqlite3.Error as err:
+        # the postings are simply opened again
+        print(f"Error reading the posting store: " + str(err))
+        return {}
+    # a near-duplicate's description is read from its original's run
+    frame["job_description"] = get_descriptions(frame.description_id, frame.description_run)
+    frame = frame[frame.job_description.notna()].drop(columns=["description_run", "description_id"])
+    return {record["job_id"]: record for record in frame.to_dict("records")}
+
+
+def query_view(job: str, location: str, columns: list = None, seen_after: datetime = None) -> pd.DataFrame:
+    """
+    Every stored posting a query matched, most recently first seen by it first, read from the
+    store rather than a run file. Descriptions are only read (from the runs holding them) if asked for.
+    :param columns: only these job columns, all if None
+    :param seen_after: only postings the query matched since, all if None
+    :return: data-frame typed like storage.read_run's, None if the store has no postings of the query.
+             A near-duplicate whose original isn't in the view is unmarked and given the original's
+             description, so it counts as an original
+    """
+    columns = list(columns) if columns is not None else storage.JOB_SCHEMA.names
+    with closing(connect()) as conn:
+        frame = _read_frame(
+            conn, f"SELECT {', '.join(f'posting.{name}' for name in FIELDS)}, "
+            "original.run_path AS original_run_path "
+            "FROM query_postings AS member JOIN stored_postings AS posting ON posting.job_id = member.job_id "
+            "LEFT JOIN stored_postings AS original ON original.job_id = posting.duplicate_of "
+            "WHERE member.query_key = ? AND member.last_seen >= ? ORDER BY member.first_seen DESC, posting.rowid",
+            (catalog.query_key(job, location), seen_after.timestamp() if seen_after else 0))
+    if frame.empty:
+        return None
+    unmarked = frame.duplicate_of.notna() & ~frame.duplicate_of.isin(frame.job_id)
+    if "job_description" in columns:
+        # an unmarked copy's description is its original's
+        frame["job_description"] = get_descriptions(frame.job_id.where(~unmarked, frame.duplicate_of),
+                                                    frame.run_path.where(~unmarked, frame.original_run_path))
+    frame.loc[unmarked, "duplicate_of"] = None
+    # column by column into the job schema, never a dict per posting
+    table = storage.to_table({name: frame[name].tolist() for name in columns if name in frame})
+    return table.to_pandas()[columns]
+
+
+def prune(max_days: float = None) -> int:
+    """
+    Forget query memberships not seen for max_days (POSTING_STORE_DAYS in the env, 30 by
+    default) and the postings no query matches any more.
+    :return: number of postings removed
+    """
+    max_days = max_days if max_days is not None else float(getenv("POSTING_STORE_DAYS") or 30)
+    expired_before = (datetime.now() - timedelta(days=max_days)).timestamp()
+    with closing(connect()) as conn, conn:
+        conn.execute("DELETE FROM query_postings WHERE last_seen < ?", (expired_before,))
+        return conn.execute("DELETE FROM stored_postings WHERE job_id NOT IN (SELECT job_id FROM query_postings)"
+                            ).rowcount
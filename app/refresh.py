@@ -0,0 +1,206 @@
+"""
+Headless refresh of a watchlist of queries, so dashboard searches find fresh runs instead of
+starting a scrape.
+
+Every cycle the watched queries whose runs are close to going stale (or missing) are ranked by
+staleness times priority and picked, best first, while their estimated requests fit the cycle's
+budget. The picked refreshes run a few at a time through a TaskRunner, incrementally where a
+previous run allows it.
+
+Usage: python -m app.refresh [--watchlist FILE] [--daemon] [--interval SECONDS] [--budget REQUESTS]
+                             [--workers N] [--dry-run]
+"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from datetime import datetime
+from math import ceil
+from os import getenv
+from pathlib import Path
+from time import sleep
+import json
+
+from dotenv import load_dotenv
+
+from app import catalog
+from app.tasks import TaskRunner
+
+# rough number of postings on a results page, for request estimates
+POSTINGS_PER_PAGE = 15
+
+
+class WatchedQuery:
+
+    def __init__(self, job: str, location: str, pages: int, priority: float = 1.0):
+        """
+        A query kept fresh by the refresher.
+        :param pages: pages a run of it should cover
+        :param priority: weight of its staleness when refreshes are ranked, higher goes first
+        """
+        self.job = job
+        self.location = location
+        self.pages = int(pages)
+        self.priority = float(priority)
+
+    def __repr__(self) -> str:
+        return f"{self.job} in {self.location} ({self.pages} pages)"
+
+
+class PlannedRefresh:
+
+    def __init__(self, query: WatchedQuery, staleness: float, requests: int, incremental: bool):
+        """
+        :param staleness: age of the query's run as a fraction of the freshness window, inf if it has none
+        :param requests: estimated requests the refresh makes
+        :param incremental: whether it only scrapes postings newer than the previous run
+        """
+        self.query = query
+        self.staleness = staleness
+        self.requests = requests
+        self.incremental = incremental
+
+    @property
+    def score(self) -> float:
+        return self.staleness * self.query.priority
+
+    def as_dict(self) -> dict:
+        return dict(job=self.query.job, location=self.query.location, pages=self.query.pages,
+                    priority=self.query.priority, staleness=self.staleness, requests=self.requests,
+                    incremental=self.incremental)
+
+
+def get_watchlist_path() -> Path:
+    """
+    Watchlist file, REFRESH_WATCHLIST in the env (defaults to "watchlist.json").
+    """
+    return Path(getenv("REFRESH_WATCHLIST") or "watchlist.json")
+
+
+def load_watchlist(file_path: Path = None) -> list:
+    """
+    Read a watchlist: a JSON list of {"job", "location", "pages", "priority"} objects, pages
+    defaulting to PAGES and priority to 1.
+    :return: list of WatchedQuery
+    """
+    entries = json.loads(Path(file_path or get_watchlist_path()).read_text(encoding="utf-8"))
+    return [WatchedQuery(entry["job"], entry["location"], entry.get("pages") or int(getenv("PAGES") or 2),
+                         entry.get("priority", 1.0)) for entry in entries]
+
+
+def get_refresh_at() -> float:
+    """
+    Fraction of the freshness window after which a run is refreshed (REFRESH_AT, default 0.75), so
+    it is replaced before searches find it stale.
+    """
+    return float(getenv("REFRESH_AT") or 0.75)
+
+
+def estimate_requests(pages: int, runs: list, incremental: bool) -> int:
+    """
+    Requests a refresh is expected to make: a results page per page and a posting page per posting.
+    :param runs: catalog rows of the query's runs, newest first
+    :param incremental: whether the refresh builds on runs[0]
+    """
+    if not incremental:
+        return pages * (POSTINGS_PER_PAGE + 1)
+    # an incremental refresh opens about as many postings as the previous one added
+    added = runs[0]["row_count"] - runs[1]["row_count"] if len(runs) > 1 else 0
+    postings = max(added, POSTINGS_PER_PAGE)
+    return postings + ceil(postings / POSTINGS_PER_PAGE)
+
+
+def plan_refreshes(watchlist: list, budget: int, now: datetime = None) -> list:
+    """
+    Pick the watched queries to refresh this cycle.
+    :param watchlist: list of WatchedQuery
+    :param budget: requests the cycle may make in total
+    :return: list of PlannedRefresh, in the order to run them
+    """
+    # imported here so planning a cycle doesn't pull the scraping engine in
+    from app.scraper import get_freshness_hours, use_incremental
+
+    now = now or datetime.now()
+    window = get_freshness_hours() * 3600
+    candidates = []
+    with closing(catalog.connect()) as conn:
+        for query in watchlist:
+            # the same override initialize applies to the pages asked for
+            pages = int(getenv("PAGES") or query.pages)
+            runs = conn.execute("SELECT * FROM runs WHERE query_key = ? AND (max_scrape = 1 OR pages_got >= ?) "
+                                "ORDER BY finished_at DESC LIMIT 2",
+                                (catalog.query_key(query.job, query.location), pages)).fetchall()
+            staleness = (now.timestamp() - runs[0]["finished_at"]) / window if runs and window else float("inf")
+            if staleness < get_refresh_at():
+                continue
+            incremental = bool(runs) and use_incremental()
+            requests = estimate_requests(pages, runs, incremental)
+            candidates.append(PlannedRefresh(query, staleness, requests, incremental))
+
+    candidates.sort(key=lambda planned: planned.score, reverse=True)
+    planned, spent = [], 0
+    for candidate in candidates:
+        # a refresh that doesn't fit leaves room for cheaper ones ranked after it
+        if spent + candidate.requests <= budget:
+            planned.append(candidate)
+            spent += candidate.requests
+    skipped = len(candidates) - len(planned)
+    if skipped:
+        print(f"{skipped} due refreshes don't fit the budget of {budget} requests, deferred to the next cycle\n")
+    return planned
+
+
+def run_cycle(watchlist: list, budget: int, workers: int, dry_run: bool = False) -> list:
+    """
+    Plan and run one refresh cycle, waiting for every refresh to finish.
+    :param workers: refreshes running at once
+    :param dry_run: only print the plan
+    :return: list of dicts describing each planned refresh, with its task's outcome unless dry_run
+    """
+    planned = plan_refreshes(watchlist, budget)
+    print(f"Refreshing {len(planned)} of {len(watchlist)} watched queries "
+          f"({sum(refresh.requests for refresh in planned)} requests estimated)\n")
+    for refresh in planned:
+        print(f"  {refresh.query}: staleness {refresh.staleness:.2f}, ~{refresh.requests} requests"
+              + (", incremental" if refresh.incremental else ""))
+    if dry_run or not planned:
+        return [refresh.as_dict() for refresh in planned]
+
+    runner = TaskRunner(max_workers=workers)
+    try:
+        # a freshness of 0 makes initialize scrape even though the current run isn't stale yet
+        tasks = [(refresh, runner.submit(refresh.query.job, refresh.query.location, refresh.query.pages,
+                                         freshness_hours=0)) for refresh in planned]
+        for _, task in tasks:
+            task.wait()
+    finally:
+        runner.pool.shutdown(wait=True)
+    return [dict(refresh.as_dict(), status=task.status, rows=task.rows, error=task.error) for refresh, task in tasks]
+
+
+def main(argv: list = None) -> None:
+    load_dotenv()
+    parser = ArgumentParser(description="Keep the runs of a watchlist of queries fresh")
+    parser.add_argument("--watchlist", help="JSON watchlist file, defaults to REFRESH_WATCHLIST")
+    parser.add_argument("--daemon", action="store_true", help="keep running a cycle every --interval seconds")
+    parser.add_argument("--interval", type=float, default=float(getenv("REFRESH_INTERVAL") or 600),
+                        help="seconds between the starts of two cycles")
+    parser.add_argument("--budget", type=int, default=int(getenv("REFRESH_BUDGET") or 2000),
+                        help="estimated requests a cycle may make")
+    parser.add_argument("--workers", type=int, default=int(getenv("REFRESH_WORKERS") or 2),
+                        help="refreshes running at once")
+    parser.add_argument("--dry-run", action="store_true", help="print the refreshes due without running them")
+    args = parser.parse_args(argv)
+
+    while True:
+        started = datetime.now()
+        # re-read every cycle so the watchlist can be edited while the daemon runs
+        results = run_cycle(load_watchlist(args.watchlist), args.budget, args.workers, args.dry_run)
+        failed = [result for result in results if result.get("status") == "failed"]
+        print(f"\nCycle done in {(datetime.now() - started).total_seconds():.0f}s, {len(failed)} failed\n")
+        if not args.daemon:
+            break
+        sleep(max(0.0, args.interval - (datetime.now() - started).total_seconds()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 """Routes for parent Flask app."""
-from flask import current_app as app
+from decimal import Decimal
+
+from flask import current_app as app, jsonify, request, Response
 
 
 @app.route('/')
@@ -12,3 +14,55 @@ def home():
 def login():
     return "Login Page", 200
 
+
+@app.route("/tasks/<task_id>")
+def task_status(task_id: str):
+    """Progress of a background search task, for polling clients."""
+    from .tasks import get_runner
+    task = get_runner().get(task_id)
+    if task is None:
+        return jsonify(error="unknown task"), 404
+    return jsonify(task.as_dict()), 200
+
+
+@app.route("/metrics")
+def metrics():
+    """Scrape stage timings, error and event counts, cache and driver pool stats in Prometheus text format."""
+    from .metrics import render
+    return Response(render(), mimetype="text/plain; version=0.0.4"), 200
+
+
+@app.route("/search")
+def search_postings():
+    """Ranked full-text search over the postings of every stored run, e.g. /search?q=python+-java&limit=20."""
+    from .search_index import search
+    query = request.args.get("q", "")
+    try:
+        results = search(query, limit=min(int(request.args.get("limit", 20)), 100),
+                         offset=int(request.args.get("offset", 0)),
+                         job=request.args.get("job"), location=request.args.get("location"))
+    except ValueError as err:
+        return jsonify(error=str(err)), 400
+    return jsonify(query=query, results=results), 200
+
+
+@app.route("/postings")
+def query_postings():
+    """Every posting a query matched, from the shared posting store, e.g. /postings?job=python&location=toronto."""
+    from .posting_store import query_view
+    from .storage import TABLE_COLUMNS
+    job, location = request.args.get("job"), request.args.get("location")
+    if not job or not location:
+        return jsonify(error="job and location are required"), 400
+    try:
+        limit, offset = min(int(request.args.get("limit", 100)), 1000), int(request.args.get("offset", 0))
+    except ValueError as err:
+        return jsonify(error=str(err)), 400
+    jobs_df = query_view(job, location, TABLE_COLUMNS)
+    if jobs_df is None:
+        return jsonify(job=job, location=location, total=0, postings=[]), 200
+    # NaN becomes null and Decimal salaries strings, so the page serializes as JSON
+    postings = [{name: None if value != value else str(value) if isinstance(value, Decimal) else value
+                 for name, value in record.items()}
+                for record in jobs_df.iloc[offset:offset + limit].astype(object).to_dict("records")]
+    return jsonify(job=job, location=location, total=len(jobs_df), postings=postings), 200
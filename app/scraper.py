@@ -6,33 +6,64 @@ Scrape jobs off of Canadian Indeed
 """
 
 from datetime import datetime, timedelta
-from os import path, getenv, remove
+from os import getenv
 import logging
-import glob
 
-from dotenv import load_dotenv
 from selenium import webdriver
-from time import sleep
+from time import monotonic
 from pathlib import Path
 
 from tqdm import tqdm
 import pandas as pd
+from selenium.common.exceptions import (ElementClickInterceptedException, ElementNotInteractableException,
+                                        NoSuchElementException, StaleElementReferenceException, TimeoutException)
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from app.job import Job
-import random
-
-load_dotenv()
+from app import http_backend
+from app.driver_pool import PoolExhausted, get_pool
+from app import storage, catalog
+from app.cache import get_run_cache
+from app import pipeline, metrics, search_index, posting_store
+from app.dedup import DedupIndex, get_dedup_index
+from app.dashapp.summary import RunSummary, extend_summary, load_summary, summary_path
+from app.shards import get_shard_workers, scrape_sharded
+from app.throttle import BlockedError, get_limiter
 start_url = "https://ca.indeed.com/advanced_search"
+result_titles = "//a[@data-tn-element='jobTitle']"
+# errors opening a single posting that leave the browser usable, any other error stops the scrape
+POSTING_ERRORS = (TimeoutException, NoSuchElementException, StaleElementReferenceException,
+                  ElementClickInterceptedException, ElementNotInteractableException)
+# requests the scraper never needs: images, fonts, media, stylesheets and trackers
+blocked_urls = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.woff", "*.woff2", "*.ttf",
+                "*.otf", "*.mp4", "*.webm", "*.css", "*google-analytics.com*", "*googletagmanager.com*",
+                "*doubleclick.net*", "*facebook.net*"]
 
 
-def set_chrome_options(env: str) -> Options:
+def use_lean_browser() -> bool:
+    """
+    Whether Chrome runs lean (SCRAPER_LEAN, default on): content blocking, eager page loads,
+    no implicit waits, instant popup checks and waits on DOM readiness instead of fixed timeouts.
+    """
+    return (getenv("SCRAPER_LEAN") or "true").lower() in ("1", "true", "yes")
+
+
+def get_wait_timeout() -> float:
+    """
+    Longest a lean wait for a results page lasts (SCRAPER_WAIT seconds, default 10).
+    It only runs that long when the page never gets ready.
+    """
+    return float(getenv("SCRAPER_WAIT") or 10)
+
+
+def set_chrome_options(env: str, lean: bool = None) -> Options:
     """
     Method to set up Webdriver with Chrome options
     :param env: environment being run in dev/prod etc.
+    :param lean: skip images and fonts and return from page loads at DOMContentLoaded, see use_lean_browser
     :return: Options object for Chrome webdriver
     """
     chrome_options = Options()
@@ -44,70 +75,221 @@ def set_chrome_options(env: str) -> Options:
         chrome_options.add_argument("--headless")
         chrome_options.add_argument("--window-size=1920,1080")
 
+    if use_lean_browser() if lean is None else lean:
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        })
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.set_capability("pageLoadStrategy", "eager")
+
     return chrome_options
 
 
-def search_job(what: str, where: str) -> WebDriver:
+def new_driver() -> WebDriver:
+    """
+    Launch a Chrome webdriver configured for the current environment.
+    :return: new webdriver
+    """
+    lean = use_lean_browser()
+    driver = webdriver.Chrome(getenv("WEBDRIVER_PATH"), options=set_chrome_options(getenv("ENVIRONMENT"), lean))
+    if lean:
+        # fonts, stylesheets and trackers have no content setting, they are blocked at the network level
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+        driver.implicitly_wait(0)
+    return driver
+
+
+# one round trip per poll: DOM parsed and either results, a next link or the "no jobs" notice in it
+results_ready_script = """
+return document.readyState !== 'loading' && (
+    document.querySelector("a[data-tn-element='jobTitle'], a[aria-label='Next']") !== null ||
+    (document.body !== null && document.body.innerText.indexOf('did not match any jobs') >= 0));
+"""
+
+
+def wait_for_results(web_driver: WebDriver) -> None:
+    """
+    Lean wait for a results page: returns as soon as the DOM is parsed and result titles are in it
+    (or the page says there are none), rather than after a fixed implicit wait.
+    """
+    with metrics.stage("wait"):
+        try:
+            WebDriverWait(web_driver, get_wait_timeout(), poll_frequency=0.1).until(
+                lambda driver: driver.execute_script(results_ready_script))
+        except TimeoutException as err:
+            print(f"\nResults not ready after {get_wait_timeout()}s {err}")
+
+
+def posting_shown(previous_desc, title_text: str):
+    """
+    Expected condition for the details panel of a clicked posting: the panel is in the DOM and
+    either the previous posting's description was replaced or the panel shows the clicked title.
+    :param previous_desc: description element shown before the click, None for the first posting
+    :param title_text: text of the clicked result title
+    :return: condition returning the job container once ready, False until then
+    """
+    def shown(driver):
+        containers = driver.find_elements_by_id("vjs-container")
+        if not containers:
+            return False
+        if previous_desc is None:
+            return containers[0]
+        try:
+            previous_desc.is_enabled()
+        except Exception:
+            # stale: the panel was re-rendered for the clicked posting
+            return containers[0]
+        titles = containers[0].find_elements_by_id("vjs-jobtitle")
+        return containers[0] if titles and titles[0].text.strip() == title_text else False
+    return shown
+
+
+def get_driver_pool():
+    """
+    Shared pool of warm webdrivers, see app.driver_pool.
+    """
+    return get_pool(new_driver)
+
+
+def search_job(what: str, where: str, driver: WebDriver = None) -> WebDriver:
     """
     Searches Indeed for a particular job (what) for a particular location (where).
     :param what: The job user queries for
     :param where: The location user queries for
+    :param driver: warm driver to search with, a new one is launched if not provided
     :return:
     """
     try:
-        driver = webdriver.Chrome(getenv("WEBDRIVER_PATH"), options=set_chrome_options(getenv("ENVIRONMENT")))
-        driver.get(start_url)
-        job_title_input = driver.find_element_by_id("as_and")
-        location_input = driver.find_element_by_id("where")
-        job_title_input.send_keys(what)
-        location_input.send_keys(where)
-        select_job_age = Select(driver.find_element_by_id('fromage'))
-        select_job_age.select_by_value('1')
-        select_job_radius = Select(driver.find_element_by_id('radius'))
-        select_job_radius.select_by_value('100')
-        select_job_limit = Select(driver.find_element_by_id('limit'))
-        select_job_limit.select_by_value('50')
-        select_job_sort = Select(driver.find_element_by_id('sort'))
-        select_job_sort.select_by_value('date')
-        driver.find_element_by_id("fj").click()
-        driver.implicitly_wait(10)
+        with metrics.stage("navigate"):
+            driver = driver or new_driver()
+            driver.get(start_url)
+            job_title_input = driver.find_element_by_id("as_and")
+            location_input = driver.find_element_by_id("where")
+            job_title_input.send_keys(what)
+            location_input.send_keys(where)
+            select_job_age = Select(driver.find_element_by_id('fromage'))
+            select_job_age.select_by_value('1')
+            select_job_radius = Select(driver.find_element_by_id('radius'))
+            select_job_radius.select_by_value('100')
+            select_job_limit = Select(driver.find_element_by_id('limit'))
+            select_job_limit.select_by_value('50')
+            select_job_sort = Select(driver.find_element_by_id('sort'))
+            select_job_sort.select_by_value('date')
+            driver.find_element_by_id("fj").click()
+        if use_lean_browser():
+            wait_for_results(driver)
+        else:
+            driver.implicitly_wait(10)
         return driver
     except Exception as err:
         print(f"Error Searching Job {what} in {where}: " + str(err))
+        # nothing was scraped: raise so the scrape is recorded as interrupted, not as an empty max-scrape
+        raise
+
+
+def get_job_key(search_item) -> str:
+    """
+    Stable Indeed job key of a search result, read off the enclosing result card.
+    :param search_item: job title web element from searchable_items
+    :return: job key, None if the card doesn't carry one
+    """
+    try:
+        return search_item.find_element_by_xpath("./ancestor::*[@data-jk][1]").get_attribute("data-jk")
+    except Exception:
+        return None
 
 
-def get_per_page_info(web_driver: WebDriver, search_items: list) -> list:
+def get_per_page_info(web_driver: WebDriver, search_items: list, dedup: DedupIndex = None, stored: dict = None):
     """
     Indeed jobs are paginated based on window size. Keeping 1980x1800 driver resolution
-    we get roughly 15 items per page. Returns a list of job dicts to be used directly with
-    a pandas Data-frame
+    we get roughly 15 items per page. Yields a Job for every posting as soon as it is parsed
     :param web_driver: Selenium driver object
     :param search_items: list of web elements found by selenium once a search is performed with user query
-    :return: list of job dicts
+    :param dedup: index of the scrape's postings so far, near-duplicates get marked, see app.dedup
+    :param stored: job key -> job dict of postings taken from the posting store instead of opened
+    :return: generator of Job objects
     """
-    try:
-        jobs = []
-        for title in tqdm(search_items):
-            title.find_element_by_xpath('..').click()
+    stored = stored or {}
+    limiter = get_limiter()
+    lean = use_lean_browser()
+    previous_desc = None
+    for title in tqdm(search_items):
+        job_key = get_job_key(title)
+        if job_key in stored:
+            # scraped recently by another query, no need to open it
+            a_job = Job.from_record(stored[job_key])
+            metrics.count("posting_reused")
+            if dedup is not None:
+                with metrics.stage("dedup"):
+                    if dedup.mark(a_job):
+                        metrics.count("duplicate")
+            yield a_job
+            continue
+        try:
+            a_job, previous_desc = open_posting(web_driver, title, job_key, limiter, lean, previous_desc)
+        except POSTING_ERRORS as err:
+            # this posting's panel didn't load, the next ones still can
+            print(f"Error retrieving job info: " + str(err))
+            continue
+        # BlockedError and driver errors (e.g. the browser died) propagate, so the page isn't marked
+        # done and is redone on resume
+        if dedup is not None:
+            with metrics.stage("dedup"):
+                if dedup.mark(a_job):
+                    metrics.count("duplicate")
+        yield a_job
+
+
+def open_posting(web_driver: WebDriver, title, job_key: str, limiter, lean: bool, previous_desc) -> tuple:
+    """
+    Click a search result and parse the posting shown in the details panel.
+    :param title: job title web element from searchable_items
+    :param limiter: per-host rate limiter, see app.throttle.get_limiter
+    :param lean: wait for the panel the lean way, see use_lean_browser
+    :param previous_desc: description element of the posting opened before, None for the first
+    :return: tuple of the Job and its description element
+    """
+    # politeness is paced per host by the shared token bucket instead of a fixed sleep
+    page_url = web_driver.current_url
+    with metrics.stage("throttle"):
+        limiter.acquire(page_url)
+    start = monotonic()
+    with metrics.stage("click"):
+        title_text = title.text.strip() if lean else None
+        title.find_element_by_xpath('..').click()
+        if not lean:
             web_driver.implicitly_wait(5)
-            job_container = WebDriverWait(web_driver, 5).until(
-                EC.presence_of_element_located((By.ID, "vjs-container"))
-            )
-            info_container = job_container.find_element_by_id("vjs-jobinfo")
-            job_title = info_container.find_element_by_id("vjs-jobtitle").text
-            job_cp = info_container.find_element_by_id("vjs-cn").text
-            job_loc = info_container.find_element_by_id("vjs-loc").text
-            job_desc = job_container.find_element_by_id("vjs-desc").text
-
-            full_chunk = str(info_container.text)
-
-            # create new Job object
-            a_job = Job(job_title, job_cp, job_loc, job_desc, full_chunk)
-            jobs.append(a_job.as_dict())
-            sleep(1+random.random()*4)
-        return jobs
-    except Exception as err:
-        print(f"Error retrieving job info: " + str(err))
+    try:
+        with metrics.stage("wait"):
+            if lean:
+                # done as soon as the panel shows the clicked posting, polled every 100ms
+                job_container = WebDriverWait(web_driver, 5, poll_frequency=0.1).until(
+                    posting_shown(previous_desc, title_text))
+            else:
+                job_container = WebDriverWait(web_driver, 5).until(
+                    EC.presence_of_element_located((By.ID, "vjs-container"))
+                )
+    except Exception:
+        blocked = "captcha" in web_driver.page_source
+        limiter.record(page_url, monotonic() - start, ok=False, blocked=blocked)
+        if blocked:
+            raise BlockedError(f"Captcha on {page_url}")
+        raise
+    limiter.record(page_url, monotonic() - start)
+    with metrics.stage("parse"):
+        info_container = job_container.find_element_by_id("vjs-jobinfo")
+        job_title = info_container.find_element_by_id("vjs-jobtitle").text
+        job_cp = info_container.find_element_by_id("vjs-cn").text
+        job_loc = info_container.find_element_by_id("vjs-loc").text
+        desc_element = job_container.find_element_by_id("vjs-desc")
+        job_desc = desc_element.text
+
+        full_chunk = str(info_container.text)
+
+        # create new Job object
+        return Job(job_title, job_cp, job_loc, job_desc, full_chunk, job_key), desc_element
 
 
 def has_next(web_driver: WebDriver) -> tuple:
@@ -118,12 +300,14 @@ def has_next(web_driver: WebDriver) -> tuple:
     """
     try:
         popup_handler(web_driver)
-        next_page = web_driver.find_element_by_xpath("//a[@aria-label='Next']")
+        with metrics.stage("next_page"):
+            next_page = web_driver.find_element_by_xpath("//a[@aria-label='Next']")
         if next_page.size != 0:
             return True, next_page
-    except Exception as err:
+    except NoSuchElementException as err:
+        # only a missing link ends the results, other errors (e.g. the browser died) propagate
         print(f"\nReached end of pagination. {err}")
-        return False, None
+    return False, None
 
 
 def popup_handler(web_driver: WebDriver) -> None:
@@ -133,33 +317,42 @@ def popup_handler(web_driver: WebDriver) -> None:
     :return:
     """
     try:
-        # check if there's a popup upon hitting the new page
-        popup_container = WebDriverWait(web_driver, 10).until(
-            EC.presence_of_element_located((By.ID, "popover-foreground"))
-        )
-        # if there is, close it and continue as usual
-        if popup_container.size != 0:
-            popup_container.find_element_by_xpath("//button[@aria-label='Close']").click()
+        with metrics.stage("popup"):
+            # check if there's a popup upon hitting the new page
+            if use_lean_browser():
+                # the page is ready by now, a popup is either in the DOM or not coming: look once, don't wait
+                popups = web_driver.find_elements_by_id("popover-foreground")
+                if not popups:
+                    return
+                popup_container = popups[0]
+            else:
+                popup_container = WebDriverWait(web_driver, 10).until(
+                    EC.presence_of_element_located((By.ID, "popover-foreground"))
+                )
+            # if there is, close it and continue as usual
+            if popup_container.size != 0:
+                popup_container.find_element_by_xpath("//button[@aria-label='Close']").click()
+                metrics.count("popup_closed")
     except Exception as err:
         print(f"\nPopup Handler {err}")
 
 
-def save_run_data(total_jobs: list, pages_wanted: int, pages_got: int, job: str, location: str) -> str:
+def save_run_data(total_jobs: list, pages_wanted: int, pages_got: int, job: str, location: str,
+                  started_at: datetime = None, summary: RunSummary = None) -> str:
     """
     Save scraped jobs from a particular run to minimize repeated scrapes.
     :param pages_got:
     :param location:
     :param job:
-    :param total_jobs:
+    :param total_jobs: list of job dicts, data-frame of jobs or pipeline.Segment streamed to disk
     :param pages_wanted:
+    :param started_at: when the scrape started, recorded in the run catalog
+    :param summary: analytics summary of total_jobs if already known, computed from the saved run otherwise
     :return:
     """
     # create data folder
-    Path(f"data/{job.strip().lower()}-{location.strip().lower()}").mkdir(parents=True, exist_ok=True)
-    file_path = Path(f"data/{job.strip().lower()}-{location.strip().lower()}")
-    # create df from data
-    jobs_df = pd.DataFrame(total_jobs)
-
+    file_path = catalog.get_data_dir() / catalog.query_key(job, location)
+    file_path.mkdir(parents=True, exist_ok=True)
     # naming convention
     file = ""
     # if requested is less than actual pages got, then clearly we have hit the maximal pages that query can ever return
@@ -168,63 +361,110 @@ def save_run_data(total_jobs: list, pages_wanted: int, pages_got: int, job: str,
         file += "maxscrape"
     else:
         file += "scrape"
-    file += datetime.now().strftime("_%d-%m-%Y_%H-%M-%S")
+    finished_at = datetime.now()
+    file += finished_at.strftime("_%d-%m-%Y_%H-%M-%S")
     file += f"_{pages_got}-pgs"
 
-    full_file_path = file_path / file
-
-    # save as a serialized pickle file
-    jobs_df.to_excel(full_file_path, engine='xlsxwriter', index=False)
+    # never overwrite a run saved within the same second (e.g. a quick incremental refresh)
+    run_name, duplicate = file, 0
+    while storage.run_file_path(file_path / run_name).exists():
+        duplicate += 1
+        run_name = f"{file}-{duplicate}"
+
+    # save as a compressed columnar file
+    with metrics.stage("save"):
+        if isinstance(total_jobs, pipeline.Segment):
+            full_file_path = storage.write_run_batches(total_jobs.iter_batches(), file_path / run_name)
+            row_count = total_jobs.count
+        else:
+            full_file_path = storage.write_run(total_jobs, file_path / run_name)
+            row_count = len(total_jobs)
+    catalog.record_run(job, location, pages_wanted, pages_got, row_count, full_file_path,
+                       started_at, finished_at)
+    # anything cached for this query was derived from an older run
+    get_run_cache().invalidate(catalog.query_key(job, location))
+    if search_index.use_search_index():
+        try:
+            with metrics.stage("index"):
+                search_index.index_saved_run(full_file_path)
+        except Exception as err:
+            # the run is saved either way, a later search_index.sync() indexes it
+            print(f"Error indexing run: " + str(err))
+    try:
+        with metrics.stage("summarize"):
+            if summary is not None:
+                summary.save(summary_path(full_file_path))
+            else:
+                load_summary(full_file_path)
+    except Exception as err:
+        # the analytics tabs build a missing summary on first use
+        print(f"Error summarizing run: " + str(err))
     print(f"Saved data into {full_file_path}\n")
     return full_file_path
 
 
-def read_last_run(job: str, location: str, pages_wanted: int) -> str:
+def store_postings(job: str, location: str, segment: pipeline.Segment, run_path: str,
+                   seen_at: datetime = None) -> None:
     """
-    Checks the "data" folder to find latest data output from previous runs.
+    Keep the postings of a finished scrape in the shared posting store, see app.posting_store.
+    :param run_path: run the postings were saved into, the store reads their descriptions from it
+    """
+    if not posting_store.use_posting_store():
+        return
+    try:
+        with metrics.stage("store"):
+            posting_store.add_postings(job, location, (record for batch in segment.iter_batches() for record in batch),
+                                       seen_at, run_path)
+    except Exception as err:
+        # the run is saved either way, its postings are just opened again by other queries
+        print(f"Error storing postings: " + str(err))
+
+
+def get_freshness_hours() -> float:
+    """
+    Age in hours after which a run is stale and searching its query scrapes again (RUN_FRESH_HOURS, default 20).
+    """
+    return float(getenv("RUN_FRESH_HOURS") or 20)
+
+
+def read_last_run(job: str, location: str, pages_wanted: int, freshness_hours: float = None) -> str:
+    """
+    Looks up the run catalog for the latest data output from previous runs.
+    :param freshness_hours: runs older than this are considered stale, see get_freshness_hours
     :return: string path to the latest created file based on recency/optimal needs
     """
-    existing_files = glob.glob(f"data/{job.strip().lower()}-{location.strip().lower()}/*")
+    # automatically purge older data files first so the run picked below is never one being removed
+    removed = catalog.apply_retention(job, location)
+    if removed:
+        print(f"Cleaned up {removed} older/unused files...\n")
+        search_index.sync()
+        if posting_store.use_posting_store():
+            posting_store.prune()
+
     latest_file = None
-    if existing_files:
+    freshness_hours = freshness_hours if freshness_hours is not None else get_freshness_hours()
+    check_date = datetime.now() - timedelta(hours=freshness_hours)
+    best = catalog.best_run(job, location, pages_wanted, check_date)
+
+    if best is not None:
         print("Found previous runs, preloading most recent/optimal data...\n")
-        max_pgs_scraped = 0
-        for file in existing_files:
-            curr_file_pgs = int(file.split('_')[3].split('-')[0])
-            if max_pgs_scraped < curr_file_pgs:
-                max_pgs_scraped = curr_file_pgs
-                latest_file = file
-
-        # check to see if all data was recently acquired (~ 10 hours)
-        latest_file_datetime = datetime.fromtimestamp(path.getctime(latest_file))
-        print(f"Max pages scraped is {max_pgs_scraped} on {latest_file_datetime}\n")
-        check_date = datetime.now() - timedelta(hours=20)
-
-        if latest_file.split('/')[2].startswith('scrape') and max_pgs_scraped < pages_wanted:
-            print(f"Requested more pages than maximum scraped till date {max_pgs_scraped}\n")
-            latest_file = None
-
-        # if date of creation of our data is older than 10 hours from present, get fresh data
-        if latest_file_datetime < check_date:
-            print("Data is stale, fetching new data...\n")
-            latest_file = None
-
-        # also automatically purge older data files
-        if len(existing_files) > 5:
-            print("Cleaning up and removing some older/unused files...\n")
-            oldest_file = min(existing_files, key=path.getctime)
-            remove(oldest_file)
+        print(f"Max pages scraped is {best['pages_got']} on {datetime.fromtimestamp(best['finished_at'])}\n")
+        latest_file = best["file_path"]
+    elif catalog.latest_run(job, location) is not None:
+        print("Previous runs are stale or have fewer pages than requested, fetching new data...\n")
 
     return latest_file
 
 
-def load_jobs_from_file(file_path: str) -> pd.DataFrame:
+def load_jobs_from_file(file_path: str, columns: list = None) -> pd.DataFrame:
     """
-    Read pickle file and create a pandas data-frame to be used
-    :param file_path: path to pickle file
+    Read a stored run and create a pandas data-frame to be used
+    :param file_path: path to the run file
+    :param columns: only load these columns (e.g. storage.TABLE_COLUMNS), all if None
     :return:
     """
-    job_df = pd.read_excel(file_path)
+    with metrics.stage("load"):
+        job_df = storage.read_run(file_path, columns)
     return job_df
 
 
@@ -241,68 +481,319 @@ def searchable_items(web_driver: WebDriver) -> list:
         popup_handler(web_driver)
         # then attempt to populate search results
 
-        search_results = web_driver.find_elements_by_xpath("//a[@data-tn-element='jobTitle']")
-        if search_results is not None:
-            return search_results
+        return web_driver.find_elements_by_xpath(result_titles)
     except Exception as err:
         print(f"\nCould not find job-titles from search " + str(err))
+        # a results page that can't be read isn't an empty one
+        raise
 
 
-def scrape_jobs(job: str, location: str, total_pages: int) -> tuple:
+def get_backend(backend: str = None) -> str:
     """
-    Call the webdriver and start the scraping process for fresh batch of job data
-    :return: tuple of list of jobs and total pages to scrape provided by user
+    Resolve which fetch backend to scrape with: "selenium" (default) drives Chrome,
+    "http" fetches and parses pages without a browser.
+    :param backend: explicit choice, falls back to the SCRAPER_BACKEND env variable
+    :return: backend name
     """
-    # initialize
-    all_jobs = []
-    max_actual_pages = None
+    backend = (backend or getenv("SCRAPER_BACKEND") or "selenium").strip().lower()
+    if backend not in ("selenium", "http"):
+        raise ValueError(f"Unknown scraper backend {backend!r}, expected 'selenium' or 'http'")
+    return backend
 
-    # Main Search
-    driver = search_job(job, location)
 
-    # Every job title in a page
-    for curr_page in range(0, total_pages):
-        start_time = datetime.now()
-        print(f"\nGathering data from page {curr_page + 1} of {total_pages}...\n")
-        search_results = searchable_items(driver)
-        all_jobs.extend(get_per_page_info(driver, search_results))
-        has_next_page, next_locator = has_next(driver)
-        elapsed_time = datetime.now() - start_time
-        logging.info(f"Page {curr_page + 1} done in {elapsed_time.total_seconds()}s")
-        max_actual_pages = curr_page + 1
-        if has_next_page:
-            next_locator.click()
-            continue
+def iter_selenium_jobs(job: str, location: str, total_pages: int, known_ids: set = None, start_page: int = 1,
+                       start_url: str = None, skip_ids: set = None):
+    """
+    Drive Chrome through the result pages of a query.
+    :param known_ids: see scrape_jobs
+    :param start_page: number of the first page to scrape, pages before it were done by an earlier scrape
+    :param start_url: URL of that page, the search form is used if None
+    :param skip_ids: job keys collected already, not opened again
+    :return: generator of Job objects, with a PageDone marker after every finished page
+    """
+    seen_ids = set(known_ids or ()) | set(skip_ids or ())
+    dedup = get_dedup_index()
+
+    # Main Search, on a warm driver borrowed from the pool instead of a fresh Chrome
+    with get_driver_pool().driver() as lease:
+        if start_url is not None:
+            driver = lease.driver
+            with metrics.stage("navigate"):
+                driver.get(start_url)
+            if use_lean_browser():
+                wait_for_results(driver)
         else:
-            break
+            driver = search_job(job, location, lease.driver)
+
+        # Every job title in a page
+        for curr_page in range(start_page - 1, total_pages):
+            start_time = datetime.now()
+            print(f"\nGathering data from page {curr_page + 1} of {total_pages}...\n")
+            search_results = searchable_items(driver)
+            page_ids = [get_job_key(item) for item in search_results]
+            new_results = [item for item, job_id in zip(search_results, page_ids)
+                           if job_id is None or job_id not in seen_ids]
+            new_ids = [job_id for job_id in page_ids if job_id is not None and job_id not in seen_ids]
+            seen_ids.update(job_id for job_id in page_ids if job_id is not None)
+            if known_ids is not None and search_results and not new_results:
+                print("\nCaught up with previously scraped postings.")
+                break
+            yield from get_per_page_info(driver, new_results, dedup, posting_store.reusable(new_ids))
+            has_next_page, next_locator = has_next(driver)
+            elapsed_time = datetime.now() - start_time
+            logging.info(f"Page {curr_page + 1} done in {elapsed_time.total_seconds()}s")
+            lease.pages = curr_page + 2 - start_page
+            if has_next_page:
+                next_locator.click()
+                if use_lean_browser():
+                    wait_for_results(driver)
+                yield pipeline.PageDone(curr_page + 1, driver.current_url)
+                continue
+            else:
+                yield pipeline.PageDone(curr_page + 1)
+                break
+
+
+def iter_jobs(job: str, location: str, total_pages: int, backend: str = None, known_ids: set = None,
+              start_page: int = 1, start_url: str = None, skip_ids: set = None):
+    """
+    Stream the postings of a query from the selected backend.
+    :param start_page, start_url, skip_ids: where to resume from, see iter_selenium_jobs
+    :return: generator of Job objects, with a PageDone marker after every finished page
+    """
+    if get_backend(backend) == "http":
+        return http_backend.iter_jobs(job, location, total_pages, known_ids, start_page, start_url, skip_ids)
+    return iter_selenium_jobs(job, location, total_pages, known_ids, start_page, start_url, skip_ids)
+
+
+def scrape_jobs(job: str, location: str, total_pages: int, backend: str = None, known_ids: set = None,
+                progress=None, resume: pipeline.Segment = None) -> tuple:
+    """
+    Call the webdriver and start the scraping process for fresh batch of job data. Jobs are streamed
+    into an on-disk segment as they are parsed, so a failure partway keeps everything scraped so far.
+    :param backend: fetch backend to use, see get_backend
+    :param known_ids: job keys already stored for this query. When given, the scrape is incremental:
+                      only new postings are opened and paging stops at the first page with nothing new
+    :param progress: optional app.tasks.ScrapeProgress updated as pages and postings complete
+    :param resume: checkpoint segment of an interrupted scrape (see pipeline.find_checkpoint) to carry on:
+                   scraping continues from its next page, appending to it, and its postings aren't opened again
+    :return: tuple of the pipeline.Segment holding the jobs, total pages to scrape provided by user
+             (lowered to the pages got if the scrape was interrupted) and pages actually scraped
+    """
+    query_dir = catalog.get_data_dir() / catalog.query_key(job, location)
+    meta = dict(job=job, location=location, pages_wanted=total_pages, incremental=known_ids is not None)
+    if resume is not None:
+        segment_path = resume.path
+        start_page, start_url, skip_ids = resume.pages_done + 1, resume.next_url, resume.job_ids()
+        max_actual_pages = resume.pages_done
+        print(f"Resuming from page {start_page} with {resume.count} postings already collected\n")
+        if progress is not None:
+            progress.resumed(resume.pages_done, resume.count)
+    else:
+        segment_path, start_page, start_url, skip_ids = pipeline.new_segment_path(query_dir), 1, None, None
+        max_actual_pages = 0
+
+    with pipeline.SegmentWriter(segment_path, meta) as segment:
+        try:
+            for item in iter_jobs(job, location, total_pages, backend, known_ids, start_page, start_url, skip_ids):
+                if isinstance(item, pipeline.PageDone):
+                    max_actual_pages = item.page
+                    segment.page_done(item.page, item.next_url)
+                    metrics.count("page_done")
+                    if progress is not None:
+                        progress.page_done(max_actual_pages)
+                else:
+                    segment.write_job(item.as_dict())
+                    metrics.count("posting_parsed")
+                    if progress is not None:
+                        progress.posting_parsed()
+        except PoolExhausted:
+            # nothing was scraped, the search fails instead of saving an empty run
+            metrics.count("pool_exhausted")
+            if resume is None:
+                segment.close()
+                segment.path.unlink(missing_ok=True)
+            raise
+        except Exception as err:
+            metrics.count("scrape_interrupted")
+            segment.interrupted(str(err))
+            print(f"Scrape interrupted, keeping the {segment.count} postings scraped so far: " + str(err))
+            # an interrupted run says nothing about how many pages the query can return
+            total_pages = max_actual_pages
+
+    return pipeline.Segment(segment.path), total_pages, max_actual_pages
+
+
+def use_resume(resume: bool = None) -> bool:
+    """
+    Whether interrupted scrapes are kept as checkpoints and resumed, from the argument or SCRAPE_RESUME (default on).
+    """
+    if resume is not None:
+        return resume
+    return (getenv("SCRAPE_RESUME") or "true").lower() in ("1", "true", "yes")
+
+
+def get_resume_max_age() -> timedelta:
+    """
+    How long a checkpoint stays resumable (SCRAPE_RESUME_MAX_HOURS, default 20). Older ones are discarded
+    since the results pages they point into have moved on.
+    """
+    return timedelta(hours=float(getenv("SCRAPE_RESUME_MAX_HOURS") or 20))
+
+
+def recover_abandoned_runs(job: str, location: str, keep_resumable: bool = False) -> int:
+    """
+    Save the postings of scrapes of this query that crashed or were killed before they were saved.
+    :param keep_resumable: leave segments that can still be resumed in place as checkpoints
+    :return: number of runs recovered
+    """
+    recovered = 0
+    for segment_path in pipeline.find_abandoned_segments(catalog.get_data_dir() / catalog.query_key(job, location)):
+        segment = pipeline.Segment(segment_path)
+        if keep_resumable and segment.resumable and segment.age() <= get_resume_max_age():
+            continue
+        # a checkpoint's postings were saved when its scrape was interrupted
+        if segment.count and segment.saved_as is None:
+            print(f"Recovering {segment.count} postings from an interrupted scrape...\n")
+            started_at = segment.meta.get("started_at")
+            run_path = save_run_data(segment, segment.pages_done, segment.pages_done, job, location,
+                                     datetime.fromisoformat(started_at) if started_at else None)
+            store_postings(job, location, segment, run_path, datetime.fromtimestamp(segment.path.stat().st_mtime))
+            recovered += 1
+        segment.remove()
+    return recovered
+
+
+def load_run_with_path(file_path: str, columns: list = None) -> pd.DataFrame:
+    """
+    load_jobs_from_file, remembering the source file in the frame's attrs so artifacts derived
+    from the frame can be cached next to the run.
+    """
+    jobs_df = load_jobs_from_file(file_path, columns)
+    jobs_df.attrs['run_path'] = str(file_path)
+    return jobs_df
+
+
+def load_cached_run(job: str, location: str, pages: int, file_path: str, columns: list = None) -> pd.DataFrame:
+    """
+    load_jobs_from_file through the in-process run cache, keyed by the normalized query and the
+    file's version so a rewritten file is never served stale.
+    :return: data-frame of the run, safe for the caller to add columns to
+    """
+    version = Path(file_path).stat().st_mtime_ns
+    key = (catalog.query_key(job, location), pages, tuple(columns) if columns else None, str(file_path), version)
+    jobs_df = get_run_cache().get_or_load(key, lambda: load_run_with_path(file_path, columns))
+    # shallow copy: callers adding derived columns must not grow the cached frame
+    return jobs_df.copy(deep=False)
+
+
+def merge_jobs(new_jobs: list, base_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge the postings of an incremental scrape into the dataset it was based on.
+    Newer postings go first and a posting already present (same job_id) is kept once.
+    :param new_jobs: list of job dicts scraped incrementally
+    :param base_df: previous run's jobs
+    :return: merged data-frame
+    """
+    new_df = pd.DataFrame.from_records(new_jobs, columns=storage.JOB_SCHEMA.names)
+    merged = pd.concat([new_df, base_df.astype(object)], ignore_index=True)
+    return merged[merged.job_id.isna() | ~merged.job_id.duplicated()]
+
+
+def use_incremental(incremental: bool = None) -> bool:
+    """
+    Whether stale runs are refreshed incrementally, from the argument or SCRAPER_INCREMENTAL (default on).
+    """
+    if incremental is not None:
+        return incremental
+    return (getenv("SCRAPER_INCREMENTAL") or "true").lower() in ("1", "true", "yes")
 
-    driver.quit()
 
-    return all_jobs, total_pages, max_actual_pages
+def use_run_profile() -> bool:
+    """
+    Whether a per-stage profile of every scrape is saved next to its run (SCRAPE_PROFILE, default off).
+    """
+    return (getenv("SCRAPE_PROFILE") or "false").lower() in ("1", "true", "yes")
 
 
-def initialize(job: str, location: str, pages: int = 120) -> pd.DataFrame:
+def initialize(job: str, location: str, pages: int = 120, backend: str = None, columns: list = None,
+               incremental: bool = None, progress=None, resume: bool = None, shards: int = None,
+               freshness_hours: float = None) -> pd.DataFrame:
     """
     Driver function
+    :param backend: fetch backend to scrape with if no usable previous run exists, see get_backend
+    :param columns: only load these columns of the run, all if None
+    :param incremental: refresh a stale run by scraping only postings newer than it, see use_incremental
+    :param progress: optional app.tasks.ScrapeProgress the scrape reports to
+    :param resume: continue an interrupted scrape of the query from its checkpoint, see use_resume
+    :param shards: worker processes a full scrape is split across, see app.shards.get_shard_workers
+    :param freshness_hours: reuse a previous run only if it is younger, see get_freshness_hours; 0 always scrapes
+                            (incrementally when a previous run covers enough pages)
     """
     # init
     jobs_df = None
     logging.disable(True)
     pages_to_scrape = int(getenv("PAGES") or pages)
+    if progress is not None:
+        progress.pages_total = pages_to_scrape
+    # runs saved as xlsx by older versions are converted once
+    storage.migrate_legacy_runs(catalog.get_data_dir())
+    # scrapes that died before saving are kept as runs of what they got
+    resume = use_resume(resume)
+    recover_abandoned_runs(job, location, keep_resumable=resume)
     # if prev runs exist, load data instead of scraping
-    latest_file_path = read_last_run(job, location, pages_to_scrape)
+    latest_file_path = read_last_run(job, location, pages_to_scrape, freshness_hours)
 
     if latest_file_path is not None:
-        jobs_df = load_jobs_from_file(latest_file_path)
+        jobs_df = load_cached_run(job, location, pages_to_scrape, latest_file_path, columns)
     else:
+        started_at = datetime.now()
         # set logging
         log_file = f"logs/run-{datetime.now()}.log"
         logging.basicConfig(filename=log_file, level=logging.INFO)
-        # run scraper and destructure out data for other functions
-        all_jobs, pages_wanted, pages_actual = scrape_jobs(job, location, pages_to_scrape)
-        # save all data from a run
-        data_file = save_run_data(all_jobs, pages_wanted, pages_actual, job, location)
-        jobs_df = load_jobs_from_file(data_file)
+        with metrics.profile_run() as profile:
+            query_dir = catalog.get_data_dir() / catalog.query_key(job, location)
+            checkpoint = pipeline.find_checkpoint(query_dir, pages_to_scrape, get_resume_max_age()) if resume else None
+            # a stale run that covered enough pages can be brought up to date with just the new postings
+            base_run = catalog.best_run(job, location, pages_to_scrape) \
+                if checkpoint is None and use_incremental(incremental) else None
+            base_df = load_jobs_from_file(base_run["file_path"]) if base_run is not None else None
+
+            if base_df is not None and "job_id" in base_df and base_df.job_id.notna().any():
+                segment, _, _ = scrape_jobs(job, location, pages_to_scrape, backend, set(base_df.job_id.dropna()),
+                                            progress)
+                print(f"Merging {segment.count} new postings into the previous run\n")
+                new_jobs = segment.read_records()
+                # the merged dataset covers the same pages as the run it extends, its analytics are the
+                # previous run's plus the new postings'
+                data_file = save_run_data(merge_jobs(new_jobs, base_df), base_run["pages_wanted"],
+                                          base_run["pages_got"], job, location, started_at,
+                                          extend_summary(base_run["file_path"], new_jobs, base_df))
+            elif checkpoint is None and (shards or get_shard_workers()) > 1:
+                segment, pages_wanted, pages_actual = scrape_sharded(job, location, pages_to_scrape, backend,
+                                                                     shards or get_shard_workers(), progress=progress)
+                data_file = save_run_data(segment, pages_wanted, pages_actual, job, location, started_at)
+            else:
+                # run scraper and destructure out data for other functions
+                segment, pages_wanted, pages_actual = scrape_jobs(job, location, pages_to_scrape, backend,
+                                                                  progress=progress, resume=checkpoint)
+                if segment.saved_as is not None and segment.pages_done == checkpoint.pages_done \
+                        and Path(segment.saved_as).exists():
+                    # the resume added nothing, the run saved from the checkpoint already holds it all
+                    data_file = segment.saved_as
+                else:
+                    # save all data from a run
+                    data_file = save_run_data(segment, pages_wanted, pages_actual, job, location, started_at)
+            store_postings(job, location, segment, data_file)
+        if use_run_profile():
+            profile.save(data_file)
+        if resume and segment.interrupted is not None and segment.resumable:
+            # what was scraped is saved as a (partial) run, the segment stays as the checkpoint to resume from
+            segment.mark_saved(data_file)
+            print(f"Kept a checkpoint, the next search of this query resumes from page {segment.pages_done + 1}\n")
+        else:
+            segment.remove()
+        jobs_df = load_cached_run(job, location, pages_to_scrape, data_file, columns)
 
     return jobs_df
 
@@ -310,5 +801,7 @@ def initialize(job: str, location: str, pages: int = 120) -> pd.DataFrame:
 # if run standalone, it will try to scrape 2 pages of Software Development Jobs
 # in Toronto, ON as a demo, and print out the dataframe to console
 if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
     print(initialize("Software Engineer", "Toronto, ON", 1))
 
@@ -0,0 +1,244 @@
+"""
+Full-text index over the postings of every stored run.
+
+Titles, companies, locations and descriptions are kept in an SQLite FTS5 inverted index inside
+the run catalog. A run is indexed when it is saved (runs saved before the index existed are
+picked up by sync), so searching never loads a run. Queries support implicit AND, AND/OR/NOT,
+-term exclusion, "quoted phrases", prefix* terms and column:term, and results are ranked with
+BM25, title matches weighing most. A posting kept by several runs is returned once, from the
+newest run.
+"""
+
+from contextlib import closing
+from os import getenv
+import re
+import sqlite3
+
+from app import catalog, storage
+
+INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS postings USING fts5(
+    title, company, location, description,
+    run_id UNINDEXED, row UNINDEXED, job_id UNINDEXED,
+    tokenize = "unicode61 tokenchars '+#'"
+);
+CREATE TABLE IF NOT EXISTS indexed_runs (
+    run_id INTEGER PRIMARY KEY,
+    first_rowid INTEGER NOT NULL,
+    last_rowid INTEGER NOT NULL
+);
+"""
+INDEXED_COLUMNS = ("title", "company", "location", "description")
+# bm25 weight of each indexed column, in INDEXED_COLUMNS order
+COLUMN_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+OPERATORS = ("AND", "OR", "NOT")
+query_token = re.compile(r'(?P<op>\b(?:AND|OR|NOT)\b)|(?P<paren>[()])|(?P<neg>-)?'
+                         r'(?:(?P<column>title|company|location|description):)?'
+                         r'(?:"(?P<phrase>[^"]*)"?|(?P<term>[^\s()"]+))')
+
+
+def use_search_index() -> bool:
+    """
+    Whether saved runs are indexed for full-text search (SEARCH_INDEX, default on).
+    """
+    return (getenv("SEARCH_INDEX") or "true").lower() in ("1", "true", "yes")
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Open the run catalog with the index tables created.
+    """
+    conn = catalog.connect()
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def build_match(query: str) -> str:
+    """
+    Translate a search box query into an FTS5 match expression. Every term is quoted, so
+    characters FTS5 would read as syntax (c++, node.js, ml/ai) are searched for as text.
+    Exclusions outside parentheses (-term, or NOT term with nothing before it to exclude from)
+    apply to the whole query wherever they are written, so '-java python' and 'NOT java python'
+    work although FTS5 can't start an expression with NOT.
+    :param query: e.g. 'python -java "machine learning" title:senior data*'
+    :return: FTS5 match expression
+    :raises ValueError: if the query has no term to match or joins an exclusion with OR or NOT
+    """
+    parts, excluded, depth, positive = [], [], 0, False
+    # negate: a leading NOT applies to the next term; after_exclusion: the last token was a moved exclusion
+    negate = after_exclusion = False
+    for match in query_token.finditer(query or ""):
+        operator = match.group("op")
+        if operator == "NOT" and depth == 0 and (not parts or parts[-1] in OPERATORS):
+            negate = True
+            continue
+        if operator is not None and after_exclusion:
+            if operator != "AND":
+                raise ValueError(f"Search query can't join an exclusion with {operator}")
+            # '-java AND python' means the same as '-java python'
+            continue
+        if operator or match.group("paren"):
+            parts.append(operator or match.group("paren"))
+            depth += {"(": 1, ")": -1}.get(match.group("paren"), 0)
+            after_exclusion = False
+            continue
+        text = match.group("phrase") if match.group("phrase") is not None else match.group("term")
+        prefix = text.endswith("*") and match.group("phrase") is None
+        text = text.rstrip("*") if prefix else text
+        if not text.strip():
+            continue
+        term = _quote(text) + ("*" if prefix else "")
+        if match.group("column"):
+            term = f"{match.group('column')}:{term}"
+        if not (match.group("neg") or negate):
+            parts.append(term)
+            positive = True
+            after_exclusion = False
+        elif depth > 0:
+            parts.append(f"NOT {term}")
+        else:
+            if parts and parts[-1] in OPERATORS:
+                if parts[-1] != "AND":
+                    raise ValueError(f"Search query can't join an exclusion with {parts[-1]}")
+                # 'python AND -java' means the same as 'python -java'
+                parts.pop()
+            excluded.append(term)
+            after_exclusion = True
+        negate = False
+    if negate:
+        raise ValueError("Search query has NOT without a term to exclude")
+    if not positive:
+        raise ValueError("Search query needs at least one term to match")
+    if not excluded:
+        return " ".join(parts)
+    return f"({' '.join(parts)})" + "".join(f" NOT {term}" for term in excluded)
+
+
+def _remove_runs(conn: sqlite3.Connection, runs: list) -> None:
+    for run in runs:
+        conn.execute("DELETE FROM postings WHERE rowid BETWEEN ? AND ?", (run["first_rowid"], run["last_rowid"]))
+        conn.execute("DELETE FROM indexed_runs WHERE run_id = ?", (run["run_id"],))
+
+
+def index_run(conn: sqlite3.Connection, run: sqlite3.Row) -> int:
+    """
+    Add a cataloged run's postings to the index, replacing what was indexed for it before.
+    :param run: row of the catalog's runs table
+    :return: number of postings indexed
+    """
+    columns = ["job_id", "title", "company", "location", "job_description"]
+    jobs_df = storage.read_run(run["file_path"], columns)
+    _remove_runs(conn, conn.execute("SELECT * FROM indexed_runs WHERE run_id = ?", (run["id"],)).fetchall())
+    first_rowid = conn.execute("SELECT coalesce(max(rowid), 0) + 1 FROM postings").fetchone()[0]
+    values = {name: jobs_df[name].astype(object).where(jobs_df[name].notna(), None).tolist()
+              if name in jobs_df else [None] * len(jobs_df) for name in columns}
+    conn.executemany(
+        "INSERT INTO postings (rowid, title, company, location, description, run_id, row, job_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ((first_rowid + row, title or "", company or "", location or "", description or "", run["id"], row, job_id)
+         for row, (job_id, title, company, location, description)
+         in enumerate(zip(*(values[name] for name in columns)))))
+    conn.execute("INSERT INTO indexed_runs (run_id, first_rowid, last_rowid) VALUES (?, ?, ?)",
+                 (run["id"], first_rowid, first_rowid + len(jobs_df) - 1))
+    return len(jobs_df)
+
+
+def index_saved_run(file_path: str) -> int:
+    """
+    Index a run right after it was saved and recorded in the catalog.
+    :return: number of postings indexed
+    """
+    with closing(connect()) as conn, conn:
+        run = conn.execute("SELECT * FROM runs WHERE file_path = ?", (str(file_path),)).fetchone()
+        return index_run(conn, run) if run is not None else 0
+
+
+def sync() -> tuple:
+    """
+    Bring the index in line with the catalog: index runs it lacks (e.g. saved before the index
+    existed) and drop the postings of runs removed by retention.
+    :return: tuple of runs indexed and runs removed
+    """
+    with closing(connect()) as conn, conn:
+        removed = conn.execute("SELECT * FROM indexed_runs WHERE run_id NOT IN (SELECT id FROM runs)").fetchall()
+        _remove_runs(conn, removed)
+        missing = conn.execute("SELECT * FROM runs WHERE id NOT IN (SELECT run_id FROM indexed_runs)").fetchall()
+        indexed = 0
+        for run in missing:
+            try:
+                index_run(conn, run)
+                indexed += 1
+            except Exception as err:
+                print(f"Error indexing run {run['file_path']}: " + str(err))
+    return indexed, len(removed)
+
+
+_synced = False
+
+
+def search(query: str, limit: int = 20, offset: int = 0, job: str = None, location: str = None) -> list:
+    """
+    Ranked full-text search over every stored run.
+    :param query: search box query, see build_match
+    :param limit: number of postings returned
+    :param offset: number of best ranked postings skipped, for paging
+    :param job: only search runs of this query, together with location
+    :param location: see job
+    :return: list of dicts with the posting's title, company, location and job_id, the run it is
+             from (query job/location, file path, row), its score (lower is better) and a
+             description snippet with the matches in [brackets]
+    """
+    global _synced
+    match = build_match(query)
+    if not _synced:
+        # once per process: runs saved by older versions, or by a process with indexing off
+        sync()
+        _synced = True
+
+    with closing(connect()) as conn:
+        runs = {run["id"]: run for run in conn.execute("SELECT * FROM runs")}
+        weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+        sql = (f"SELECT rowid, run_id, row, job_id, title, company, location, bm25(postings, {weights}) AS score "
+               "FROM postings WHERE postings MATCH ?")
+        params = [match]
+        if job is not None and location is not None:
+            key = catalog.query_key(job, location)
+            runs = {run_id: run for run_id, run in runs.items() if run["query_key"] == key}
+            sql += f" AND run_id IN ({', '.join('?' * len(runs))})"
+            params += list(runs)
+        sql += " ORDER BY score LIMIT ?"
+        # FTS5 ranks inside the index, only the best rows come out; a posting kept by several runs
+        # comes out once per run, so more rows are fetched until the page has enough distinct ones
+        fetch = (offset + limit) * 4
+        while True:
+            try:
+                fetched = conn.execute(sql, params + [fetch]).fetchall()
+            except sqlite3.OperationalError as err:
+                raise ValueError(f"Invalid search query: {err}")
+            rows = [row for row in fetched if row["run_id"] in runs]
+            # identical copies score the same, the newest run's copy goes first
+            rows.sort(key=lambda row: (row["score"], -runs[row["run_id"]]["finished_at"]))
+            distinct, seen = [], set()
+            for row in rows:
+                posting = row["job_id"] or (row["title"], row["company"], row["location"])
+                if posting not in seen:
+                    seen.add(posting)
+                    distinct.append(row)
+            if len(distinct) >= offset + limit or len(fetched) < fetch:
+                break
+            fetch *= 4
+        page = distinct[offset:offset + limit]
+        snippets = dict(conn.execute(
+            f"SELECT rowid, snippet(postings, 3, '[', ']', '...', 16) FROM postings WHERE postings MATCH ? "
+            f"AND rowid IN ({', '.join('?' * len(page))})", [match] + [row["rowid"] for row in page]).fetchall()) \
+            if page else {}
+
+    return [dict(title=row["title"], company=row["company"], location=row["location"], job_id=row["job_id"],
+                 query_job=runs[row["run_id"]]["job"], query_location=runs[row["run_id"]]["location"],
+                 file_path=runs[row["run_id"]]["file_path"], row=row["row"], score=row["score"],
+                 snippet=snippets.get(row["rowid"], "")) for row in page]
@@ -0,0 +1,206 @@
+"""
+Sharded scraping across worker processes.
+
+A large query is split into independent shards, either by results page offset (`start=`) or
+by sub-location, and each shard is scraped in its own process with its own browser or HTTP
+session and its own rate limiter. Every shard streams into its own segment; once all are
+done they are merged into one run, dropping postings seen by more than one shard (results
+shift while a query is being paged, so neighbouring offset shards overlap a little).
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from os import environ, getenv
+
+from app import catalog, pipeline
+from app.dedup import get_dedup_index
+from app.http_backend import RESULTS_PER_PAGE, build_search_url
+
+
+class Shard:
+
+    def __init__(self, index: int, job: str, location: str, first_page: int, pages: int, start_url: str = None):
+        """
+        Slice of a query scraped by one worker.
+        :param index: position of the shard, merged results keep shard order
+        :param location: location searched, the query's own or one of its sub-locations
+        :param first_page: number of the shard's first results page within its search
+        :param pages: number of results pages the shard covers
+        :param start_url: URL of the first page, None to start from the search form
+        """
+        self.index = index
+        self.job = job
+        self.location = location
+        self.first_page = first_page
+        self.pages = pages
+        self.start_url = start_url
+
+    @property
+    def last_page(self) -> int:
+        return self.first_page + self.pages - 1
+
+
+def plan_shards(job: str, location: str, total_pages: int, shards: int, locations: list = None) -> list:
+    """
+    Split a query into shards.
+    :param total_pages: pages wanted for the query
+    :param shards: number of offset shards, ignored when locations are given
+    :param locations: sub-locations to search instead of splitting by offset, total_pages each
+    :return: list of Shard
+    """
+    if locations:
+        return [Shard(index, job, sub_location, 1, total_pages) for index, sub_location in enumerate(locations)]
+    shards = max(1, min(shards, total_pages))
+    base, extra = divmod(total_pages, shards)
+    planned, first_page = [], 1
+    for index in range(shards):
+        pages = base + (1 if index < extra else 0)
+        start_url = None if first_page == 1 else build_search_url(job, location, (first_page - 1) * RESULTS_PER_PAGE)
+        planned.append(Shard(index, job, location, first_page, pages, start_url))
+        first_page += pages
+    return planned
+
+
+def _init_worker(rate: str = None) -> None:
+    # each worker process builds its own rate limiter, optionally with a per-shard budget
+    if rate:
+        environ["SCRAPER_RATE"] = rate
+
+
+def scrape_shard(shard: Shard, query_dir: str, backend: str = None) -> dict:
+    """
+    Scrape one shard into its own segment. Runs in a worker process.
+    :return: dict with the shard's index, segment path, pages done, whether its search ran out of
+             results and the error that interrupted it, if any
+    """
+    from app.scraper import iter_jobs
+
+    meta = dict(job=shard.job, location=shard.location, pages_wanted=shard.pages, incremental=False,
+                shard=shard.index)
+    reached_end, error = False, None
+    with pipeline.SegmentWriter(pipeline.new_segment_path(query_dir), meta) as segment:
+        try:
+            for item in iter_jobs(shard.job, shard.location, shard.last_page, backend, start_page=shard.first_page,
+                                  start_url=shard.start_url):
+                if isinstance(item, pipeline.PageDone):
+                    segment.page_done(item.page, item.next_url)
+                    # the next link is parsed even on the shard's last page, its absence is the end of the results
+                    reached_end = item.next_url is None
+                else:
+                    segment.write_job(item.as_dict())
+        except Exception as err:
+            segment.interrupted(str(err))
+            error = str(err)
+    last_done = pipeline.Segment(segment.path).pages_done
+    pages_done = last_done - shard.first_page + 1 if last_done else 0
+    return dict(index=shard.index, path=str(segment.path), pages_done=pages_done, reached_end=reached_end, error=error)
+
+
+def get_shard_workers() -> int:
+    """
+    Worker processes for sharded scrapes (SCRAPE_SHARDS, default 1 meaning sharding is off).
+    """
+    return int(getenv("SCRAPE_SHARDS") or 1)
+
+
+def get_shard_locations() -> list:
+    """
+    Sub-locations to shard by (SCRAPE_SHARD_LOCATIONS, ";" separated), empty to shard by page offset.
+    """
+    return [sub_location.strip() for sub_location in (getenv("SCRAPE_SHARD_LOCATIONS") or "").split(";")
+            if sub_location.strip()]
+
+
+def scrape_sharded(job: str, location: str, total_pages: int, backend: str = None, workers: int = None,
+                   locations: list = None, progress=None) -> tuple:
+    """
+    Scrape a query as shards in a process pool and merge them. Same contract as scraper.scrape_jobs.
+    :param workers: processes to run, see get_shard_workers
+    :param locations: sub-locations to shard by, see get_shard_locations
+    :param progress: optional app.tasks.ScrapeProgress, updated as shards finish
+    :return: tuple of the merged pipeline.Segment, pages wanted (lowered to the pages got if a shard
+             was interrupted) and pages got
+    """
+    workers = workers or get_shard_workers()
+    locations = locations if locations is not None else get_shard_locations()
+    query_dir = catalog.get_data_dir() / catalog.query_key(job, location)
+    query_dir.mkdir(parents=True, exist_ok=True)
+    shards = plan_shards(job, location, total_pages, workers, locations)
+    print(f"Scraping {len(shards)} shards with {min(workers, len(shards))} workers\n")
+
+    results = []
+    context = get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=context, initializer=_init_worker,
+                             initargs=(getenv("SCRAPER_SHARD_RATE"),)) as pool:
+        futures = [pool.submit(scrape_shard, shard, str(query_dir), backend) for shard in shards]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                # the worker process itself died, its segment is left for recovery
+                print(f"Error in scrape shard: " + str(err))
+                continue
+            if result["error"]:
+                print(f"Shard {result['index'] + 1} interrupted: {result['error']}")
+            results.append(result)
+            if progress is not None:
+                progress.page_done(sum(result["pages_done"] for result in results))
+    results.sort(key=lambda result: result["index"])
+    return merge_shards(job, location, total_pages, shards, results, query_dir, by_location=bool(locations))
+
+
+def merge_shards(job: str, location: str, total_pages: int, shards: list, results: list, query_dir,
+                 by_location: bool = False) -> tuple:
+    """
+    Merge shard segments in shard order into one segment, keeping the first copy of every posting.
+    Near-duplicates are marked again across shards, each shard only knew its own postings.
+    :param results: scrape_shard results of the shards that finished, in shard order
+    :param by_location: shards are sub-locations rather than page offsets
+    :return: see scrape_sharded
+    """
+    meta = dict(job=job, location=location, pages_wanted=total_pages, incremental=False, merged_shards=len(shards))
+    seen_ids = set()
+    dedup, renamed = get_dedup_index(), {}
+    with pipeline.SegmentWriter(pipeline.new_segment_path(query_dir), meta) as merged:
+        for result in results:
+            shard_segment = pipeline.Segment(result["path"])
+            for batch in shard_segment.iter_batches():
+                for record in batch:
+                    job_id = record.get("job_id")
+                    if job_id is not None and job_id in seen_ids:
+                        continue
+                    seen_ids.add(job_id)
+                    if dedup is not None:
+                        dedup.mark_record(record, renamed)
+                    merged.write_job(record)
+            shard_segment.remove()
+
+        if by_location:
+            # every sub-location covers the whole page range, the query got as far as the deepest one
+            pages_got = max((result["pages_done"] for result in results), default=0)
+            reached_end = all(result["reached_end"] for result in results)
+            interrupted = len(results) < len(shards) or any(result["error"] for result in results)
+        else:
+            # offset shards only count up to the first one that stopped short, shards past the end of
+            # the results have nothing to scrape and their failures don't matter
+            pages_got, reached_end, interrupted = 0, False, False
+            by_index = {result["index"]: result for result in results}
+            for shard in shards:
+                result = by_index.get(shard.index)
+                if result is None or result["error"]:
+                    interrupted = True
+                    break
+                pages_got += result["pages_done"]
+                if result["reached_end"]:
+                    reached_end = True
+                    break
+                if result["pages_done"] < shard.pages:
+                    break
+        if interrupted:
+            merged.interrupted("a shard was interrupted")
+    merged_segment = pipeline.Segment(merged.path)
+    print(f"Merged {merged_segment.count} unique postings from {len(results)} shards\n")
+    if interrupted or (pages_got < total_pages and not reached_end):
+        # a run cut short says nothing about how many pages the query can return
+        total_pages = pages_got
+    return merged_segment, total_pages, pages_got
@@ -0,0 +1,166 @@
+"""
+Columnar storage for scraped runs.
+
+Runs are written as zstd compressed Parquet files with an explicit schema (Decimal salaries,
+boolean flags, dictionary encoded categoricals) and read back memory-mapped, optionally
+projecting only the columns a caller needs.
+"""
+
+from decimal import Decimal
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RUN_SUFFIX = ".parquet"
+LEGACY_MARKER = ".migrated-parquet"
+
+categorical = pa.dictionary(pa.int32(), pa.string())
+salary = pa.decimal128(12, 2)
+
+JOB_SCHEMA = pa.schema([
+    pa.field("job_id", pa.string()),
+    pa.field("title", pa.string()),
+    pa.field("company", categorical),
+    pa.field("location", categorical),
+    pa.field("job_description", pa.string()),
+    pa.field("is_responsive", pa.bool_()),
+    pa.field("salary_base", salary),
+    pa.field("salary_upper", salary),
+    pa.field("salary_period", categorical),
+    pa.field("salary_annual_base", pa.float64()),
+    pa.field("salary_annual_upper", pa.float64()),
+    pa.field("job_type", categorical),
+    # job_id of the posting a near-duplicate was matched to, None for original postings
+    pa.field("duplicate_of", pa.string()),
+])
+
+# everything the jobs DataTable shows, i.e. all but the (large) description
+TABLE_COLUMNS = [name for name in JOB_SCHEMA.names if name != "job_description"]
+
+
+def to_table(records) -> pa.Table:
+    """
+    Build an Arrow table with the job schema from Job.as_dict() records.
+    :param records: list of job dicts, a data-frame with the job columns or the columns dict of job.parse_jobs
+    :return: table conforming to JOB_SCHEMA
+    """
+    if isinstance(records, pd.DataFrame):
+        frame = records.reindex(columns=JOB_SCHEMA.names)
+        for name in JOB_SCHEMA.names:
+            if name not in records:
+                # runs stored before a column existed: all missing, not all-NaN floats
+                frame[name] = pd.Series([None] * len(frame), index=frame.index, dtype=object)
+        return pa.Table.from_pandas(frame, schema=JOB_SCHEMA, preserve_index=False)
+    if isinstance(records, dict):
+        rows = len(next(iter(records.values()), []))
+        columns = {name: records[name] if name in records else [None] * rows for name in JOB_SCHEMA.names}
+        return pa.Table.from_pydict(columns, schema=JOB_SCHEMA)
+    columns = {name: [record.get(name) for record in records] for name in JOB_SCHEMA.names}
+    return pa.Table.from_pydict(columns, schema=JOB_SCHEMA)
+
+
+def run_file_path(file_path: Path) -> Path:
+    """
+    file_path with RUN_SUFFIX appended if missing.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix != RUN_SUFFIX:
+        file_path = file_path.with_name(file_path.name + RUN_SUFFIX)
+    return file_path
+
+
+def write_run(records, file_path: Path) -> Path:
+    """
+    Persist the jobs of a run.
+    :param records: list of job dicts, a data-frame of jobs or a dict of columns such as job.parse_jobs builds
+    :param file_path: destination, RUN_SUFFIX is appended if missing
+    :return: path actually written
+    """
+    file_path = run_file_path(file_path)
+    pq.write_table(to_table(records), file_path, compression="zstd")
+    return file_path
+
+
+def write_run_batches(batches, file_path: Path) -> Path:
+    """
+    Persist a run streamed in batches, one row group per batch, so it never has to be in memory whole.
+    :param batches: iterable of lists of job dicts
+    :param file_path: destination, RUN_SUFFIX is appended if missing
+    :return: path actually written
+    """
+    file_path = run_file_path(file_path)
+    with pq.ParquetWriter(file_path, JOB_SCHEMA, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_table(to_table(batch))
+    return file_path
+
+
+def read_run(file_path: Path, columns: list = None) -> pd.DataFrame:
+    """
+    Memory-map a stored run into a data-frame.
+    :param file_path: path of a run written by write_run
+    :param columns: only read these columns, all if None
+    :return: data-frame of the run's jobs
+    """
+    if columns is not None:
+        # runs saved by older versions may lack newer columns such as job_id
+        available = set(pq.read_schema(file_path).names)
+        columns = [column for column in columns if column in available]
+    table = pq.read_table(file_path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def is_legacy_run(file_path: Path) -> bool:
+    """
+    Runs saved before the switch to Parquet are extension-less xlsx files.
+    """
+    file_path = Path(file_path)
+    return file_path.is_file() and file_path.suffix == "" and not file_path.name.startswith(".")
+
+
+def migrate_legacy_run(file_path: Path) -> Path:
+    """
+    Rewrite an old xlsx run as Parquet next to it, keeping its name (and so its run metadata),
+    and remove the original.
+    :param file_path: path to the xlsx run
+    :return: path of the Parquet run
+    """
+    file_path = Path(file_path)
+    legacy_df = pd.read_excel(file_path)
+    legacy_df = legacy_df.astype(object).where(legacy_df.notna(), None)
+    # written column by column, the run is never turned into a dict per posting
+    columns = {name: legacy_df[name].tolist() for name in legacy_df.columns if name in JOB_SCHEMA.names}
+    # excel hands salaries back as floats
+    for name in ("salary_base", "salary_upper"):
+        if name in columns:
+            columns[name] = [None if value is None else Decimal(str(value)) for value in columns[name]]
+    new_path = write_run(columns, file_path)
+    file_path.unlink()
+    return new_path
+
+
+def migrate_legacy_runs(data_dir: str = "data") -> int:
+    """
+    One-off migration of every xlsx run under data_dir. A marker file records that it ran
+    so later calls return immediately.
+    :param data_dir: root of the data folder
+    :return: number of runs migrated
+    """
+    root = Path(data_dir)
+    marker = root / LEGACY_MARKER
+    if not root.is_dir() or marker.exists():
+        return 0
+    migrated = 0
+    for file_path in root.glob("*/*"):
+        if is_legacy_run(file_path):
+            try:
+                migrate_legacy_run(file_path)
+                migrated += 1
+            except Exception as err:
+                print(f"Error migrating {file_path}: " + str(err))
+    marker.touch()
+    if migrated:
+        print(f"Migrated {migrated} xlsx runs to Parquet\n")
+    return migrated
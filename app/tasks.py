@@ -0,0 +1,185 @@
+"""
+Background runner for scrape requests.
+
+Submitting a query returns a task handle right away while initialize() runs on a worker thread.
+Identical queries submitted while one is in flight attach to the same task (single-flight), and
+the scraper loop reports pages done and postings parsed into the task's progress for polling.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+from threading import Event, Lock
+from uuid import uuid4
+
+from app.catalog import query_key
+
+
+class ScrapeProgress:
+
+    def __init__(self, pages_total: int = None):
+        """
+        Progress of a running scrape, updated from the scraper loop.
+        :param pages_total: pages requested
+        """
+        self.pages_total = pages_total
+        self.pages_done = 0
+        # pages an interrupted scrape did before this one resumed it, they took none of this one's time
+        self.pages_resumed = 0
+        self.postings_parsed = 0
+        self.started_at = datetime.now()
+        self.lock = Lock()
+
+    def page_done(self, pages_done: int) -> None:
+        with self.lock:
+            self.pages_done = pages_done
+
+    def resumed(self, pages_done: int, postings: int) -> None:
+        """
+        Start from the pages and postings of the checkpoint a scrape resumes.
+        """
+        with self.lock:
+            self.pages_done = self.pages_resumed = pages_done
+            self.postings_parsed += postings
+
+    def posting_parsed(self, count: int = 1) -> None:
+        with self.lock:
+            self.postings_parsed += count
+
+    def eta_seconds(self) -> float:
+        """
+        Seconds left assuming the remaining pages take as long as the ones this scrape finished, None if unknown.
+        """
+        with self.lock:
+            pages_this_run = self.pages_done - self.pages_resumed
+            if pages_this_run <= 0 or not self.pages_total:
+                return None
+            elapsed = (datetime.now() - self.started_at).total_seconds()
+            return elapsed / pages_this_run * max(0, self.pages_total - self.pages_done)
+
+    def as_dict(self) -> dict:
+        eta = self.eta_seconds()
+        with self.lock:
+            return dict(
+                pages_done=self.pages_done,
+                pages_total=self.pages_total,
+                postings_parsed=self.postings_parsed,
+                elapsed_seconds=(datetime.now() - self.started_at).total_seconds(),
+                eta_seconds=eta,
+            )
+
+
+class ScrapeTask:
+
+    def __init__(self, key: tuple, job: str, location: str, pages: int):
+        self.id = uuid4().hex
+        self.key = key
+        self.job = job
+        self.location = location
+        self.pages = pages
+        self.status = "pending"
+        self.progress = ScrapeProgress(pages)
+        self.rows = None
+        # the run the task loaded or saved, callers load it from there instead of searching again
+        self.run_path = None
+        self.error = None
+        self.finished_at = None
+        self.finished = Event()
+
+    def done(self) -> bool:
+        return self.finished.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until the task finishes or timeout passes.
+        :return: True if the task finished
+        """
+        return self.finished.wait(timeout)
+
+    def as_dict(self) -> dict:
+        return dict(id=self.id, job=self.job, location=self.location, pages=self.pages, status=self.status,
+                    rows=self.rows, error=self.error, **self.progress.as_dict())
+
+
+class TaskRunner:
+
+    def __init__(self, max_workers: int = 2, keep_finished: int = 100):
+        """
+        :param max_workers: scrapes allowed to run at once
+        :param keep_finished: finished tasks remembered for polling before the oldest are forgotten
+        """
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scrape")
+        self.keep_finished = keep_finished
+        self.tasks = {}
+        self.in_flight = {}
+        self.lock = Lock()
+
+    def submit(self, job: str, location: str, pages: int, **kwargs) -> ScrapeTask:
+        """
+        Load or scrape a query in the background.
+        :param kwargs: passed through to initialize()
+        :return: the in-flight task for the same query if there is one, else a new task
+        """
+        options = tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                               for name, value in kwargs.items()))
+        key = (query_key(job, location), int(pages), options)
+        with self.lock:
+            task = self.in_flight.get(key)
+            if task is not None:
+                return task
+            task = ScrapeTask(key, job, location, pages)
+            self.tasks[task.id] = task
+            self.in_flight[key] = task
+            self._forget_finished()
+        self.pool.submit(self._run, task, kwargs)
+        return task
+
+    def _run(self, task: ScrapeTask, kwargs: dict) -> None:
+        # imported here so the runner doesn't pull the scraping engine in at import time
+        from app.scraper import initialize
+        task.status = "running"
+        task.progress.started_at = datetime.now()
+        try:
+            # the frame itself isn't kept, once the run is saved callers load it through the run cache
+            jobs_df = initialize(task.job, task.location, task.pages, progress=task.progress, **kwargs)
+            task.rows = len(jobs_df)
+            task.run_path = jobs_df.attrs['run_path']
+            task.status = "done"
+        except Exception as err:
+            task.error = str(err)
+            task.status = "failed"
+            print(f"Error running scrape task {task.id}: " + str(err))
+        finally:
+            task.finished_at = datetime.now()
+            with self.lock:
+                self.in_flight.pop(task.key, None)
+            task.finished.set()
+
+    def _forget_finished(self) -> None:
+        finished = [task for task in self.tasks.values() if task.done()]
+        finished.sort(key=lambda task: task.finished_at)
+        for task in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.tasks[task.id]
+
+    def get(self, task_id: str) -> ScrapeTask:
+        """
+        Look up a task by id.
+        :return: task, None if unknown or forgotten
+        """
+        with self.lock:
+            return self.tasks.get(task_id)
+
+
+_runner = None
+_runner_lock = Lock()
+
+
+def get_runner() -> TaskRunner:
+    """
+    Process-wide task runner running up to SCRAPE_TASK_WORKERS scrapes at once.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = TaskRunner(max_workers=int(getenv("SCRAPE_TASK_WORKERS") or 2))
+        return _runner
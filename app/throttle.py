@@ -0,0 +1,169 @@
+"""
+Politeness control shared by every request the scraper makes.
+
+A token bucket per host caps the request rate regardless of how many workers are in flight.
+The adaptive variant backs off multiplicatively when the server slows down, errors or serves
+a captcha and creeps back up additively while responses are healthy (AIMD).
+"""
+
+from os import getenv
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+
+class BlockedError(Exception):
+    """Raised when the site answers with a block or captcha page instead of content."""
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Classic token bucket.
+        :param rate: tokens added per second
+        :param burst: bucket capacity, i.e. how many requests may go out back to back
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """
+        Block until a token is available and take it.
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            sleep(delay)
+            waited += delay
+
+    def record(self, latency: float, ok: bool = True, blocked: bool = False) -> None:
+        """
+        Feedback hook about the request a token was spent on. The fixed bucket ignores it.
+        :param latency: seconds the request took
+        :param ok: False if the request failed
+        :param blocked: True if the response was a captcha/block page
+        """
+
+
+class AdaptiveTokenBucket(TokenBucket):
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = None, max_rate: float = None,
+                 slow_factor: float = 2.0, step: float = None):
+        """
+        Token bucket whose rate follows the server's health.
+        :param rate: starting rate in requests per second
+        :param min_rate: floor the rate is never backed off below
+        :param max_rate: ceiling the rate never grows above
+        :param slow_factor: a response is "slow" when its latency exceeds this multiple of the average
+        :param step: rate added after every healthy response
+        """
+        super().__init__(rate, burst)
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.max_rate = max_rate if max_rate is not None else rate * 4
+        self.slow_factor = slow_factor
+        self.step = step if step is not None else rate / 20
+        self.avg_latency = None
+
+    def record(self, latency: float, ok: bool = True, blocked: bool = False) -> None:
+        with self.lock:
+            slow = self.avg_latency is not None and latency > self.avg_latency * self.slow_factor
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            if blocked:
+                self.rate = self.min_rate
+                self.tokens = min(self.tokens, 0.0)
+            elif not ok or slow:
+                self.rate = max(self.min_rate, self.rate / 2)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.step)
+
+
+class HostRateLimiter:
+
+    def __init__(self, rate: float, burst: int = 1, adaptive: bool = True):
+        """
+        Hands out one bucket per host so politeness is enforced per site, shared across workers.
+        :param rate: requests per second allowed per host
+        :param burst: bucket capacity per host
+        :param adaptive: use AdaptiveTokenBucket instead of a fixed rate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.adaptive = adaptive
+        self.buckets = {}
+        self.lock = Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        """
+        Bucket responsible for the host of url.
+        :param url: absolute URL about to be requested
+        :return: shared bucket for that host
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                bucket_cls = AdaptiveTokenBucket if self.adaptive else TokenBucket
+                self.buckets[host] = bucket_cls(self.rate, self.burst)
+            return self.buckets[host]
+
+    def acquire(self, url: str) -> float:
+        return self.bucket(url).acquire()
+
+    def record(self, url: str, latency: float, ok: bool = True, blocked: bool = False) -> None:
+        self.bucket(url).record(latency, ok, blocked)
+
+
+_limiter = None
+_limiter_lock = Lock()
+
+
+def get_limiter() -> HostRateLimiter:
+    """
+    Process-wide limiter configured from SCRAPER_RATE (requests/s per host), SCRAPER_BURST
+    and SCRAPER_ADAPTIVE.
+    :return: shared HostRateLimiter
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = HostRateLimiter(
+                rate=float(getenv("SCRAPER_RATE") or 0.5),
+                burst=int(getenv("SCRAPER_BURST") or 2),
+                adaptive=(getenv("SCRAPER_ADAPTIVE") or "true").lower() in ("1", "true", "yes"),
+            )
+        return _limiter
+
+
+def get_workers() -> int:
+    """
+    Number of postings/result pages kept in flight at once, from SCRAPER_WORKERS.
+    :return: worker count, 1 means strictly sequential
+    """
+    return max(1, int(getenv("SCRAPER_WORKERS") or 4))
+
+
+def looks_blocked(status_code: int, body: str) -> bool:
+    """
+    Heuristic for Indeed's block/captcha responses.
+    :param status_code: HTTP status of the response
+    :param body: response body
+    :return: True if the response should be treated as a block
+    """
+    if status_code in (403, 429):
+        return True
+    lowered = body[:20000].lower()
+    return "captcha" in lowered and "jobdescriptiontext" not in lowered and "data-jk" not in lowered
@@ -0,0 +1,7 @@
+"""
+Offline benchmark suite.
+
+`python -m benchmarks.run` times the scraper's hot paths against the saved Indeed pages in
+fixtures/ and synthetic runs, and stores the results as JSON under benchmarks/results/.
+`python -m benchmarks.compare OLD NEW` reports what got slower between two stored results.
+"""
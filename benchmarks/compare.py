@@ -0,0 +1,62 @@
+"""
+Compare two stored benchmark results.
+
+Usage: python -m benchmarks.compare OLD NEW [--threshold 0.1]
+OLD and NEW are results files or labels under benchmarks/results/. Exits with status 1 when a
+case got slower than the threshold allows or NEW went over a budget (e.g. the startup import
+budget), so it can gate a release.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import sys
+
+from benchmarks.run import results_dir
+
+
+def load_results(name: str) -> dict:
+    path = Path(name)
+    if not path.is_file():
+        path = results_dir / f"{name}.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> list:
+    """
+    Match cases by name and size and compare their median times.
+    :param threshold: relative slowdown (0.1 = 10%) above which a case counts as a regression
+    :return: list of (name, size, old median, new median, relative change, regressed) tuples
+    """
+    old_by_case = {(result["name"], result["size"]): result["median"] for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        key = (result["name"], result["size"])
+        if key not in old_by_case:
+            continue
+        change = result["median"] / old_by_case[key] - 1 if old_by_case[key] else 0.0
+        rows.append((*key, old_by_case[key], result["median"], change, change > threshold))
+    return rows
+
+
+def main(argv: list = None) -> int:
+    parser = ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    old, new = load_results(args.old), load_results(args.new)
+    print(f"{old.get('commit')} ({old['created_at']}) -> {new.get('commit')} ({new['created_at']})\n")
+    rows = compare(old, new, args.threshold)
+    for name, size, old_median, new_median, change, regressed in rows:
+        print(f"{name:<32} {size if size is not None else '':>8} {old_median * 1000:>10.2f} ms "
+              f"{new_median * 1000:>10.2f} ms {change:>+8.1%}" + ("  REGRESSION" if regressed else ""))
+    over_budget = [result["name"] for result in new["results"] if result.get("over_budget")]
+    for name in over_budget:
+        print(f"{name} is over its budget")
+    return 1 if any(row[-1] for row in rows) or over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+Run the benchmark suite and store its results.
+
+Everything runs offline: scraping is served by fixtures.server and runs are written to a
+temporary data folder, so the numbers don't depend on Indeed or on the local data/ folder.
+
+Usage: python -m benchmarks.run [--sizes 1000,10000,100000] [--repeat 3] [--label NAME] [--only CASE,...]
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+repo_dir = Path(__file__).parent.parent
+results_dir = Path(__file__).parent / "results"
+fixture_dir = Path(__file__).parent.parent / "fixtures" / "indeed"
+
+BENCH_JOB = "Benchmark Developer"
+BENCH_LOCATION = "Toronto, ON"
+
+words = ("team experience design build maintain services customers product data systems cloud scale "
+         "develop support code review ownership agile delivery quality testing platform mobile web "
+         "security performance collaborate stakeholders requirements analysis reporting").split()
+skills = ("Python Java JavaScript TypeScript C++ C# Golang SQL React Node.js Django Spring AWS Azure "
+          "Docker k8s Kubernetes Terraform PostgreSQL MongoDB Kafka Spark Linux Git CI/CD").split()
+companies = [f"Company {i}" for i in range(500)]
+locations = ["Toronto, ON", "Remote", "Mississauga, ON", "Markham, ON", "Vaughan, ON", "Ottawa, ON"]
+titles = ["Software Developer", "Senior Software Engineer", "Data Engineer", "Full Stack Developer",
+          "DevOps Engineer", "QA Analyst", "Backend Developer", "Machine Learning Engineer"]
+info_chunks = ["$85,000 - $110,000 a year - Full-time", "$40 - $55 an hour - Contract", "Full-time, Permanent",
+               "$6,000 a month\nResponded to 75% or more applications", "Part-time", "$1,500 a week - Temporary"]
+
+
+def synthetic_records(count: int, seed: int = 0, description_words: int = 250) -> list:
+    """
+    Raw postings shaped like what the backends scrape, as parse_jobs input.
+    :return: list of (title, company, location, job_description, extra_info, job_id) tuples
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(words * 4 + skills)
+    tokens = vocabulary[rng.integers(0, len(vocabulary), size=(count, description_words))]
+    pick = rng.integers(0, 1 << 30, size=(count, 4))
+    return [(titles[a % len(titles)], companies[b % len(companies)], locations[c % len(locations)],
+             " ".join(row), info_chunks[d % len(info_chunks)], f"{seed:04x}{index:012x}")
+            for index, (row, (a, b, c, d)) in enumerate(zip(tokens, pick))]
+
+
+def synthetic_frame(count: int, seed: int = 0) -> pd.DataFrame:
+    from app.job import parse_jobs
+    return pd.DataFrame(parse_jobs(synthetic_records(count, seed)))
+
+
+def measure(name: str, func, size: int = None, repeat: int = 3, items: int = None) -> dict:
+    """
+    Time func() repeat times.
+    :param items: units of work per call (postings, pages...) to report throughput for
+    :return: result record
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = perf_counter()
+        func()
+        seconds.append(perf_counter() - started)
+    result = dict(name=name, size=size, repeat=repeat, seconds=seconds, median=median(seconds), min=min(seconds))
+    if items:
+        result["items_per_second"] = items / result["median"]
+    print(f"{name:<32} {size if size is not None else '':>8} {result['median'] * 1000:>12.2f} ms"
+          + (f" {result['items_per_second']:>14.0f} /s" if items else ""))
+    return result
+
+
+def bench_parse(sizes: list, repeat: int) -> list:
+    from app.job import Job, parse_jobs
+    results = []
+    for size in sizes:
+        records = synthetic_records(size)
+        results.append(measure("parse.job_objects", lambda: [Job(*record[:5], job_id=record[5]).as_dict()
+                                                             for record in records], size, repeat, size))
+        results.append(measure("parse.batch_columns", lambda: parse_jobs(records), size, repeat, size))
+    return results
+
+
+def bench_html(repeat: int) -> list:
+    from app.http_backend import parse_search_page, parse_viewjob_page
+    search_page = (fixture_dir / "search_0.html").read_text(encoding="utf-8")
+    viewjob_pages = [path.read_text(encoding="utf-8") for path in sorted(fixture_dir.glob("viewjob_*.html"))]
+    rounds = 200
+    return [
+        measure("html.parse_search_page", lambda: [parse_search_page(search_page, "http://fixture/jobs")
+                                                   for _ in range(rounds)], None, repeat, rounds),
+        measure("html.parse_viewjob_page", lambda: [parse_viewjob_page(page) for _ in range(rounds)
+                                                    for page in viewjob_pages], None, repeat,
+                rounds * len(viewjob_pages)),
+    ]
+
+
+def bench_scrape(repeat: int) -> list:
+    from fixtures.server import FixtureServer
+    from app.scraper import scrape_jobs
+
+    def scrape():
+        segment, _, _ = scrape_jobs(BENCH_JOB, BENCH_LOCATION, 2, backend="http")
+        segment.remove()
+
+    with FixtureServer() as server:
+        os.environ["INDEED_BASE_URL"] = server.base_url
+        return [measure("scrape.http_fixture_2_pages", scrape, None, repeat, 2)]
+
+
+def bench_storage(sizes: list, repeat: int) -> list:
+    from app.scraper import save_run_data, load_jobs_from_file
+    from app.storage import TABLE_COLUMNS
+    results = []
+    for size in sizes:
+        frame = synthetic_frame(size)
+        saved = []
+        results.append(measure("storage.save_run_data", lambda: saved.append(
+            save_run_data(frame, 1, 1, f"{BENCH_JOB} {size}", BENCH_LOCATION)), size, repeat, size))
+        results.append(measure("storage.load_full", lambda: load_jobs_from_file(saved[-1]), size, repeat, size))
+        results.append(measure("storage.load_table_columns",
+                               lambda: load_jobs_from_file(saved[-1], TABLE_COLUMNS), size, repeat, size))
+    return results
+
+
+def bench_catalog(repeat: int, runs: int = 300) -> list:
+    from app.scraper import save_run_data, read_last_run
+    frame = synthetic_frame(10)
+    job = f"{BENCH_JOB} catalog"
+    # keep every run so each lookup sees all of them rather than the first one pruning them
+    os.environ["RUNS_TO_KEEP"] = str(runs * 2)
+    for pages in range(runs):
+        save_run_data(frame, pages % 50 + 1, pages % 50 + 1, job, BENCH_LOCATION)
+    return [measure("catalog.read_last_run", lambda: read_last_run(job, BENCH_LOCATION, 25), runs, repeat)]
+
+
+def bench_text(sizes: list, repeat: int) -> list:
+    from app.dashapp.skills import extract_skills
+    from app.dashapp.text import build_doc_term_matrix
+    results = []
+    for size in sizes:
+        descriptions = synthetic_frame(size).job_description
+        results.append(measure("text.format_data", lambda: build_doc_term_matrix(descriptions), size, repeat, size))
+        results.append(measure("text.extract_skills", lambda: extract_skills(descriptions), size, repeat, size))
+    return results
+
+
+def bench_search(sizes: list, repeat: int) -> list:
+    from app.scraper import save_run_data
+    from app.search_index import search
+    results = []
+    for size in sizes:
+        job = f"{BENCH_JOB} search {size}"
+        save_run_data(synthetic_frame(size, seed=size), 1, 1, job, BENCH_LOCATION)
+        for name, query in (("term", "kubernetes"), ("boolean", "title:senior AND (golang OR k8s) -java"),
+                            ("phrase", '"machine learning"')):
+            results.append(measure(f"search.{name}", lambda: search(query, job=job, location=BENCH_LOCATION),
+                                   size, repeat))
+    return results
+
+
+def bench_dash(sizes: list, repeat: int) -> list:
+    from app import init_app
+    from app.scraper import save_run_data
+    client = init_app().test_client()
+    results = []
+    for size in sizes:
+        job = f"{BENCH_JOB} dash {size}"
+        run_path = save_run_data(synthetic_frame(size), 1, 1, job, BENCH_LOCATION)
+        table_run = dict(job=job, location=BENCH_LOCATION, pages=1, run_path=str(run_path))
+        table_payload = {
+            "output": "..jobs-table.data...jobs-table.page_count..",
+            "outputs": [{"id": "jobs-table", "property": "data"}, {"id": "jobs-table", "property": "page_count"}],
+            "inputs": [{"id": "table-run", "property": "data", "value": table_run},
+                       {"id": "jobs-table", "property": "page_current", "value": 3},
+                       {"id": "jobs-table", "property": "page_size", "value": 25},
+                       {"id": "jobs-table", "property": "sort_by",
+                        "value": [{"column_id": "salary_annual_base", "direction": "desc"}]},
+                       {"id": "jobs-table", "property": "filter_query", "value": "{title} contains engineer"}],
+            "changedPropIds": ["jobs-table.page_current"],
+        }
+
+        def table_page():
+            response = client.post("/dashboard/_dash-update-component", json=table_payload)
+            assert response.status_code == 200, response.status_code
+
+        results.append(measure("dash.table_page.first", table_page, size, 1))
+        results.append(measure("dash.table_page.warm", table_page, size, repeat))
+        for tab in ("tech", "lang", "skill", "role"):
+            payload = {
+                "output": "tabs-content.children",
+                "outputs": {"id": "tabs-content", "property": "children"},
+                "inputs": [{"id": "graph-tabs", "property": "value", "value": tab},
+                           {"id": "table-run", "property": "data", "value": table_run}],
+                "state": [{"id": "search-task", "property": "data", "value": None}],
+                "changedPropIds": ["graph-tabs.value"],
+            }
+
+            def render():
+                response = client.post("/dashboard/_dash-update-component", json=payload)
+                assert response.status_code == 200, response.status_code
+
+            # the first render builds the run's derived artifacts, later ones hit the caches
+            results.append(measure(f"dash.render_{tab}.first", render, size, 1))
+            results.append(measure(f"dash.render_{tab}.warm", render, size, repeat))
+    return results
+
+
+# seconds a fresh worker may spend importing the web app, and the stacks it must leave to first use
+STARTUP_BUDGET = 1.0
+LAZY_PACKAGES = ("pandas", "pyarrow", "numpy", "scipy", "sklearn", "nltk", "selenium", "lxml")
+startup_probe = f"""
+import json, sys, time
+started = time.perf_counter()
+import wsgi
+print(json.dumps(dict(seconds=time.perf_counter() - started,
+                      eager=[name for name in {LAZY_PACKAGES!r} if name in sys.modules])))
+"""
+
+
+def bench_startup(repeat: int) -> list:
+    """
+    Import the web app in fresh interpreters, as a starting worker does. The interpreter's own
+    startup isn't counted.
+    """
+    reports = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-W", "ignore", "-c", startup_probe], capture_output=True,
+                                   text=True, cwd=repo_dir, check=True)
+        reports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    seconds = [report["seconds"] for report in reports]
+    eager = sorted({name for report in reports for name in report["eager"]})
+    result = dict(name="startup.import_wsgi", size=None, repeat=repeat, seconds=seconds, median=median(seconds),
+                  min=min(seconds), budget=STARTUP_BUDGET, eager_packages=eager,
+                  over_budget=median(seconds) > STARTUP_BUDGET or bool(eager))
+    print(f"{result['name']:<32} {'':>8} {result['median'] * 1000:>12.2f} ms"
+          + (f"  OVER BUDGET ({STARTUP_BUDGET * 1000:.0f} ms, eager: {', '.join(eager) or 'none'})"
+             if result["over_budget"] else ""))
+    return [result]
+
+
+CASES = ("parse", "html", "scrape", "storage", "catalog", "text", "search", "dash", "startup")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list, repeat: int = 3, only: list = None) -> dict:
+    """
+    Run the selected benchmark cases in a throwaway data folder.
+    :param sizes: synthetic run sizes (postings) for the size dependent cases
+    :param only: case names from CASES, all if None
+    :return: results document
+    """
+    cases = only or CASES
+    results = []
+    with TemporaryDirectory(prefix="jobseekr-bench-") as data_dir:
+        os.environ.update(DATA_DIR=data_dir, SCRAPER_RATE="1000", SCRAPER_BURST="1000",
+                          SCRAPER_INCREMENTAL="false")
+        os.environ.pop("PAGES", None)
+        if "parse" in cases:
+            results += bench_parse(sizes, repeat)
+        if "html" in cases:
+            results += bench_html(repeat)
+        if "scrape" in cases:
+            results += bench_scrape(repeat)
+        if "storage" in cases:
+            results += bench_storage(sizes, repeat)
+        if "catalog" in cases:
+            results += bench_catalog(repeat)
+        if "text" in cases:
+            results += bench_text(sizes, repeat)
+        if "search" in cases:
+            results += bench_search(sizes, repeat)
+        if "dash" in cases:
+            results += bench_dash(sizes, repeat)
+        if "startup" in cases:
+            results += bench_startup(repeat)
+    return dict(
+        created_at=datetime.now().isoformat(timespec="seconds"),
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        sizes=sizes,
+        results=results,
+    )
+
+
+def main(argv: list = None) -> Path:
+    parser = ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated synthetic run sizes, up to 100000")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per case")
+    parser.add_argument("--label", help="name of the results file, defaults to the git commit")
+    parser.add_argument("--only", help=f"comma separated cases out of {','.join(CASES)}")
+    args = parser.parse_args(argv)
+
+    document = run([int(size) for size in args.sizes.split(",")], args.repeat,
+                   args.only.split(",") if args.only else None)
+    results_dir.mkdir(exist_ok=True)
+    label = args.label or document["commit"] or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    out_path = results_dir / f"{label}.json"
+    out_path.write_text(json.dumps(document, indent=2), encoding="utf-8")
+    print(f"\nSaved results into {out_path}")
+    return out_path
+
+
+if __name__ == '__main__':
+    main()
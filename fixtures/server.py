@@ -0,0 +1,92 @@
+"""
+Local HTTP server that serves saved Indeed pages so the http backend can be exercised offline.
+
+Layout of a fixture directory:
+    search_<start>.html   results page returned for /jobs?...&start=<start> (start defaults to 0)
+    viewjob_<jk>.html     posting page returned for /viewjob?jk=<jk>
+
+Run standalone with `python -m fixtures.server [port]` and point INDEED_BASE_URL at it.
+"""
+
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+import sys
+
+default_fixture_dir = Path(__file__).parent / "indeed"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def __init__(self, *args, fixture_dir: Path, **kwargs):
+        self.fixture_dir = fixture_dir
+        super().__init__(*args, **kwargs)
+
+    def _fixture_file(self) -> Path:
+        """
+        Map a request path onto a fixture file.
+        :return: path of the fixture to serve, None if the route is unknown
+        """
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/jobs":
+            return self.fixture_dir / f"search_{int(query.get('start', ['0'])[0])}.html"
+        if url.path == "/viewjob" and "jk" in query:
+            return self.fixture_dir / f"viewjob_{query['jk'][0]}.html"
+        return None
+
+    def do_GET(self):
+        fixture = self._fixture_file()
+        if fixture is None or not fixture.is_file():
+            self.send_error(404)
+            return
+        body = fixture.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep benchmark and scraper output readable
+        pass
+
+
+class FixtureServer:
+
+    def __init__(self, fixture_dir: Path = default_fixture_dir, port: int = 0):
+        """
+        Threaded fixture server, usable as a context manager.
+        :param fixture_dir: directory holding the saved pages
+        :param port: port to bind on localhost, 0 picks a free one
+        """
+        handler = partial(FixtureHandler, fixture_dir=Path(fixture_dir))
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == '__main__':
+    server = FixtureServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f"Serving {default_fixture_dir} on {server.base_url}")
+    server.httpd.serve_forever()